@@ -1,29 +1,1044 @@
-import random
 import time
+import argparse
+import functools
+import hashlib
+import heapq
+import json
+import operator
+import os
+import struct
+import tempfile
+import tracemalloc
+import zipfile
 import pygame
 import sys
 import math
 import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 
 # 初始化pygame
 pygame.init()
 
-class SeasonalTree:
-    """季节模型：模拟树叶在春夏秋冬四季中的变化"""
+# 树几何缓存目录，可以用环境变量AIAGENTTREE_CACHE修改
+GEOMETRY_CACHE_DIR = os.environ.get(
+    'AIAGENTTREE_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'aiagenttree'))
+GEOMETRY_FORMAT_VERSION = 1  # 几何生成算法或文件格式变化时递增，使旧缓存失效
+SNAPSHOT_FORMAT_VERSION = 2  # 快照包含的状态或文件格式变化时递增，旧快照无法读取
+RECORDING_FORMAT_VERSION = 1  # 输入录制文件的格式版本
+
+def save_npz(path, **arrays):
+    """把数组写成未压缩的.npz（可以内存映射读取），先写临时文件再替换，多个进程同时写入也安全"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def load_npz(path, mmap=True):
+    """读取.npz文件；未压缩的数组成员直接内存映射到文件，不读入内存"""
+    arrays = {}
+    data = None  # 整个文件只映射一次，各数组是它的视图
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            if mmap and info.compress_type == zipfile.ZIP_STORED:
+                # 跳过zip本地文件头，定位到.npy数据
+                f.seek(info.header_offset)
+                local_header = f.read(30)
+                name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+                f.seek(info.header_offset + 30 + name_length + extra_length)
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+                if shape and not dtype.hasobject and np.prod(shape) > 0:
+                    if data is None:
+                        data = np.memmap(path, dtype=np.uint8, mode='r')
+                    arrays[name] = np.ndarray(shape, dtype=dtype, buffer=data, offset=f.tell(),
+                                              order='F' if fortran_order else 'C')
+                    continue
+            # 压缩的、标量或空数组直接读入
+            with archive.open(info) as member:
+                arrays[name] = np.lib.format.read_array(member, allow_pickle=False)
+    return arrays
+
+def pack_records(records):
+    """把字典列表按字段拆成列数组，元组字段（坐标）成为二维数组"""
+    if not records:
+        return {}
+    return {key: np.array([record[key] for record in records]) for key in records[0]}
+
+def unpack_records(columns, count):
+    """把pack_records()的列数组还原为字典列表"""
+    lists = {key: np.asarray(column).tolist() for key, column in columns.items()}
+    return [{key: tuple(values[i]) if isinstance(values[i], list) else values[i] for key, values in lists.items()}
+            for i in range(count)]
+
+class SurfaceCache:
+    """按键缓存已绘制好的表面，超出容量时淘汰最久未使用的条目（LRU）"""
     
-    def __init__(self):
-        # 窗口设置
-        self.width, self.height = 800, 600
-        pygame.display.init()  # 确保显示模块正确初始化
-        self.screen = pygame.display.set_mode((self.width, self.height))
-        pygame.display.set_caption("四季树叶变化模拟")
-        
-        # 确保字体模块初始化
-        pygame.font.init()
-        self.font = pygame.font.SysFont('SimHei', 24)  # 中文字体
-        self.small_font = pygame.font.SysFont('SimHei', 16)  # 小号字体用于显示环境信息
-        
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key, build):
+        """取出缓存的条目；未命中时调用build()生成并缓存"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        entry = build()
+        self.entries[key] = entry
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return entry
+    
+    def clear(self):
+        """清空缓存（计数保留）"""
+        self.entries.clear()
+    
+    def stats(self):
+        """返回命中统计"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+def map_colors(surface, colors):
+    """把(N, 3)的RGB数组向量化地转换为表面的像素值，相当于逐个调用map_rgb"""
+    colors = np.asarray(colors, dtype=np.uint32)
+    shifts, losses, masks = surface.get_shifts(), surface.get_losses(), surface.get_masks()
+    mapped = np.full(len(colors), masks[3], dtype=np.uint32)  # 不透明
+    for channel in range(3):
+        mapped |= ((colors[:, channel] >> losses[channel]) << shifts[channel]) & masks[channel]
+    return mapped
+
+def plot_points(surface, xs, ys, color):
+    """把一组像素点直接写入表面（向量化），超出表面的点被丢弃
+    
+    color可以是一个颜色，也可以是每个点一个颜色的(N, 3)数组。
+    """
+    width, height = surface.get_size()
+    xs = xs.astype(np.int32)
+    ys = ys.astype(np.int32)
+    # 负数按无符号比较会变成很大的数，一次比较同时完成上下界检查
+    inside = (xs.view(np.uint32) < width) & (ys.view(np.uint32) < height)
+    xs, ys = xs[inside], ys[inside]
+    per_point = np.ndim(color) == 2
+    if per_point:
+        color = np.asarray(color)[inside]
+    if surface.get_bytesize() == 3:
+        # 24位表面不支持pixels2d
+        pixels = pygame.surfarray.pixels3d(surface)
+        pixels[xs, ys] = color if per_point else color[:3]
+    else:
+        pixels = pygame.surfarray.pixels2d(surface)
+        pixels[xs, ys] = map_colors(surface, color) if per_point else surface.map_rgb(color)
+    del pixels  # 解锁表面
+
+class BufferedRandom:
+    """带缓冲区的随机数流：标量随机数从一次批量生成的缓冲区中按顺序取出，向量化抽样直接使用generator"""
+    
+    def __init__(self, generator, size=1024):
+        self.generator = generator
+        self.size = size
+        self.values = []
+        self.pos = 0
+    
+    def random(self):
+        """[0, 1)中的随机数"""
+        if self.pos >= len(self.values):
+            self.values = self.generator.random(self.size).tolist()
+            self.pos = 0
+        value = self.values[self.pos]
+        self.pos += 1
+        return value
+    
+    def uniform(self, low, high):
+        """[low, high)中的随机数"""
+        return low + (high - low) * self.random()
+    
+    def randint(self, low, high):
+        """[low, high]中的随机整数（与random.randint相同的闭区间）"""
+        return min(low + int(self.random() * (high - low + 1)), high)
+    
+    def get_state(self):
+        """返回(可以写成JSON的生成器状态和读取位置, 缓冲区中的随机数)"""
+        return ({'generator': self.generator.bit_generator.state, 'pos': self.pos},
+                np.array(self.values, dtype=np.float64))
+    
+    def set_state(self, state, values):
+        """恢复get_state()保存的状态，生成器对象保持不变（共享它的粒子系统等不受影响）"""
+        self.generator.bit_generator.state = state['generator']
+        self.values = np.asarray(values).tolist()
+        self.pos = state['pos']
+
+class RandomStreams:
+    """从一个主种子为每个子系统派生独立的随机数流
+    
+    模拟只使用geometry、weather、particles、wildlife和effects流，绘制只使用render流，
+    因此相同的种子无论绘制帧率如何都得到完全相同的模拟状态。
+    """
+    
+    NAMES = ('geometry', 'weather', 'particles', 'wildlife', 'effects', 'render')
+    
+    def __init__(self, seed=None):
+        sequence = np.random.SeedSequence(seed)
+        self.seed = sequence.entropy  # 没有指定种子时记录随机选取的种子，便于复现
+        for name, child in zip(self.NAMES, sequence.spawn(len(self.NAMES))):
+            setattr(self, name, BufferedRandom(np.random.Generator(np.random.PCG64(child))))
+    
+    def get_state(self):
+        """所有流的状态：返回(可以写成JSON的部分, 每个流缓冲区中的随机数)"""
+        meta = {'seed': self.seed}
+        values = {}
+        for name in self.NAMES:
+            meta[name], values[name] = getattr(self, name).get_state()
+        return meta, values
+    
+    def set_state(self, meta, values):
+        """恢复get_state()保存的状态"""
+        self.seed = meta['seed']
+        for name in self.NAMES:
+            getattr(self, name).set_state(meta[name], values[name])
+
+class StarField:
+    """星空：星星的位置、大小、闪烁速度和相位存放在NumPy数组中，亮度向量化计算后直接写入像素"""
+    
+    def __init__(self, rng=None):
+        self.rng = rng if rng is not None else np.random.default_rng()
+        # 不同半径星星的像素偏移，与pygame.draw.circle画出的形状一致
+        self.stamps = {}
+        for radius in (1, 2):
+            temp = pygame.Surface((radius * 2 + 3, radius * 2 + 3))
+            temp.fill((0, 0, 0))
+            pygame.draw.circle(temp, (255, 255, 255), (radius + 1, radius + 1), radius)
+            dx, dy = np.nonzero(pygame.surfarray.array_red(temp))
+            self.stamps[radius] = (dx - radius - 1, dy - radius - 1)
+        self.generate(0, 0, 0)
+    
+    def generate(self, count, width, height):
+        """在[0, width]×[0, height]范围内随机生成count颗星星"""
+        rng = self.rng
+        self.x = rng.integers(0, width + 1, count).astype(np.int32)
+        self.y = rng.integers(0, height + 1, count).astype(np.int32)
+        self.size = rng.uniform(0.8, 2.0, count)
+        # 为每颗星星分配不同的闪烁周期和初始相位，使闪烁看起来不同步
+        self.blink_speed = rng.uniform(0.01, 0.03, count)  # 更慢的闪烁速度
+        self.phase = rng.uniform(0, 2 * math.pi, count)    # 随机初相位
+        self.group_by_radius()
+    
+    def group_by_radius(self):
+        """和pygame.draw.circle一样把半径截断为整数（半径为0的星星画不出来），按半径预先分组"""
+        radius = self.size.astype(np.int32)
+        self.groups = [(r, np.flatnonzero(radius == r)) for r in self.stamps if (radius == r).any()]
+    
+    def get_state(self):
+        """可以保存到快照的数组"""
+        return {name: getattr(self, name) for name in ('x', 'y', 'size', 'blink_speed', 'phase')}
+    
+    def set_state(self, state):
+        """恢复get_state()保存的星星"""
+        for name, array in state.items():
+            setattr(self, name, np.array(array))
+        self.group_by_radius()
+    
+    def __len__(self):
+        return len(self.x)
+    
+    def brightness(self, frame):
+        """所有星星在某一帧的亮度（0.6-1.0）"""
+        # 使用正弦函数生成缓慢周期性的亮度变化，转换为0.6-1.0的亮度范围，使星星始终可见但亮度变化
+        return 0.6 + (np.sin(frame * self.blink_speed + self.phase) + 1) * 0.2
+    
+    def draw(self, surface, frame):
+        """按当前亮度把所有星星写入表面"""
+        level = (255 * self.brightness(frame)).astype(np.uint8)
+        for radius, index in self.groups:
+            dx, dy = self.stamps[radius]
+            colors = np.repeat(level[index], len(dx))
+            plot_points(surface,
+                        (self.x[index][:, None] + dx).ravel(),
+                        (self.y[index][:, None] + dy).ravel(),
+                        np.stack((colors, colors, colors), axis=1))
+
+class ParticleSystem:
+    """粒子系统：位置、速度和大小存放在预分配的NumPy数组中，发射使用固定容量的环形缓冲区"""
+    
+    ARRAYS = ('x', 'y', 'prev_x', 'prev_y', 'vx', 'vy', 'size', 'alive')
+    
+    def __init__(self, capacity, rng=None):
+        self.capacity = capacity
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.x = np.zeros(capacity, dtype=np.float32)
+        self.y = np.zeros(capacity, dtype=np.float32)
+        self.prev_x = np.zeros(capacity, dtype=np.float32)
+        self.prev_y = np.zeros(capacity, dtype=np.float32)
+        self.vx = np.zeros(capacity, dtype=np.float32)
+        self.vy = np.zeros(capacity, dtype=np.float32)
+        self.size = np.zeros(capacity, dtype=np.float32)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.head = 0  # 下一个写入位置
+        self.used = 0  # 曾经写入过的槽位数量，只需要处理前used个槽位
+    
+    def __len__(self):
+        return int(np.count_nonzero(self.alive[:self.used]))
+    
+    def emit(self, x, y, vx=0.0, vy=0.0, size=1.0):
+        """发射一批粒子；缓冲区满时覆盖最早的粒子"""
+        count = len(x)
+        if count == 0:
+            return
+        if count > self.capacity:
+            # 一次发射超过容量时只保留最后capacity个
+            x, y = x[-self.capacity:], y[-self.capacity:]
+            vx, vy, size = [v[-self.capacity:] if np.ndim(v) else v for v in (vx, vy, size)]
+            count = self.capacity
+        idx = (self.head + np.arange(count)) % self.capacity
+        self.x[idx] = x
+        self.y[idx] = y
+        self.prev_x[idx] = x
+        self.prev_y[idx] = y
+        self.vx[idx] = vx
+        self.vy[idx] = vy
+        self.size[idx] = size
+        self.alive[idx] = True
+        self.head = (self.head + count) % self.capacity
+        self.used = min(self.capacity, self.used + count)
+    
+    def integrate(self, dx=0.0, dy=0.0, dt=1):
+        """按速度（加上额外位移dx、dy，可以是标量或数组）推进所有粒子dt步，并记录上一步位置"""
+        n = self.used
+        self.prev_x[:n] = self.x[:n]
+        self.prev_y[:n] = self.y[:n]
+        self.x[:n] += (self.vx[:n] + dx) * dt
+        self.y[:n] += (self.vy[:n] + dy) * dt
+    
+    def cull_below(self, limit):
+        """移除落到limit以下的粒子"""
+        n = self.used
+        self.alive[:n] &= self.y[:n] < limit
+    
+    def clear(self):
+        """清空所有粒子"""
+        self.alive[:] = False
+        self.head = 0
+        self.used = 0
+    
+    def resize(self, capacity):
+        """修改容量（会清空现有粒子）"""
+        self.__init__(capacity, self.rng)
+    
+    def get_state(self):
+        """可以保存到快照的数组（只包含写入过的槽位）"""
+        n = self.used
+        state = {name: getattr(self, name)[:n] for name in self.ARRAYS}
+        state.update(capacity=np.int64(self.capacity), head=np.int64(self.head), used=np.int64(n))
+        return state
+    
+    def set_state(self, state):
+        """恢复get_state()保存的粒子"""
+        self.resize(int(state['capacity']))
+        n = int(state['used'])
+        for name in self.ARRAYS:
+            getattr(self, name)[:n] = state[name]
+        self.head = int(state['head'])
+        self.used = n
+    
+    def visible(self, alpha=1.0):
+        """返回存活粒子的插值位置和大小"""
+        n = self.used
+        alive = self.alive[:n]
+        px, py = self.prev_x[:n][alive], self.prev_y[:n][alive]
+        xs = px + (self.x[:n][alive] - px) * alpha
+        ys = py + (self.y[:n][alive] - py) * alpha
+        return xs, ys, self.size[:n][alive]
+
+class FallingLeafSystem:
+    """飘落叶子存储：所有属性存放在连续的NumPy数组中，统一生成、向量化更新、用掩码移除落地的叶子"""
+    
+    FIELDS = ('x', 'y', 'prev_x', 'prev_y', 'size', 'speed', 'swing', 'rotation', 'rotation_speed')
+    
+    def __init__(self, capacity=256, wind_sway=1.0, rng=None):
+        self.wind_sway = wind_sway  # 风引起的整体摆动系数，0表示不受风影响
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.count = 0
+        self.allocate(capacity)
+    
+    def allocate(self, capacity):
+        """分配（或扩大）数组，保留现有叶子"""
+        n = self.count
+        for name in self.FIELDS:
+            array = np.zeros(capacity, dtype=np.float32)
+            if n:
+                array[:n] = getattr(self, name)[:n]
+            setattr(self, name, array)
+        leaf_type = np.zeros(capacity, dtype=np.int8)
+        color = np.zeros((capacity, 3), dtype=np.uint8)
+        if n:
+            leaf_type[:n] = self.leaf_type[:n]
+            color[:n] = self.color[:n]
+        self.leaf_type = leaf_type
+        self.color = color
+        self.capacity = capacity
+    
+    def __len__(self):
+        return self.count
+    
+    def spawn(self, x, y, size, speed, swing, rotation, rotation_speed, leaf_type, color):
+        """生成一批飘落的叶子；标量参数会广播到每片叶子"""
+        x = np.atleast_1d(np.asarray(x, dtype=np.float32))
+        added = len(x)
+        if added == 0:
+            return
+        n = self.count
+        if n + added > self.capacity:
+            self.allocate(max(self.capacity * 2, n + added))
+        end = n + added
+        self.x[n:end] = x
+        self.y[n:end] = y
+        self.prev_x[n:end] = x
+        self.prev_y[n:end] = y
+        self.size[n:end] = size
+        self.speed[n:end] = speed
+        self.swing[n:end] = swing
+        self.rotation[n:end] = rotation
+        self.rotation_speed[n:end] = rotation_speed
+        self.leaf_type[n:end] = leaf_type
+        self.color[n:end] = color
+        self.count = end
+    
+    def update(self, sway, ground_level, dt=1):
+        """推进所有叶子dt步；sway为本步所有叶子共享的风摆动量"""
+        n = self.count
+        if n == 0:
+            return
+        self.prev_x[:n] = self.x[:n]
+        self.prev_y[:n] = self.y[:n]
+        self.x[:n] += (self.swing[:n] + sway * self.wind_sway) * dt
+        self.y[:n] += self.speed[:n] * dt
+        self.rotation[:n] = (self.rotation[:n] + self.rotation_speed[:n] * dt) % 360
+        
+        # 用掩码移除落地的叶子，剩下的叶子压缩到数组前部
+        keep = self.y[:n] < ground_level
+        kept = int(np.count_nonzero(keep))
+        if kept < n:
+            for name in self.FIELDS + ('leaf_type', 'color'):
+                array = getattr(self, name)
+                array[:kept] = array[:n][keep]
+            self.count = kept
+    
+    def clear(self):
+        """移除所有叶子"""
+        self.count = 0
+    
+    def get_state(self):
+        """可以保存到快照的数组（只包含现有的叶子）"""
+        n = self.count
+        state = {name: getattr(self, name)[:n] for name in self.FIELDS + ('leaf_type', 'color')}
+        state.update(capacity=np.int64(self.capacity), wind_sway=np.float64(self.wind_sway))
+        return state
+    
+    def set_state(self, state):
+        """恢复get_state()保存的叶子"""
+        n = len(state['x'])
+        self.wind_sway = float(state['wind_sway'])
+        self.count = 0
+        self.allocate(max(int(state['capacity']), n))
+        for name in self.FIELDS + ('leaf_type', 'color'):
+            getattr(self, name)[:n] = state[name]
+        self.count = n
+
+class LeafSlots:
+    """树上叶子的槽位分配器：每片叶子只记录它占用的叶子位置下标
+    
+    order数组的前count项是已占用的槽位，其余是空闲槽位；slot_index记录每个槽位在order中的下标，
+    因此占用或释放一个槽位都只需一次交换，增减k片叶子耗时O(k)，与槽位总数无关。
+    另外用一个按高度排序的堆记录已占用的槽位，按高度顺序掉落k片叶子耗时O(k log n)。
+    """
+    
+    def __init__(self, capacity=0, rng=None):
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.reset(capacity)
+    
+    def reset(self, capacity, heights=None):
+        """清空所有叶子，按新的槽位数量重建；heights为每个槽位的y坐标，决定掉落顺序"""
+        self.order = np.arange(capacity, dtype=np.int64)
+        self.slot_index = np.arange(capacity, dtype=np.int64)
+        self.size = np.zeros(capacity, dtype=np.float32)  # 每个槽位上叶子的大小
+        self.count = 0
+        
+        # 掉落顺序：按y坐标预先排序一次，rank越小越先掉落
+        if heights is None:
+            self.by_rank = np.arange(capacity, dtype=np.int64)
+        else:
+            self.by_rank = np.argsort(heights, kind='stable')
+        self.rank = np.empty(capacity, dtype=np.int64)
+        self.rank[self.by_rank] = np.arange(capacity)
+        # 堆中保存槽位的rank，被随机释放的槽位不立即删除，出堆时再跳过；每个槽位最多一项
+        self.heap = []
+        self.in_heap = np.zeros(capacity, dtype=bool)
+    
+    def __len__(self):
+        return self.count
+    
+    @property
+    def capacity(self):
+        return len(self.order)
+    
+    def occupied(self):
+        """所有已占用的槽位"""
+        return self.order[:self.count]
+    
+    def is_occupied(self, slots):
+        """逐个判断槽位是否已占用"""
+        return self.slot_index[slots] < self.count
+    
+    def _push(self, slot):
+        """把新占用的槽位加入掉落顺序堆（已在堆中的不重复加入）"""
+        if not self.in_heap[slot]:
+            self.in_heap[slot] = True
+            heapq.heappush(self.heap, int(self.rank[slot]))
+    
+    def _swap(self, i, j):
+        """交换order中的两项并更新反向索引"""
+        a, b = self.order[i], self.order[j]
+        self.order[i], self.order[j] = b, a
+        self.slot_index[a], self.slot_index[b] = j, i
+    
+    def take(self, slots):
+        """占用指定的槽位（已占用的忽略）"""
+        for slot in np.asarray(slots, dtype=np.int64).tolist():
+            i = int(self.slot_index[slot])
+            if i >= self.count:
+                self._swap(i, self.count)
+                self.count += 1
+                self._push(slot)
+    
+    def allocate(self, k):
+        """随机占用k个空闲槽位并返回它们（部分Fisher-Yates洗牌）"""
+        start = self.count
+        k = min(k, self.capacity - start)
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        picks = self.rng.integers(np.arange(start, start + k), self.capacity)
+        for offset, pick in enumerate(picks.tolist()):
+            self._swap(start + offset, pick)
+        self.count += k
+        allocated = self.order[start:self.count].copy()
+        for slot in allocated.tolist():
+            self._push(slot)
+        return allocated
+    
+    def release(self, slots):
+        """释放指定的槽位（空闲的忽略）"""
+        for slot in np.asarray(slots, dtype=np.int64).tolist():
+            i = int(self.slot_index[slot])
+            if i < self.count:
+                self._swap(i, self.count - 1)
+                self.count -= 1
+    
+    def release_random(self, k):
+        """随机释放k个已占用的槽位并返回它们"""
+        k = min(k, self.count)
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        picks = self.rng.integers(0, self.count - np.arange(k))
+        for pick in picks.tolist():
+            self._swap(pick, self.count - 1)
+            self.count -= 1
+        return self.order[self.count:self.count + k].copy()
+    
+    def get_state(self):
+        """可以保存到快照的数组"""
+        return {
+            'order': self.order, 'slot_index': self.slot_index, 'size': self.size,
+            'by_rank': self.by_rank, 'rank': self.rank, 'in_heap': self.in_heap,
+            'heap': np.array(self.heap, dtype=np.int64), 'count': np.int64(self.count)
+        }
+    
+    def set_state(self, state):
+        """恢复get_state()保存的槽位（数组会复制，快照文件可以是只读的内存映射）"""
+        for name in ('order', 'slot_index', 'size', 'by_rank', 'rank', 'in_heap'):
+            setattr(self, name, np.array(state[name]))
+        self.heap = np.asarray(state['heap']).tolist()  # 保持原来的堆顺序
+        self.count = int(state['count'])
+    
+    def release_lowest(self, k):
+        """按掉落顺序释放k个已占用的槽位并返回它们"""
+        released = []
+        while len(released) < k and self.heap:
+            slot = int(self.by_rank[heapq.heappop(self.heap)])
+            self.in_heap[slot] = False
+            i = int(self.slot_index[slot])
+            if i < self.count:  # 跳过已经被随机释放的槽位
+                self._swap(i, self.count - 1)
+                self.count -= 1
+                released.append(slot)
+        return np.array(released, dtype=np.int64)
+
+class LeafGrid:
+    """叶子位置的均匀网格索引，用于查询某个圆形区域或线段附近的槽位
+    
+    槽位（及其坐标）按所在网格排序后连续存放，cell_start[c]是第c个网格在order中的起点，
+    同一行相邻网格的槽位也是连续的，因此查询一个矩形范围时每行只需一次切片。
+    """
+    
+    def __init__(self, positions=None, cell=16):
+        self.cell = cell
+        self.build(np.zeros((0, 2)) if positions is None else positions)
+    
+    def build(self, positions):
+        """按叶子位置重建网格"""
+        positions = np.asarray(positions, dtype=np.float64)
+        if len(positions):
+            self.origin = np.floor(positions.min(axis=0))
+            self.cols, self.rows = (((positions.max(axis=0) - self.origin) // self.cell).astype(np.int64) + 1).tolist()
+        else:
+            self.origin = np.zeros(2)
+            self.cols = self.rows = 0
+        cells = self.cell_of(positions[:, 0], positions[:, 1])
+        self.order = np.argsort(cells, kind='stable')
+        self.cell_start = np.searchsorted(cells[self.order], np.arange(self.rows * self.cols + 1))
+        self.xs = np.ascontiguousarray(positions[self.order, 0], dtype=np.float32)
+        self.ys = np.ascontiguousarray(positions[self.order, 1], dtype=np.float32)
+    
+    def cell_of(self, xs, ys):
+        """叶子位置所在网格的编号"""
+        cx = ((xs - self.origin[0]) // self.cell).astype(np.int64)
+        cy = ((ys - self.origin[1]) // self.cell).astype(np.int64)
+        return cy * self.cols + cx
+    
+    def candidates(self, left, top, right, bottom):
+        """与矩形范围重叠的网格中的所有槽位，返回(槽位, x坐标, y坐标)"""
+        ox, oy = self.origin.tolist()
+        cx0, cy0 = max(int((left - ox) // self.cell), 0), max(int((top - oy) // self.cell), 0)
+        cx1, cy1 = min(int((right - ox) // self.cell), self.cols - 1), min(int((bottom - oy) // self.cell), self.rows - 1)
+        if cx0 > cx1 or cy0 > cy1:
+            empty = np.zeros(0, dtype=np.float32)
+            return np.zeros(0, dtype=np.int64), empty, empty
+        start = self.cell_start
+        spans = [slice(start[row * self.cols + cx0], start[row * self.cols + cx1 + 1]) for row in range(cy0, cy1 + 1)]
+        return (np.concatenate([self.order[span] for span in spans]),
+                np.concatenate([self.xs[span] for span in spans]),
+                np.concatenate([self.ys[span] for span in spans]))
+    
+    def query_radius(self, x, y, radius):
+        """距离(x, y)不超过radius的所有槽位"""
+        slots, xs, ys = self.candidates(x - radius, y - radius, x + radius, y + radius)
+        dx, dy = xs - x, ys - y
+        return slots[dx * dx + dy * dy <= radius * radius]
+    
+    def query_segment(self, start, end, radius):
+        """距离线段start-end不超过radius的所有槽位"""
+        (x1, y1), (x2, y2) = start, end
+        slots, xs, ys = self.candidates(min(x1, x2) - radius, min(y1, y2) - radius,
+                                        max(x1, x2) + radius, max(y1, y2) + radius)
+        # 投影到线段上的最近点
+        dx, dy = xs - x1, ys - y1
+        ux, uy = x2 - x1, y2 - y1
+        length2 = ux * ux + uy * uy
+        t = np.clip((dx * ux + dy * uy) / length2, 0, 1) if length2 else 0
+        dx, dy = dx - t * ux, dy - t * uy
+        return slots[dx * dx + dy * dy <= radius * radius]
+    
+    def query_path(self, points, radius):
+        """距离折线不超过radius的所有槽位（不重复）"""
+        if len(points) < 2:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate([self.query_segment(a, b, radius) for a, b in zip(points, points[1:])]))
+
+class CanopyLayer:
+    """树冠烘焙层：树叶绘制在8位调色板表面上，颜色变化只修改调色板"""
+    
+    TRANSPARENT_INDEX = 0  # 透明（颜色键）
+    LEAF_INDEX = 1         # 树叶颜色
+    
+    def __init__(self, rect):
+        # 树冠在屏幕上的区域
+        self.rect = pygame.Rect(rect)
+        self.surface = pygame.Surface(self.rect.size, 0, 8)
+        self.surface.set_palette_at(self.TRANSPARENT_INDEX, (0, 0, 0))
+        self.surface.set_colorkey(self.TRANSPARENT_INDEX)
+        self.surface.fill(self.TRANSPARENT_INDEX)
+        
+        # 每个像素被多少片叶子覆盖，移除叶子时不需要重绘相邻叶子
+        self.coverage = np.zeros(self.rect.size, dtype=np.uint16)
+        self.stamps = {}  # (叶子类型, 量化尺寸) -> (掩码, 中心偏移)
+        self.color = None
+        self.damage = [self.rect.copy()]  # 内容变化过的屏幕区域，供脏矩形渲染使用
+    
+    def get_stamp(self, leaf_type, size):
+        """获取叶子形状掩码，形状与逐片绘制时一致"""
+        key = (leaf_type, int(round(size * 4)))
+        stamp = self.stamps.get(key)
+        if stamp is None:
+            size = key[1] / 4
+            radius = int(math.ceil(size * 1.6)) + 2
+            temp = pygame.Surface((radius * 2 + 1, radius * 2 + 1))
+            temp.fill((0, 0, 0))
+            white = (255, 255, 255)
+            x = y = radius
+            if leaf_type == 0:  # 圆形
+                pygame.draw.circle(temp, white, (x, y), int(size))
+            elif leaf_type == 1:  # 椭圆形
+                ellipse_rect = pygame.Rect(int(x - size*1.2), int(y - size*0.8), int(size*2.4), int(size*1.6))
+                pygame.draw.ellipse(temp, white, ellipse_rect)
+            else:  # 簇状
+                for j in range(3):
+                    angle = j * (2*math.pi/3)
+                    offset_x = math.cos(angle) * size * 0.6
+                    offset_y = math.sin(angle) * size * 0.6
+                    pygame.draw.circle(temp, white, (int(x + offset_x), int(y + offset_y)), int(size*0.7))
+            mask = pygame.surfarray.array_red(temp) > 0
+            stamp = (mask.astype(np.uint16), radius)
+            self.stamps[key] = stamp
+        return stamp
+    
+    def apply(self, leaves, delta):
+        """把一批叶子加入（delta=1）或移出（delta=-1）覆盖计数，并只刷新受影响的像素"""
+        if not leaves:
+            return
+        width, height = self.rect.size
+        pixels = pygame.surfarray.pixels2d(self.surface)
+        for leaf in leaves:
+            x, y, size, leaf_type = leaf[:4]
+            mask, radius = self.get_stamp(leaf_type, size)
+            x0 = int(x) - radius - self.rect.x
+            y0 = int(y) - radius - self.rect.y
+            # 裁剪到树冠区域
+            mx0, my0 = max(0, -x0), max(0, -y0)
+            x1 = min(width, x0 + mask.shape[0])
+            y1 = min(height, y0 + mask.shape[1])
+            x0, y0 = max(0, x0), max(0, y0)
+            if x0 >= x1 or y0 >= y1:
+                continue
+            region = self.coverage[x0:x1, y0:y1]
+            part = mask[mx0:mx0 + (x1 - x0), my0:my0 + (y1 - y0)]
+            if delta > 0:
+                region += part
+            else:
+                region -= np.minimum(part, region)
+            pixels[x0:x1, y0:y1] = np.where(region > 0, self.LEAF_INDEX, self.TRANSPARENT_INDEX)
+            self.damage.append(pygame.Rect(self.rect.x + x0, self.rect.y + y0, x1 - x0, y1 - y0))
+        del pixels  # 解锁表面
+    
+    def add_leaves(self, leaves):
+        """烘焙新增的叶子"""
+        self.apply(leaves, 1)
+    
+    def remove_leaves(self, leaves):
+        """擦除被移除的叶子"""
+        self.apply(leaves, -1)
+    
+    def clear(self):
+        """清空树冠"""
+        self.coverage.fill(0)
+        self.surface.fill(self.TRANSPARENT_INDEX)
+        self.damage.append(self.rect.copy())
+    
+    def set_color(self, color):
+        """修改树叶颜色，只更新调色板"""
+        if color != self.color:
+            self.surface.set_palette_at(self.LEAF_INDEX, color)
+            self.color = color
+            self.damage.append(self.rect.copy())
+    
+    def take_damage(self):
+        """返回上次绘制以来内容发生变化的屏幕区域，并清空记录"""
+        damage, self.damage = self.damage, []
+        return damage
+    
+    def draw(self, screen):
+        """一次blit绘制整个树冠"""
+        screen.blit(self.surface, self.rect.topleft)
+        self.damage = []  # 整个树冠已经绘制，之前记录的变化区域不再需要
+
+class DirtyTiles:
+    """脏矩形记录：受损区域标记在粗粒度的网格上，重叠区域自动合并，矩形数量有上限"""
+    
+    def __init__(self, width, height, tile=16):
+        self.tile = tile
+        self.bounds = pygame.Rect(0, 0, width, height)
+        self.cols = (width + tile - 1) // tile
+        self.rows = (height + tile - 1) // tile
+        self.tiles = np.zeros((self.rows, self.cols), dtype=bool)
+        # 每个网格在屏幕内的实际面积（边缘网格可能不完整），用于计算重绘比例
+        widths = np.minimum(tile, width - np.arange(self.cols) * tile)
+        heights = np.minimum(tile, height - np.arange(self.rows) * tile)
+        self.tile_area = heights[:, None] * widths[None, :]
+    
+    def clear(self):
+        self.tiles.fill(False)
+    
+    def tile_range(self, rect):
+        """矩形覆盖的网格范围(行起, 行止, 列起, 列止)，完全在屏幕外时返回None"""
+        rect = pygame.Rect(rect).clip(self.bounds)
+        if rect.width <= 0 or rect.height <= 0:
+            return None
+        return (rect.top // self.tile, (rect.bottom - 1) // self.tile + 1,
+                rect.left // self.tile, (rect.right - 1) // self.tile + 1)
+    
+    def add(self, rect):
+        """标记一个矩形区域"""
+        span = self.tile_range(rect)
+        if span is not None:
+            r0, r1, c0, c1 = span
+            self.tiles[r0:r1, c0:c1] = True
+    
+    def add_boxes(self, x0, y0, x1, y1):
+        """向量化地标记一批小矩形，坐标为[x0, x1)×[y0, y1)的数组"""
+        x0, y0, x1, y1 = (np.asarray(v, dtype=np.float64).ravel() for v in (x0, y0, x1, y1))
+        inside = (x1 > 0) & (y1 > 0) & (x0 < self.bounds.width) & (y0 < self.bounds.height) & (x1 > x0) & (y1 > y0)
+        if not inside.any():
+            return
+        c0 = np.clip(x0[inside] // self.tile, 0, self.cols - 1).astype(np.int64)
+        r0 = np.clip(y0[inside] // self.tile, 0, self.rows - 1).astype(np.int64)
+        c1 = np.clip((np.ceil(x1[inside]) - 1) // self.tile, 0, self.cols - 1).astype(np.int64)
+        r1 = np.clip((np.ceil(y1[inside]) - 1) // self.tile, 0, self.rows - 1).astype(np.int64)
+        # 每个矩形最多跨越几个网格，按跨度逐格标记（小矩形只需要很少几次）
+        for dr in range(int((r1 - r0).max()) + 1):
+            rows = np.minimum(r0 + dr, r1)
+            for dc in range(int((c1 - c0).max()) + 1):
+                self.tiles[rows, np.minimum(c0 + dc, c1)] = True
+    
+    def any_in(self, rect):
+        """矩形区域内是否有受损的网格"""
+        span = self.tile_range(rect)
+        if span is None:
+            return False
+        r0, r1, c0, c1 = span
+        return bool(self.tiles[r0:r1, c0:c1].any())
+    
+    def rects(self):
+        """把受损网格合并成矩形列表：每行连续的网格合为一段，上下相同的段继续合并"""
+        padded = np.zeros((self.rows, self.cols + 2), dtype=np.int8)
+        padded[:, 1:-1] = self.tiles
+        edges = np.diff(padded, axis=1)
+        # 每行的起点和终点按行优先顺序一一对应
+        rows, starts = np.nonzero(edges == 1)
+        ends = np.nonzero(edges == -1)[1]
+        boxes = []
+        open_runs = {}  # (起始列, 结束列) -> 最近一个这样的段所在的矩形
+        for row, start, end in zip(rows.tolist(), starts.tolist(), ends.tolist()):
+            box = open_runs.get((start, end))
+            if box is not None and box[3] == row:
+                box[3] = row + 1
+            else:
+                box = [start, row, end, row + 1]
+                boxes.append(box)
+                open_runs[(start, end)] = box
+        t = self.tile
+        return [pygame.Rect(c0 * t, r0 * t, (c1 - c0) * t, (r1 - r0) * t).clip(self.bounds)
+                for c0, r0, c1, r1 in boxes]
+    
+    def coverage(self):
+        """受损区域占整个屏幕的比例"""
+        return float(self.tile_area[self.tiles].sum()) / (self.bounds.width * self.bounds.height)
+
+class TraceRecorder:
+    """性能追踪记录器：阶段耗时和计数器记录在固定容量的环形缓冲区中，可以长时间开启，随时导出为trace-event JSON
+    
+    每个阶段记录为一个完整事件（开始时间和持续时间），追踪查看器按时间范围自动嵌套；
+    缓冲区写满后覆盖最早的事件。
+    """
+    
+    def __init__(self, capacity=262144, counter_capacity=65536):
+        if capacity <= 0 or counter_capacity <= 0:
+            raise ValueError(f"追踪缓冲区容量必须是正整数: {capacity}, {counter_capacity}")
+        self.origin = time.perf_counter()
+        self.names = []      # 事件名称表
+        self.name_ids = {}   # 名称 -> 编号
+        self.span_name = np.zeros(capacity, dtype=np.int32)
+        self.span_start = np.zeros(capacity)     # 秒，相对origin
+        self.span_duration = np.zeros(capacity)
+        self.span_count = 0  # 写入过的事件总数
+        self.counter_name = np.zeros(counter_capacity, dtype=np.int32)
+        self.counter_time = np.zeros(counter_capacity)
+        self.counter_value = np.zeros(counter_capacity)
+        self.counter_count = 0
+    
+    def name_id(self, name):
+        """名称对应的编号"""
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+    
+    def span(self, name, start, duration):
+        """记录一个阶段，start为time.perf_counter()的值"""
+        index = self.span_count % len(self.span_name)
+        self.span_name[index] = self.name_id(name)
+        self.span_start[index] = start - self.origin
+        self.span_duration[index] = duration
+        self.span_count += 1
+    
+    def counters(self, values):
+        """记录一组计数器（名称 -> 数值）在当前时刻的值"""
+        now = time.perf_counter() - self.origin
+        capacity = len(self.counter_name)
+        for name, value in values.items():
+            index = self.counter_count % capacity
+            self.counter_name[index] = self.name_id(name)
+            self.counter_time[index] = now
+            self.counter_value[index] = value
+            self.counter_count += 1
+    
+    def __len__(self):
+        return min(self.span_count, len(self.span_name))
+    
+    def events(self):
+        """把缓冲区中的事件按时间顺序转换为trace-event格式（时间单位为微秒）"""
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': 1, 'tid': 1, 'args': {'name': '四季树叶变化模拟'}}]
+        n = len(self)
+        order = (self.span_count - n + np.arange(n)) % len(self.span_name)
+        order = order[np.argsort(self.span_start[order], kind='stable')]  # 阶段在结束时写入，导出前按开始时间排序
+        for name_id, start, duration in zip(self.span_name[order].tolist(), (self.span_start[order] * 1e6).tolist(),
+                                            (self.span_duration[order] * 1e6).tolist()):
+            events.append({'name': self.names[name_id], 'ph': 'X', 'ts': start, 'dur': duration,
+                           'pid': 1, 'tid': 1})
+        n = min(self.counter_count, len(self.counter_name))
+        order = (self.counter_count - n + np.arange(n)) % len(self.counter_name)
+        for name_id, timestamp, value in zip(self.counter_name[order].tolist(), (self.counter_time[order] * 1e6).tolist(),
+                                             self.counter_value[order].tolist()):
+            name = self.names[name_id]
+            events.append({'name': name, 'ph': 'C', 'ts': timestamp, 'pid': 1, 'args': {name: value}})
+        return events
+    
+    def write(self, path):
+        """导出为可以在chrome://tracing或Perfetto中打开的JSON文件"""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': self.events(), 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+
+class FrameProfiler:
+    """帧性能分析器：累计每帧中各阶段（用@profiled标记的方法）的耗时，保留最近history帧用于计算滚动分位数"""
+    
+    def __init__(self, history=300):
+        self.history = history
+        self.enabled = True
+        self.samples = {}        # 阶段名 -> 最近history帧中每帧的累计耗时（秒，环形数组）
+        self.frame_samples = np.zeros(history)  # 每帧总耗时
+        self.top_level = []      # 出现过的顶层阶段（按首次出现的顺序），用于堆叠图
+        self.current = {}        # 本帧各阶段的累计耗时
+        self.depth = 0           # 当前嵌套深度
+        self.frames = 0          # 已完成的帧数
+        self.frame_start = time.perf_counter()
+        self.in_frame = False    # 只有帧内的顶层阶段才出现在堆叠图中
+        self.tracer = None       # 设置TraceRecorder后，每个阶段同时记录到时间线
+    
+    def begin(self, name):
+        """进入一个阶段，返回开始时间"""
+        self.depth += 1
+        return time.perf_counter()
+    
+    def end(self, name, start):
+        """离开一个阶段，把耗时计入本帧"""
+        elapsed = time.perf_counter() - start
+        self.depth -= 1
+        self.current[name] = self.current.get(name, 0.0) + elapsed
+        if self.depth == 0 and self.in_frame and name not in self.top_level:
+            self.top_level.append(name)
+        if self.tracer is not None:
+            self.tracer.span(name, start, elapsed)
+    
+    def begin_frame(self):
+        """开始新的一帧（丢弃帧外记录的耗时）"""
+        self.current = {}
+        self.in_frame = True
+        self.frame_start = time.perf_counter()
+    
+    def end_frame(self):
+        """结束本帧，把各阶段耗时写入环形数组"""
+        index = self.frames % self.history
+        self.frame_samples[index] = time.perf_counter() - self.frame_start
+        if self.tracer is not None:
+            self.tracer.span('run', self.frame_start, self.frame_samples[index])
+        current = self.current
+        for name in current:
+            if name not in self.samples:
+                self.samples[name] = np.zeros(self.history)
+        for name, samples in self.samples.items():
+            samples[index] = current.get(name, 0.0)
+        self.current = {}
+        self.in_frame = False
+        self.frames += 1
+    
+    def recent(self, samples, count=None):
+        """按时间顺序取出环形数组中最近count帧（默认全部有效帧）的数据"""
+        valid = min(self.frames, self.history)
+        count = valid if count is None else min(count, valid)
+        return samples[(self.frames - count + np.arange(count)) % self.history]
+    
+    def percentiles(self, name=None):
+        """某个阶段（为None时为整帧）最近各帧耗时的p50/p95/p99（毫秒）"""
+        samples = self.frame_samples if name is None else self.samples[name]
+        recent = self.recent(samples)
+        if len(recent) == 0:
+            return (0.0, 0.0, 0.0)
+        return tuple((np.percentile(recent, (50, 95, 99)) * 1000).tolist())
+
+def profiled(method):
+    """把方法标记为性能分析的一个阶段（阶段名为方法名），分析器关闭时直接调用"""
+    name = method.__name__
+    
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        profiler = self.profiler
+        if not profiler.enabled:
+            return method(self, *args, **kwargs)
+        start = profiler.begin(name)
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            profiler.end(name, start)
+    return wrapper
+
+class Environment:
+    """共用的环境：模拟时钟、季节、时间、天气、风、云和降水粒子、天空
+
+    场景中的主树和背景森林都读取同一个环境，每棵树只保存自己的位置、几何和叶子状态。
+    """
+
+    # SeasonalTree上的同名属性转发到环境
+    FIELDS = (
+        # 模拟时钟
+        'animation_frame', 'tick_count', 'sim_time_ms', 'last_time_update', 'time_elapsed', 'tick_ms',
+        'tick_scale', 'tick_carry',
+        # 季节和时间
+        'seasons', 'current_season', 'current_day', 'days_per_season', 'season_duration', 'day_update_interval',
+        'current_time', 'time_speed',
+        # 天气和风
+        'temperature', 'humidity', 'wind_strength', 'precipitation', 'weather_conditions', 'current_weather',
+        'weather_duration', 'weather_probs',
+        # 云和降水粒子
+        'clouds', 'cloud_density', 'max_raindrops', 'max_snowflakes', 'rain_emit_rate', 'snow_emit_rate',
+        'raindrops', 'snowflakes',
+        # 天空和天体
+        'sky_colors', 'current_sky_color', 'sky_time_steps', 'sky_gradient', 'sky_table', 'star_field',
+        'sun_pos', 'moon_pos', 'prev_sun_pos', 'prev_moon_pos', 'sun_radius', 'moon_radius', 'sun_color', 'moon_color'
+    )
+
+    def __init__(self, streams):
         # 季节定义
         self.seasons = ["春", "夏", "秋", "冬"]
         self.current_season = 0
@@ -31,14 +1046,22 @@ class SeasonalTree:
         self.days_per_season = 90  # 每个季节90天
         self.season_duration = 7500  # 每个季节持续7.5秒
         self.day_update_interval = int(self.season_duration / self.days_per_season)  # 计算天数更新间隔
-        
+
         # 时间和日期
         self.current_time = 12  # 当前时间（小时）
         self.time_speed = 0.05  # 时间流逝速度
-        self.last_time_update = pygame.time.get_ticks()
+
+        # 模拟时钟：每次update()推进固定的毫秒数，不依赖真实时间
+        self.tick_ms = self.day_update_interval // 2  # 每个模拟步长对应的毫秒数
+        self.tick_scale = 1    # 步长相对默认步长的倍数（dt），每步的位移、数量和概率按它缩放
+        self.tick_carry = {}   # 按步长缩放后不足一个的数量，留到下一步
+        self.sim_time_ms = 0   # 模拟时钟（毫秒）
+        self.tick_count = 0    # 已执行的模拟步数
+        self.last_time_update = self.sim_time_ms
         self.time_elapsed = 0  # 用于时间更新
-        
-        # 环境参数
+        self.animation_frame = 0
+
+        # 天气参数
         self.temperature = 15  # 初始温度
         self.humidity = 60     # 初始湿度
         self.wind_strength = 0  # 风力
@@ -46,6 +1069,134 @@ class SeasonalTree:
         self.weather_conditions = ["晴朗", "多云", "雨", "雪", "雷暴"]
         self.current_weather = 0  # 默认晴朗
         self.weather_duration = 0  # 天气持续时间
+        # 每个季节的天气概率（晴朗、多云、雨、雪、雷暴）
+        self.weather_probs = [
+            [0.6, 0.3, 0.1, 0.0, 0.0],  # 春天：主要晴朗和多云，偶尔有雨
+            [0.7, 0.2, 0.1, 0.0, 0.0],  # 夏天：更多晴朗，偶尔有雨
+            [0.4, 0.4, 0.2, 0.0, 0.0],  # 秋天：更多多云和雨
+            [0.3, 0.3, 0.1, 0.3, 0.1]   # 冬天：有雪
+        ]
+
+        # 云和降水粒子
+        self.clouds = []
+        self.cloud_density = 1.0  # 云量倍数，阴天可以调到上百朵云
+        self.max_raindrops = 500      # 雨滴容量，可以调到十万以上
+        self.max_snowflakes = 200     # 雪花容量
+        self.rain_emit_rate = 10      # 每步生成的雨滴数
+        self.snow_emit_rate = 2       # 每步生成的雪花数
+        self.raindrops = ParticleSystem(self.max_raindrops, rng=streams.particles.generator)
+        self.snowflakes = ParticleSystem(self.max_snowflakes, rng=streams.particles.generator)
+
+        # 昼夜循环
+        self.sky_colors = {
+            "dawn": (255, 200, 170),    # 黎明
+            "day": (135, 206, 235),     # 白天
+            "dusk": (255, 150, 100),    # 黄昏
+            "night": (25, 25, 50)       # 夜晚
+        }
+        self.current_sky_color = self.sky_colors["day"]
+
+        # 天空查找表由场景按(季节, 天气, 量化时间)生成
+        self.sky_time_steps = 20       # 每小时的量化步数（与时间流逝速度0.05小时一致）
+        self.sky_gradient = False      # 天空背景是否使用竖直渐变
+        self.sky_table = None
+        self.star_field = StarField(rng=streams.geometry.generator)
+
+        # 天体
+        self.sun_pos = (0, 0)
+        self.moon_pos = (0, 0)
+        self.prev_sun_pos = self.sun_pos
+        self.prev_moon_pos = self.moon_pos
+        self.sun_radius = 30
+        self.moon_radius = 25
+        self.sun_color = (255, 255, 0)
+        self.moon_color = (200, 200, 200)
+
+def forward_environment(cls):
+    """类装饰器：把Environment.FIELDS中的每个字段做成转发到self.environment的属性（读取用C实现的attrgetter）"""
+    def setter(name):
+        return lambda self, value: setattr(self.environment, name, value)
+    for name in Environment.FIELDS:
+        setattr(cls, name, property(operator.attrgetter('environment.' + name), setter(name)))
+    return cls
+
+# 快照中保存的标量模拟状态（写入JSON）
+SNAPSHOT_SCALARS = (
+    # 模拟时钟和季节
+    'animation_frame', 'tick_count', 'sim_time_ms', 'last_time_update', 'tick_ms', 'tick_rate',
+    'tick_scale', 'tick_carry',
+    'current_day', 'days_per_season', 'season_duration', 'day_update_interval', 'current_season',
+    'current_time', 'time_speed', 'paused',
+    # 天气
+    'current_weather', 'weather_duration', 'weather_probs', 'precipitation', 'temperature', 'humidity',
+    'wind_strength', 'cloud_density', 'rain_emit_rate', 'snow_emit_rate', 'max_raindrops', 'max_snowflakes',
+    # 叶子和颜色
+    'leaf_count', 'target_leaf_count', 'max_leaf_count', 'leaf_size', 'leaf_transition_speed', 'leaf_spawn_rate',
+    'leaf_color', 'current_leaf_color', 'target_leaf_color', 'trunk_color', 'shake_radius',
+    # 天体
+    'sun_color', 'moon_color', 'sun_pos', 'moon_pos', 'prev_sun_pos', 'prev_moon_pos',
+    # 闪电
+    'lightning_active', 'lightning_timer', 'lightning_cooldown', 'lightning_strike_pos', 'lightning_chance',
+    'lightning_duration', 'lightning_char_radius',
+    # 树形
+    'tree_seed', 'tree_shape', 'trunk_x', 'trunk_base_y', 'trunk_height'
+)
+# 快照中有get_state()/set_state()的子系统
+SNAPSHOT_SYSTEMS = ('leaf_slots', 'falling_leaves', 'black_leaves', 'raindrops', 'snowflakes')
+# 快照中按列保存的字典列表
+SNAPSHOT_RECORDS = ('clouds', 'insects', 'birds', 'grass_blades')
+
+@forward_environment
+class SeasonalTree:
+    """季节模型：模拟树叶在春夏秋冬四季中的变化"""
+    
+    def __init__(self, headless=False, tree_seed=None, seed=None, tree_shape=None):
+        # 窗口设置
+        self.width, self.height = 800, 600
+        
+        # 每个子系统独立的随机数流，都由主种子派生；seed为None时每次运行不同
+        self.streams = RandomStreams(seed)
+        
+        # 时间、季节、天气、风、降水粒子和天空保存在共用的环境中，下面同名的属性都转发到这里
+        self.environment = Environment(self.streams)
+        
+        # 性能分析：记录每帧各阶段耗时，按F3显示/隐藏性能面板（无界面模式默认关闭）
+        self.profiler = FrameProfiler()
+        self.profiler.enabled = not headless
+        self.show_profiler = False
+        self.profiler_panel = None       # 性能面板的文字部分，每隔profiler_refresh帧更新一次
+        self.profiler_panel_frame = -1
+        self.profiler_refresh = 30
+        self.trace_recorder = None  # 追踪记录器，start_trace()之后才创建
+        self.trace_path = None
+        self.snapshot_path = 'snapshot.npz'  # F5保存、F9恢复快照的文件
+        
+        # 用户命令在模拟步的边界执行，可以按步数录制和回放
+        self.command_queue = []       # 等待执行的(命令, 参数)
+        self.input_log = None         # 录制时为[(步数, 命令, 参数), ...]
+        self.recording_path = None
+        self.recording_options = None
+        self.recording_start = 0
+        self.replay_commands = None   # 回放时为{步数: [(命令, 参数), ...]}
+        self.replay_end = None        # 回放时录制结束的步数，实时回放到这一步停止
+        self.replay_digest = None     # 录制结束时的状态哈希
+        
+        # 无界面模式：不创建窗口和字体，只按模拟时钟推进状态
+        self.headless = headless
+        self.verbose = not headless  # 无界面长时间运行时不打印季节切换信息
+        if headless:
+            self.screen = None
+            self.font = None
+            self.small_font = None
+        else:
+            pygame.display.init()  # 确保显示模块正确初始化
+            self.screen = pygame.display.set_mode((self.width, self.height))
+            pygame.display.set_caption("四季树叶变化模拟")
+            
+            # 确保字体模块初始化
+            pygame.font.init()
+            self.font = pygame.font.SysFont('SimHei', 24)  # 中文字体
+            self.small_font = pygame.font.SysFont('SimHei', 16)  # 小号字体用于显示环境信息
         
         # 地面和土壤相关参数
         self.ground_level = self.height - 180  # 更进一步提高地面位置，确保树木完全显示
@@ -59,9 +1210,61 @@ class SeasonalTree:
         self.trunk_base_y = self.ground_level  # 树干基部y坐标（紧贴地面）
         self.trunk_height = 180  # 设置固定高度，确保树干不会太高
         self.branches = []  # 存储树枝
-        
-        # 生成树枝结构
-        self.generate_branches()
+        self.branch_version = 0  # 树枝几何版本号，变化时缓存的树层失效
+        
+        # 树形参数：和种子一起决定树枝与叶子位置，相同参数的几何缓存在磁盘上复用
+        self.tree_seed = tree_seed  # 为None时每次随机生成且不缓存
+        self.geometry_cache_dir = GEOMETRY_CACHE_DIR
+        self.geometry_path = None   # 当前几何对应的缓存文件
+        self.tree_shape = {
+            'max_depth': 5,                                   # 分形递归的最大深度，避免树过于复杂
+            'trunk_thickness': 25,                            # 主干粗细
+            'inner_depth': 3,                                 # 小于该深度的分支为次级分支
+            'trunk_branch_count': (4, 4),                     # 主干分支数量，避免过于拥挤
+            'inner_branch_count': (2, 3),                     # 次级分支数量
+            'outer_branch_count': (1, 2),                     # 末端分支数量
+            'trunk_length_range': (0.55, 0.65),               # 主干分支更短一些，使树更矮
+            'inner_length_range': (0.5, 0.65),
+            'outer_length_range': (0.4, 0.6),
+            'trunk_angle_range': (-math.pi/4, math.pi/4),     # 适当增加角度范围，使树更宽
+            'inner_angle_range': (-math.pi/4.5, math.pi/4.5),
+            'outer_angle_range': (-math.pi/4, math.pi/4),
+            'leaf_density': 1                                 # 每个采样点的叶子数量倍数
+        }
+        # tree_shape覆盖部分树形参数，必须在生成几何之前设置，几何缓存的键也随之变化
+        for key, value in (tree_shape or {}).items():
+            if key not in self.tree_shape:
+                raise ValueError(f"未知的树形参数: {key}")
+            self.tree_shape[key] = tuple(value) if isinstance(value, list) else value  # JSON中的范围是列表
+        
+        # 背景森林：所有树共用同一个环境，每棵树有自己的树根位置和物候（叶子比例、颜色），
+        # 只引用少量树形变体的缓存精灵。精灵只按几何缓存，每棵树的颜色通过调色板写入它自己的着色副本
+        self.forest_variants = []  # 树形变体：相对树根的树枝、叶子几何及包围盒
+        self.forest_trees = []     # 森林中的树：变体、缩放档位、树根位置和屏幕区域，按由远到近排序
+        self.forest_rects = []     # 每棵树的屏幕区域，用于裁剪查询
+        self.forest_rect = None    # 整片森林的包围盒
+        self.forest_scales = (0.3, 0.4, 0.5, 0.6)  # 缩放档位，越近的树越大
+        self.forest_bands = 8      # 叶子比例的档位数
+        self.forest_sprites = SurfaceCache(capacity=256)  # (变体, 缩放档位, 叶子档位) -> 8位调色板精灵
+        self.forest_phase = np.zeros(0)               # 每棵树的物候偏移（季节），有的树发芽和落叶早，有的晚
+        self.forest_tint = np.zeros((0, 3))           # 每棵树叶子颜色的倍数
+        self.forest_stage = None                      # 每棵树当前的物候阶段
+        self.forest_stage_table = None                # 每个物候阶段的叶子比例和颜色
+        self.forest_leaf_fraction = np.zeros(0)       # 每棵树上叶子的比例
+        self.forest_leaf_color = np.zeros((0, 3))     # 每棵树叶子的颜色（未计入昼夜亮度）
+        self.forest_instances = []      # 每棵树着色后的精灵，只在这棵树的显示状态变化时重新着色
+        self.forest_instance_state = None  # 着色时的显示状态：(树干颜色, 每棵树的叶子档位和颜色)
+        self.forest_damage = []         # 重新着色过的树的屏幕区域，供脏矩形渲染使用
+        # 森林物候：各季节中间时树上叶子的比例和颜色，季节之间线性插值。每棵树每季只变化
+        # forest_stages次，叶子和颜色变化的树分散在不同的模拟步，每步只需要重绘少数几棵树
+        self.forest_stages = 2
+        self.forest_season_leaves = (0.75, 1.0, 0.5, 0.1)
+        self.forest_season_colors = ((120, 220, 100), (30, 130, 30), (220, 150, 30), (255, 255, 255))
+        
+        # 缓存的静态树层（按几何版本、季节和树干颜色缓存）
+        self.tree_layer = None
+        self.tree_layer_key = None
+        self.tree_layer_offset = (0, 0)
         
         # 树叶参数
         self.leaf_count = 0
@@ -69,30 +1272,48 @@ class SeasonalTree:
         self.leaf_size = 0
         self.max_leaf_count = 600  # 增加最大叶子数量
         self.max_leaf_size = 8     # 叶子大小上限
-        self.leaf_positions = []   # 存储固定的叶子位置
-        self.leaf_types = []       # 叶子类型（圆形、椭圆形等）
-        self.leaves = []           # 实际叶子列表
+        self.leaf_positions = np.zeros((0, 2))            # 固定的叶子位置，形状为(N, 2)的连续数组
+        self.leaf_types = np.zeros(0, dtype=np.int8)      # 叶子类型（圆形、椭圆形等）
+        self.leaf_slots = LeafSlots(rng=self.streams.particles.generator)  # 树上实际的叶子，记录占用的叶子位置下标和大小
+        self.leaf_grid = LeafGrid()     # 叶子位置的网格索引，查询某处附近的叶子
+        self.shake_radius = 60          # 点击树冠时掉落叶子的范围
+        self.lightning_char_radius = 8  # 闪电烧焦叶子的范围
         self.ground_leaves = []    # 地面上的落叶
+        self.canopy = None         # 烘焙的树冠层，第一次绘制时创建
         
         # 季节叶子生成和落叶参数
-        self.leaf_spawn_rate = [0.1, 0.05, 0.12, 0.02, 0.01]  # 春夏秋冬雷暴的叶子生成概率
+        self.leaf_spawn_rate = [3, 3, 1, 0]  # 春夏秋冬每步长出的叶子数，可以是小数（冬天不长叶子）
         self.max_leaves_count = [450, 600, 300, 70, 50]     # 各季节的最大叶子数量，增加数量
         self.max_ground_leaves = [30, 50, 150, 80, 40]      # 各季节地面上的落叶数量上限
         
-        # 初始化固定的叶子位置
-        self.generate_leaf_positions()
+        # 生成树枝结构和固定的叶子位置（有种子时从缓存读取）
+        self.build_tree_geometry()
         
         # 动态效果参数
         self.target_leaf_count = 0
         self.target_leaf_color = (0, 0, 0)
         self.current_leaf_color = (0, 0, 0)
-        self.falling_leaves = []   # 用于存储下落的叶子
+        self.falling_leaves = FallingLeafSystem(rng=self.streams.particles.generator)  # 用于存储下落的叶子
         self.leaf_transition_speed = 1.0  # 叶子颜色过渡速度
         
+        # 飘落叶子的精灵缓存：按(类型, 量化尺寸, 量化角度, 颜色)缓存旋转好的表面
+        self.leaf_sprites = SurfaceCache(capacity=4096)
+        self.leaf_rotation_step = 10  # 旋转角度量化步长（度）
+        self.leaf_size_step = 0.5     # 尺寸量化步长（像素）
+        # 落叶颜色的随机变化只从少量固定组合中选取，使精灵缓存能够复用
+        self.leaf_color_jitter = self.streams.geometry.generator.integers(-15, 16, (8, 3))
+        
         # 云和降水效果
-        self.clouds = []
-        self.raindrops = []
-        self.snowflakes = []
+        # 云的形状模板：云只引用模板，每个模板在每种云色下只绘制一次精灵
+        self.cloud_shapes = [self.generate_cloud_shape() for _ in range(12)]
+        self.cloud_sprites = SurfaceCache(capacity=128)  # (模板, 云色) -> 云朵精灵
+        
+        # 不同半径雪花的像素偏移（圆盘）
+        self.snowflake_offsets = {}
+        for radius in (1, 2, 3):
+            offsets = [(dx, dy) for dx in range(-radius, radius + 1) for dy in range(-radius, radius + 1)
+                       if dx * dx + dy * dy <= radius * radius]
+            self.snowflake_offsets[radius] = (np.array([o[0] for o in offsets]), np.array([o[1] for o in offsets]))
         self.generate_clouds(5)  # 初始生成5朵云
         
         # 生成草地
@@ -102,27 +1323,46 @@ class SeasonalTree:
         self.insects = []
         self.birds = []
         
+        # 界面缓存：渲染好的文字和半透明背景，只有显示的内容变化时才重新渲染
+        self.text_cache = SurfaceCache(capacity=256)  # (字体, 文字, 颜色) -> 文字表面
+        self.info_panel_surface = None  # 信息面板的半透明背景
+        self.welcome_surface = None     # 欢迎信息的半透明背景
+        
         # 按钮相关
         self.buttons = []
         self.create_buttons()
+        if not headless:
+            self.prerender_buttons()
         
         # 时钟
         self.clock = pygame.time.Clock()
         
-        # 昼夜循环
-        self.sky_colors = {
-            "dawn": (255, 200, 170),    # 黎明
-            "day": (135, 206, 235),     # 白天
-            "dusk": (255, 150, 100),    # 黄昏
-            "night": (25, 25, 50)       # 夜晚
-        }
-        self.current_sky_color = self.sky_colors["day"]
-        
-        # 初始化动画参数
-        self.animation_frame = 0
-        
-        # 添加星星状态跟踪
-        self.stars = []
+        # 主循环参数：固定步长模拟，渲染时在最近两个模拟状态之间插值
+        # 每秒执行的模拟步数。用set_tick_rate()修改时步长tick_ms随之改变，
+        # 每步的位移、数量和概率按步长缩放，动画在真实时间中的速度不变
+        self.tick_rate = 1000 / self.tick_ms
+        self.target_fps = 60          # 目标帧率，0表示不限制
+        self.max_catchup_steps = 5    # 每帧最多追赶的模拟步数
+        self.max_frame_time = 0.25    # 单帧计入的最长时间（秒）
+        self.render_alpha = 1.0       # 插值系数（0=上一步状态，1=当前状态）
+        
+        # 渲染模式：'full'每帧整屏重绘，'dirty'只重绘动态物体覆盖的区域
+        self.render_mode = 'full'
+        self.dirty_tiles = None        # 本帧的受损区域，第一次脏矩形渲染时创建
+        self.prev_dirty_tiles = None   # 上一帧动态物体覆盖的网格
+        self.drawn_scene_key = None    # 屏幕上静态背景对应的状态
+        self.full_redraw = True        # 窗口被遮挡等情况下要求整屏重绘
+        self.overlay_states = []       # 按钮和信息面板上次绘制时的状态
+        self.redraw_percent = 100.0    # 本帧重绘的屏幕比例（%）
+        self.redraw_average = 100.0    # 重绘比例的平滑平均值
+        self.welcome_lines = None      # 欢迎信息，为None时不显示
+        
+        # 天空查找表：按(季节, 天气, 量化时间)预先计算天空颜色、环境光和昼夜标志，所有绘制方法共用
+        self.sky_table = self.build_sky_table()
+        self.sky_surface = None        # 缓存的天空背景
+        self.sky_surface_key = None
+        
+        # 添加星星
         self.generate_stars(100)  # 生成100颗星星
         
         # 初始化第一个季节
@@ -135,19 +1375,13 @@ class SeasonalTree:
         self.lightning_active = False
         self.lightning_timer = 0
         self.lightning_duration = 10  # 闪电持续时间（帧）
+        self.lightning_chance = 0.02  # 雷暴天气中每步触发闪电的概率
         self.lightning_cooldown = 0
         self.lightning_strike_pos = None
+        self.lightning_bolt = None  # 当前的闪电路径（每个模拟步生成一次），闪电结束时烧焦沿途的叶子
         
-        # 添加天体系统
-        self.sun_pos = (0, 0)
-        self.moon_pos = (0, 0)
-        self.sun_radius = 30
-        self.moon_radius = 25
-        self.sun_color = (255, 255, 0)
-        self.moon_color = (200, 200, 200)
-        
-        # 添加黑色叶子（被雷劈中的叶子）
-        self.black_leaves = []
+        # 添加黑色叶子（被雷劈中的叶子），不受风摆动影响
+        self.black_leaves = FallingLeafSystem(capacity=64, wind_sway=0.0, rng=self.streams.particles.generator)
     
     def create_buttons(self):
         """创建所有实体按钮"""
@@ -244,18 +1478,93 @@ class SeasonalTree:
             'active_color': (200, 0, 0)
         })
     
-    def generate_branches(self):
+    def tree_geometry_key(self):
+        """根据种子、树形参数和树干位置计算几何的内容哈希"""
+        description = {
+            'version': GEOMETRY_FORMAT_VERSION,
+            'seed': self.tree_seed,
+            'shape': self.tree_shape,
+            'trunk': (self.trunk_x, self.trunk_base_y, self.trunk_height)
+        }
+        return hashlib.sha1(json.dumps(description, sort_keys=True).encode('utf-8')).hexdigest()
+    
+    def build_tree_geometry(self):
+        """生成树枝和叶子位置；有种子时按内容哈希缓存到.npz，之后的运行直接内存映射读取"""
+        if self.tree_seed is None:
+            self.geometry_path = None
+            rng = self.streams.geometry.generator
+            self.generate_branches(rng)
+            self.generate_leaf_positions(rng)
+            return
+        
+        path = os.path.join(self.geometry_cache_dir, f"tree-{self.tree_geometry_key()[:20]}.npz")
+        self.geometry_path = path
+        if os.path.exists(path):
+            try:
+                self.load_tree_geometry(path)
+                return
+            except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+                pass  # 缓存损坏时重新生成并覆盖
+        
+        rng = np.random.default_rng(self.tree_seed)
+        self.generate_branches(rng)
+        self.generate_leaf_positions(rng)
+        try:
+            save_npz(path, **self.tree_geometry_arrays())
+        except OSError as e:
+            print(f"无法写入树几何缓存: {e}")
+    
+    def tree_geometry_arrays(self):
+        """树几何的数组形式（几何缓存和快照使用同样的格式）"""
+        return {
+            'branches': np.array([(start[0], start[1], end[0], end[1], thickness)
+                                  for start, end, thickness in self.branches], dtype=np.float64).reshape(-1, 5),
+            'leaf_positions': self.leaf_positions,
+            'leaf_types': self.leaf_types
+        }
+    
+    def load_tree_geometry(self, path):
+        """从缓存文件读取树几何，叶子位置保持为内存映射数组"""
+        self.set_tree_geometry(load_npz(path))
+    
+    def set_tree_geometry(self, arrays):
+        """使用tree_geometry_arrays()格式的数组作为树几何，树上的叶子全部清空"""
+        self.branches = [((x1, y1), (x2, y2), thickness)
+                         for x1, y1, x2, y2, thickness in np.asarray(arrays['branches']).tolist()]
+        self.branch_version += 1
+        self.leaf_positions = arrays['leaf_positions']
+        self.leaf_types = arrays['leaf_types']
+        self.leaf_slots.reset(len(self.leaf_positions), self.leaf_positions[:, 1])
+        self.leaf_grid.build(self.leaf_positions)
+        self.canopy = None
+    
+    def generate_branches(self, rng=None):
         """生成树枝结构，遵循自然生长规律和分形特性"""
+        rng = rng if rng is not None else self.streams.geometry.generator
+        self.branches = self.build_branches((self.trunk_x, self.trunk_base_y), self.trunk_height,
+                                            self.tree_shape, rng)
+        
+        # 几何发生变化，缓存的树层失效
+        self.branch_version += 1
+    
+    def build_branches(self, base, trunk_height, shape, rng):
+        """生成一棵树根位于base的树的树枝列表，不修改当前的树"""
+        branches = []
+        thickness = shape['trunk_thickness']
+        
         # 主干 - 确保紧贴地面
-        trunk_start = (self.trunk_x, self.trunk_base_y)
-        trunk_end = (self.trunk_x, self.trunk_base_y - self.trunk_height)
-        self.branches.append((trunk_start, trunk_end, 25))  # 主干
+        trunk_start = base
+        trunk_end = (base[0], base[1] - trunk_height)
+        branches.append((trunk_start, trunk_end, thickness))  # 主干
         
         # 添加分支，控制递归深度以保持树形美观
-        self.add_fractal_branches(trunk_start, trunk_end, 25, 0, 5)  # 减少最大深度到5，避免树过于复杂
+        self.add_fractal_branches(trunk_start, trunk_end, thickness, 0, shape['max_depth'], rng, branches, shape)
+        return branches
     
-    def add_fractal_branches(self, start, end, thickness, depth, max_depth):
-        """使用分形算法生成更自然的树枝结构"""
+    def add_fractal_branches(self, start, end, thickness, depth, max_depth, rng, branches=None, shape=None):
+        """使用分形算法生成更自然的树枝结构，新分支加入branches（默认为当前的树）"""
+        branches = self.branches if branches is None else branches
+        shape = self.tree_shape if shape is None else shape
         if depth >= max_depth or thickness < 1:  # 降低停止生成的厚度阈值，允许生成更多细枝
             return
             
@@ -267,19 +1576,17 @@ class SeasonalTree:
         # 分支方向和角度
         main_angle = math.atan2(dy, dx)
         
-        # 根据深度和角度调整分支数量和特性
+        # 根据深度选择分支数量、长度和角度范围
         if depth == 0:  # 主干
-            branch_count = 4  # 主干分支减少到4个，避免过于拥挤
-            length_range = (0.55, 0.65)  # 主干分支更短一些，使树更矮
-            angle_range = (-math.pi/4, math.pi/4)  # 适当增加角度范围，使树更宽
-        elif depth < 3:  # 主要次级分支
-            branch_count = random.randint(2, 3)  # 次级分支2-3个，避免过于复杂
-            length_range = (0.5, 0.65)  # 更短的分支
-            angle_range = (-math.pi/4.5, math.pi/4.5)
+            tier = 'trunk'
+        elif depth < shape['inner_depth']:  # 主要次级分支
+            tier = 'inner'
         else:  # 细小末端分支
-            branch_count = random.randint(1, 2)  # 末端分支1-2个
-            length_range = (0.4, 0.6)  # 末端分支更短
-            angle_range = (-math.pi/4, math.pi/4)
+            tier = 'outer'
+        count_range = shape[tier + '_branch_count']
+        branch_count = int(rng.integers(count_range[0], count_range[1] + 1))
+        length_range = shape[tier + '_length_range']
+        angle_range = shape[tier + '_angle_range']
         
         # 创建一个均匀分布的角度列表，使分支更均匀
         angles = []
@@ -292,23 +1599,25 @@ class SeasonalTree:
             else:
                 # 随机角度
                 for i in range(branch_count):
-                    angles.append(random.uniform(angle_range[0], angle_range[1]))
+                    angles.append(float(rng.uniform(angle_range[0], angle_range[1])))
+        elif branch_count == 1:
+            angles = [float(rng.uniform(angle_range[0], angle_range[1]))]
         else:
-            angles = [random.uniform(angle_range[0], angle_range[1])]
+            return
             
         # 随机打乱角度
-        random.shuffle(angles)
+        angles = [angles[i] for i in rng.permutation(len(angles))]
         
         for i in range(branch_count):
             # 分支长度系数随深度减小
-            length_factor = random.uniform(length_range[0], length_range[1]) * (1 - depth/max_depth * 0.15)
+            length_factor = float(rng.uniform(length_range[0], length_range[1])) * (1 - depth/max_depth * 0.15)
             new_length = length * length_factor
             
             # 使用预先计算的角度
             angle_offset = angles[i % len(angles)]
             
             # 添加随机扰动，使树看起来更自然
-            new_angle = main_angle + angle_offset + random.uniform(-0.05, 0.05)
+            new_angle = main_angle + angle_offset + float(rng.uniform(-0.05, 0.05))
             
             # 新分支终点
             new_x = x2 + math.cos(new_angle) * new_length
@@ -319,100 +1628,191 @@ class SeasonalTree:
             new_thickness = max(1, thickness * thickness_factor)
             
             # 添加新分支
-            self.branches.append((end, (new_x, new_y), new_thickness))
+            branches.append((end, (new_x, new_y), new_thickness))
             
             # 递归添加子分支
-            self.add_fractal_branches(end, (new_x, new_y), new_thickness, depth + 1, max_depth)
+            self.add_fractal_branches(end, (new_x, new_y), new_thickness, depth + 1, max_depth, rng, branches, shape)
     
-    def generate_leaf_positions(self):
-        """生成叶子的固定位置，考虑树的生长形态"""
+    def generate_leaf_positions(self, rng=None):
+        """生成叶子的固定位置，考虑树的生长形态（对所有树枝一次性批量计算）"""
+        rng = rng if rng is not None else self.streams.geometry.generator
+        positions, leaf_types = self.compute_leaf_positions(self.branches, self.tree_shape['leaf_density'], rng)
+        
+        self.leaf_positions = positions
+        self.leaf_types = leaf_types
+        
+        # 叶子位置变化后原有的槽位失效，需要重新烘焙树冠
+        self.leaf_slots.reset(len(positions), positions[:, 1])
+        self.leaf_grid.build(positions)
+        self.canopy = None
+    
+    def compute_leaf_positions(self, branches, leaf_density, rng):
+        """计算一组树枝上的叶子位置和类型，返回(位置, 类型)，不修改当前的树"""
         # 跳过主干，只在分支上生成叶子
-        branch_segments = self.branches[1:]
-        leaf_distribution = []
-        
-        for branch in branch_segments:
-            start, end, thickness = branch
-            branch_length = math.sqrt((end[0] - start[0])**2 + (end[1] - start[1])**2)
-            # 粗的分支有更多的叶子
-            num_leaves = int(thickness * 1.0) + 3  # 增加叶子基础数量
-            
-            # 在分支上和周围生成叶子位置
-            for i in range(num_leaves):
-                # 沿着分支的位置，越靠近分支末端叶子越密集
-                t = (i / num_leaves)**1.5  # 非线性分布，更集中在末端
-                x = start[0] + (end[0] - start[0]) * t
-                y = start[1] + (end[1] - start[1]) * t
-                
-                # 分支方向和垂直方向
-                branch_angle = math.atan2(end[1] - start[1], end[0] - start[0])
-                perp_angle = branch_angle + math.pi/2
-                
-                # 叶子在分支周围的分布，模拟树叶生长模式
-                # 增加每个位置生成的叶子数量
-                leaf_count = 3 if thickness < 5 else 2  # 细枝上生成更多叶子
-                
-                for j in range(leaf_count):  # 每个位置生成多个叶子
-                    angle_offset = random.uniform(-0.8, 0.8)
-                    dist_factor = random.uniform(0.5, 2.0)
-                    
-                    # 计算偏移量，粗的分支偏移更大
-                    offset = thickness * 0.3 * dist_factor
-                    leaf_angle = perp_angle + angle_offset
-                    
-                    # 计算最终位置
-                    leaf_x = x + math.cos(leaf_angle) * offset
-                    leaf_y = y + math.sin(leaf_angle) * offset
-                    
-                    # 加入随机扰动，模拟自然生长
-                    leaf_x += random.uniform(-2, 2)
-                    leaf_y += random.uniform(-2, 2)
-                    
-                    # 确定叶子类型
-                    leaf_type = random.randint(0, 2)  # 0=圆形, 1=椭圆形, 2=小簇
-                    
-                    self.leaf_positions.append((leaf_x, leaf_y))
-                    self.leaf_types.append(leaf_type)
+        segments = np.array([(start[0], start[1], end[0], end[1], thickness)
+                             for start, end, thickness in branches[1:]], dtype=np.float64).reshape(-1, 5)
+        x1, y1, x2, y2, thickness = segments.T
+        
+        # 粗的分支有更多的叶子
+        samples_per_branch = thickness.astype(np.int64) + 3
+        
+        # 展开为每个采样点：所属树枝和在树枝上的序号
+        sample_branch = np.repeat(np.arange(len(segments)), samples_per_branch)
+        sample_start = np.cumsum(samples_per_branch) - samples_per_branch
+        sample_index = np.arange(len(sample_branch)) - sample_start[sample_branch]
+        
+        # 沿着分支的位置，越靠近分支末端叶子越密集（非线性分布）
+        t = (sample_index / samples_per_branch[sample_branch]) ** 1.5
+        
+        # 细枝上每个位置生成更多叶子，再展开为每片叶子
+        leaves_per_sample = np.where(thickness < 5, 3, 2) * leaf_density
+        leaf_sample = np.repeat(np.arange(len(sample_branch)), leaves_per_sample[sample_branch])
+        leaf_branch = sample_branch[leaf_sample]
+        count = len(leaf_sample)
+        
+        # 分支方向的垂直方向
+        branch_angle = np.arctan2(y2 - y1, x2 - x1)
+        perp_angle = branch_angle[leaf_branch] + math.pi / 2
+        
+        # 叶子在分支周围的分布，粗的分支偏移更大
+        angle_offset = rng.uniform(-0.8, 0.8, count)
+        dist_factor = rng.uniform(0.5, 2.0, count)
+        offset = thickness[leaf_branch] * 0.3 * dist_factor
+        leaf_angle = perp_angle + angle_offset
+        
+        base_t = t[leaf_sample]
+        base_x = x1[leaf_branch] + (x2 - x1)[leaf_branch] * base_t
+        base_y = y1[leaf_branch] + (y2 - y1)[leaf_branch] * base_t
+        
+        # 计算最终位置，加入随机扰动模拟自然生长
+        positions = np.empty((count, 2))
+        positions[:, 0] = base_x + np.cos(leaf_angle) * offset + rng.uniform(-2, 2, count)
+        positions[:, 1] = base_y + np.sin(leaf_angle) * offset + rng.uniform(-2, 2, count)
+        
+        return positions, rng.integers(0, 3, count).astype(np.int8)  # 0=圆形, 1=椭圆形, 2=小簇
     
-    def generate_clouds(self, count):
-        """生成云朵，修复offsets错误"""
-        self.clouds = []
+    def generate_forest(self, count, variant_count=4, rng=None):
+        """生成有count棵树的背景森林，每棵树从variant_count个树形变体中随机选取，并有自己的树根位置和物候"""
+        rng = rng if rng is not None else self.streams.geometry.generator
+        shape = dict(self.tree_shape, max_depth=4, trunk_thickness=14)  # 背景树缩小后看不清细枝，树干也更细
+        leaf_margin = int(math.ceil(self.max_leaf_size * 1.1 * 1.6)) + 4
+        self.forest_variants = []
+        for _ in range(variant_count if count else 0):
+            branches = self.build_branches((0, 0), self.trunk_height, shape, rng)
+            positions, leaf_types = self.compute_leaf_positions(branches, 1, rng)
+            points = np.vstack([positions, [p for start, end, _ in branches for p in (start, end)]])
+            margin = shape['trunk_thickness'] + leaf_margin
+            left, top = (np.floor(points.min(axis=0)).astype(int) - margin).tolist()
+            right, bottom = (np.ceil(points.max(axis=0)).astype(int) + margin).tolist()
+            self.forest_variants.append({
+                'branches': branches,
+                'leaf_positions': positions,
+                'leaf_types': leaf_types,
+                'leaf_order': rng.permutation(len(positions)),  # 叶子变少时按此顺序保留
+                'rect': pygame.Rect(left, top, right - left, bottom - top)
+            })
+        
+        self.forest_trees = []
         for _ in range(count):
-            # 创建基本的云结构
-            cloud = {
-                'x': random.randint(-100, self.width + 100),
-                'y': random.randint(50, 150),
-                'width': random.randint(100, 200),
-                'height': random.randint(40, 80),
-                'speed': random.uniform(0.2, 0.5),
-                'offsets': [],  # 存储偏移量
-                'sizes': []     # 存储大小
-            }
-            
-            # 生成5个圆形组成一朵云
-            for i in range(5):
-                # 生成随机偏移量
-                offset_x = random.uniform(-30, 30)
-                offset_y = random.uniform(-15, 15)
-                cloud['offsets'].append((offset_x, offset_y))
-                
-                # 生成随机大小
-                size = random.randint(20, 50)
-                cloud['sizes'].append(size)
-            
-            self.clouds.append(cloud)
+            # 远处的树更小，树根更靠近地平线
+            depth = float(rng.uniform(0, 1))
+            scale_index = min(int(depth * len(self.forest_scales)), len(self.forest_scales) - 1)
+            scale = self.forest_scales[scale_index]
+            variant = int(rng.integers(len(self.forest_variants)))
+            rect = self.forest_variants[variant]['rect']
+            x = float(rng.uniform(0, self.width))
+            base_y = self.ground_level + depth * 20
+            self.forest_trees.append({
+                'variant': variant,
+                'scale': scale_index,
+                'depth': depth,
+                'trunk': (x, base_y),
+                'phase': float(rng.uniform(-0.25, 0.25)),   # 物候偏移（季节）
+                'tint': rng.uniform(0.85, 1.1, 3).tolist(),  # 叶子颜色的倍数
+                'rect': pygame.Rect(int(x + rect.x * scale), int(base_y + rect.y * scale),
+                                    max(1, int(rect.width * scale)), max(1, int(rect.height * scale)))
+            })
+        self.forest_trees.sort(key=lambda tree: tree['depth'])
+        self.forest_rects = [tree['rect'] for tree in self.forest_trees]
+        self.forest_rect = self.forest_rects[0].unionall(self.forest_rects) if self.forest_rects else None
+        self.forest_phase = np.array([tree['phase'] for tree in self.forest_trees]).reshape(-1)
+        self.forest_tint = np.array([tree['tint'] for tree in self.forest_trees]).reshape(-1, 3)
+        self.forest_instances = [None] * len(self.forest_trees)
+        self.forest_instance_state = None
+        self.forest_stage = None
+        self.forest_stage_table = None
+        self.forest_sprites.clear()
+        self.update_forest()
+    
+    def generate_cloud_shape(self):
+        """生成一个云朵形状模板：5个重叠的圆形及其包围盒（相对云朵中心）"""
+        rng = self.streams.geometry.generator
+        # 5个圆形的随机偏移量（整数，使精灵与逐个画圆的结果一致）和随机大小
+        offsets = list(zip(rng.integers(-30, 31, 5).tolist(), rng.integers(-15, 16, 5).tolist()))
+        sizes = rng.integers(20, 51, 5).tolist()
+        return self.cloud_shape(offsets, sizes)
+    
+    @staticmethod
+    def cloud_shape(offsets, sizes):
+        """由圆形偏移量和大小组成云朵形状模板，计算包围盒"""
+        left = min(ox - size for (ox, _), size in zip(offsets, sizes))
+        top = min(oy - size for (_, oy), size in zip(offsets, sizes))
+        right = max(ox + size for (ox, _), size in zip(offsets, sizes)) + 2
+        bottom = max(oy + size for (_, oy), size in zip(offsets, sizes)) + 2
+        return {
+            'offsets': offsets,
+            'sizes': sizes,
+            'rect': pygame.Rect(left, top, right - left, bottom - top)
+        }
+    
+    @profiled
+    def generate_clouds(self, count):
+        """生成云朵，每朵云随机引用一个形状模板"""
+        rng = self.streams.weather.generator
+        count = int(count * self.cloud_density)
+        self.clouds = [{
+            'x': x,
+            'y': y,
+            'width': width,
+            'height': height,
+            'speed': speed,
+            'shape': shape
+        } for x, y, width, height, speed, shape in zip(
+            rng.integers(-100, self.width + 101, count).tolist(),
+            rng.integers(50, 151, count).tolist(),
+            rng.integers(100, 201, count).tolist(),
+            rng.integers(40, 81, count).tolist(),
+            rng.uniform(0.2, 0.5, count).tolist(),
+            rng.integers(0, len(self.cloud_shapes), count).tolist())]
+    
+    def get_cloud_sprite(self, shape_index, color):
+        """取出某个形状模板在某种云色下的精灵，第一次使用时绘制"""
+        def build():
+            shape = self.cloud_shapes[shape_index]
+            rect = shape['rect']
+            sprite = pygame.Surface(rect.size)
+            # 云是单色的，用色键代替逐像素alpha，RLE加速后blit只复制云朵所在的像素
+            key = (255, 0, 255) if color != (255, 0, 255) else (0, 0, 0)
+            sprite.fill(key)
+            for (ox, oy), size in zip(shape['offsets'], shape['sizes']):
+                pygame.draw.circle(sprite, color, (ox - rect.x, oy - rect.y), size)
+            sprite = self.convert_surface(sprite, alpha=False)
+            sprite.set_colorkey(key, pygame.RLEACCEL)
+            return sprite
+        return self.cloud_sprites.get((shape_index, color), build)
     
     def generate_grass(self, count):
         """生成草地"""
-        self.grass_blades = []
-        for _ in range(count):
-            x = random.randint(0, self.width)
-            height = random.randint(5, 15)
-            self.grass_blades.append({
-                'x': x,
-                'height': height,
-                'phase': random.uniform(0, 2 * math.pi)
-            })
+        rng = self.streams.geometry.generator
+        self.grass_blades = [{
+            'x': x,
+            'height': height,
+            'phase': phase
+        } for x, height, phase in zip(rng.integers(0, self.width + 1, count).tolist(),
+                                      rng.integers(5, 16, count).tolist(),
+                                      rng.uniform(0, 2 * math.pi, count).tolist())]
     
+    @profiled
     def draw(self):
         """绘制整个场景"""
         # 绘制天空
@@ -427,6 +1827,9 @@ class SeasonalTree:
         # 绘制地面
         self.draw_ground()
         
+        # 绘制背景森林
+        self.draw_forest()
+        
         # 绘制树木
         self.draw_tree()
         
@@ -454,33 +1857,312 @@ class SeasonalTree:
         
         # 绘制黑色叶子
         self.draw_black_leaves()
+        
+        # 显示欢迎信息
+        self.draw_welcome()
+        
+        # 性能面板
+        self.draw_profiler()
+    
+    @profiled
+    def draw_dirty(self):
+        """脏矩形渲染：只重绘本帧和上一帧动态物体覆盖的区域，返回需要更新到屏幕上的矩形"""
+        if self.dirty_tiles is None:
+            self.dirty_tiles = DirtyTiles(self.width, self.height)
+            self.prev_dirty_tiles = np.zeros_like(self.dirty_tiles.tiles)
+        damage = self.dirty_tiles
+        damage.clear()
+        
+        # 先确定本帧的随机效果（流星、闪电路径），才能知道它们覆盖的区域
+        shooting_star = self.pick_shooting_star() if self.stars_visible() else None
+        lightning = self.lightning_path() if self.lightning_active else None
+        if len(self.leaf_positions):
+            self.update_canopy()
+        self.mark_damage(damage, shooting_star, lightning)
+        
+        # 天色、季节、天气或树形变化时整屏重绘
+        key = self.scene_key()
+        if self.full_redraw or key != self.drawn_scene_key:
+            damage.add(damage.bounds)
+            self.drawn_scene_key = key
+            self.full_redraw = False
+        
+        # 上一帧动态物体所在的区域也要恢复
+        current = damage.tiles.copy()
+        damage.tiles |= self.prev_dirty_tiles
+        self.prev_dirty_tiles = current
+        
+        # 按钮和信息面板：内容变化或与受损区域重叠时重绘，重绘的区域可能又影响相邻的按钮
+        mouse_pos = pygame.mouse.get_pos()
+        overlays = [(button['rect'], self.button_state(button, mouse_pos)) for button in self.buttons]
+        overlays.append((self.info_panel_rect(), self.info_panel_texts()))
+        dirty = [i >= len(self.overlay_states) or self.overlay_states[i] != state
+                 for i, (_, state) in enumerate(overlays)]
+        for (rect, _), redraw in zip(overlays, dirty):
+            if redraw:
+                damage.add(rect)
+        changed = True
+        while changed:
+            changed = False
+            for i, (rect, _) in enumerate(overlays):
+                if not dirty[i] and damage.any_in(rect):
+                    dirty[i] = True
+                    damage.add(rect)
+                    changed = True
+        self.overlay_states = [state for _, state in overlays]
+        
+        rects = damage.rects()
+        
+        # 背景层：缓存的天空背景，然后是星星、云和降水
+        sky_surface = self.get_sky_surface()
+        for rect in rects:
+            self.screen.blit(sky_surface, rect, rect)
+        if self.stars_visible():
+            self.draw_stars(shooting_star)
+        self.draw_weather()
+        self.draw_grass()
+        
+        # 缓存的静态层（地面、树、树冠）只在受损区域内重绘，跳过与该层不相交的区域
+        tree_rect = self.get_tree_layer().get_rect(topleft=self.tree_layer_offset)
+        canopy_rect = self.canopy.rect if self.canopy is not None else tree_rect
+        for rect in rects:
+            self.screen.set_clip(rect)
+            if rect.bottom >= self.ground_level - 1:
+                self.draw_ground()
+            if self.forest_rect is not None and rect.colliderect(self.forest_rect):
+                self.draw_forest(rect)
+            if rect.colliderect(tree_rect):
+                self.draw_tree()
+            if rect.colliderect(canopy_rect):
+                self.draw_leaves()
+        self.screen.set_clip(None)
+        
+        # 前景层
+        self.draw_falling_leaves()
+        self.draw_wildlife()
+        self.draw_buttons([button for button, redraw in zip(self.buttons, dirty) if redraw])
+        if dirty[-1]:
+            self.draw_info_panel()
+        self.draw_astronomical_bodies()
+        if lightning is not None:
+            self.draw_lightning(lightning)
+        self.draw_black_leaves()
+        self.draw_welcome()
+        self.draw_profiler()
+        
+        self.redraw_percent = damage.coverage() * 100
+        self.redraw_average += (self.redraw_percent - self.redraw_average) * 0.05
+        return rects
+    
+    def scene_key(self):
+        """静态背景的状态，变化时脏矩形渲染整屏重绘"""
+        return (self.get_sky_color(), self.sky_gradient, self.current_season, self.current_weather, self.branch_version)
+    
+    def mark_damage(self, damage, shooting_star=None, lightning=None):
+        """标记本帧所有动态物体覆盖的区域，以及内容发生变化的静态层"""
+        # 星星闪烁和流星
+        stars = self.star_field
+        if self.stars_visible() and len(stars):
+            radius = stars.size + 2
+            damage.add_boxes(stars.x - radius, stars.y - radius, stars.x + radius, stars.y + radius)
+            if shooting_star is not None:
+                (x1, y1), (x2, y2) = shooting_star
+                damage.add(pygame.Rect(min(x1, x2) - 1, min(y1, y2) - 1, abs(x2 - x1) + 3, abs(y2 - y1) + 3))
+        
+        # 云
+        for cloud in self.clouds:
+            x, y = self.lerp_pos(cloud.get('prev_pos', (cloud['x'], cloud['y'])), (cloud['x'], cloud['y']))
+            damage.add(self.cloud_shapes[cloud['shape']]['rect'].move(int(x), int(y)).inflate(4, 4))
+        
+        # 雨滴（带风向的短线）和雪花
+        if self.current_weather in [2, 4]:
+            xs, ys, _ = self.raindrops.visible(self.render_alpha)
+            drift = self.wind_strength * 2
+            damage.add_boxes(xs + min(0, drift) - 2, ys - 2, xs + max(0, drift) + 3, ys + 13)
+        elif self.current_weather == 3:
+            xs, ys, _ = self.snowflakes.visible(self.render_alpha)
+            damage.add_boxes(xs - 4, ys - 4, xs + 5, ys + 5)
+        
+        # 随风摆动的草
+        if self.grass_blades:
+            grass_height = max(blade['height'] for blade in self.grass_blades)
+            damage.add(pygame.Rect(0, self.ground_level - grass_height - 2, self.width, grass_height + 4))
+        
+        # 树冠中长出、掉落或变色的叶子
+        if self.canopy is not None:
+            for rect in self.canopy.take_damage():
+                damage.add(rect)
+        
+        # 叶子档位或颜色变化的背景树
+        if self.forest_trees:
+            self.update_forest_instances()
+            for rect in self.forest_damage:
+                damage.add(rect)
+            self.forest_damage = []
+        
+        # 飘落的叶子
+        for leaves in (self.falling_leaves, self.black_leaves):
+            n = leaves.count
+            if n:
+                alpha = self.render_alpha
+                xs = leaves.prev_x[:n] + (leaves.x[:n] - leaves.prev_x[:n]) * alpha
+                ys = leaves.prev_y[:n] + (leaves.y[:n] - leaves.prev_y[:n]) * alpha
+                radius = leaves.size[:n] * 2 + 4
+                damage.add_boxes(xs - radius, ys - radius, xs + radius, ys + radius)
+        
+        # 昆虫和鸟
+        if self.current_season in [0, 1]:
+            for creature in self.insects + self.birds:
+                x, y = self.lerp_pos(creature.get('prev_pos', creature['pos']), creature['pos'])
+                extent = creature['size'] * 3 + 3
+                damage.add(pygame.Rect(int(x - extent), int(y - extent), int(extent * 2) + 1, int(extent * 2) + 1))
+        
+        # 太阳或月亮
+        if self.sky_state()['sun']:
+            x, y = self.lerp_pos(self.prev_sun_pos, self.sun_pos)
+            extent = self.sun_radius + 12
+        else:
+            x, y = self.lerp_pos(self.prev_moon_pos, self.moon_pos)
+            extent = self.moon_radius + 2
+        damage.add(pygame.Rect(int(x) - extent, int(y) - extent, extent * 2 + 1, extent * 2 + 1))
+        
+        # 闪电
+        if lightning is not None and lightning[0]:
+            xs = [x for x, _ in lightning[0]]
+            ys = [y for _, y in lightning[0]]
+            damage.add(pygame.Rect(int(min(xs)) - 5, int(min(ys)) - 5,
+                                   int(max(xs) - min(xs)) + 11, int(max(ys) - min(ys)) + 11))
+        
+        # 欢迎信息
+        if self.welcome_lines:
+            damage.add(self.welcome_rect())
+        
+        # 性能面板每帧都在变化
+        if self.show_profiler:
+            damage.add(self.profiler_rect())
+    
+    def welcome_rect(self):
+        """欢迎信息的半透明背景区域"""
+        return pygame.Rect(0, 100, self.width, 200)
+    
+    @profiled
+    def draw_welcome(self):
+        """显示欢迎信息（使用说明）"""
+        if not self.welcome_lines:
+            return
+        # 半透明背景
+        rect = self.welcome_rect()
+        if self.welcome_surface is None:
+            s = pygame.Surface(rect.size)
+            s.fill((0, 0, 0))
+            s = self.convert_surface(s, alpha=False)
+            s.set_alpha(180)
+            self.welcome_surface = s
+        self.screen.blit(self.welcome_surface, rect.topleft)
+        
+        # 显示欢迎信息
+        for i, line in enumerate(self.welcome_lines):
+            text = self.render_text(self.font, line, (255, 255, 255))
+            self.screen.blit(text, (self.width//2 - text.get_width()//2, 120 + i * 30))
+    
+    @profiled
+    def draw_sky(self):
+        """绘制天空，考虑昼夜变化"""
+        # 填充天空
+        self.screen.blit(self.get_sky_surface(), (0, 0))
+        
+        # 夜晚显示星星，但在下雪天气时不显示
+        if self.stars_visible():
+            self.draw_stars(self.pick_shooting_star())
+    
+    def build_sky_table(self):
+        """预先计算天空查找表，table[季节][天气][时间步]是该状态下所有绘制方法共用的结果"""
+        table = []
+        for season in range(len(self.seasons)):
+            by_weather = []
+            for weather in range(len(self.weather_conditions)):
+                entries = []
+                for step in range(24 * self.sky_time_steps):
+                    hour = step / self.sky_time_steps
+                    night = hour < 6 or hour > 19
+                    
+                    # 根据时间和天气调整云的颜色
+                    if night:
+                        cloud_color = (100, 100, 120)  # 夜间云色更暗
+                    elif weather == 1:  # 多云
+                        cloud_color = (220, 220, 220)
+                    elif weather == 2:  # 雨
+                        cloud_color = (120, 120, 130)
+                    elif weather == 3:  # 雪
+                        cloud_color = (240, 240, 250)
+                    else:  # 晴朗
+                        cloud_color = (250, 250, 250)
+                    
+                    entries.append({
+                        'color': self.compute_sky_color(season, hour),
+                        'ambient': 0.7 if hour < 6 or hour > 20 else 1.0,  # 夜晚树叶亮度降低
+                        'night': night,
+                        'stars': night and weather != 3,  # 夜晚显示星星，但在下雪天气时不显示
+                        'sun': 6 <= hour <= 18,           # 白天显示太阳，否则显示月亮
+                        'cloud_color': cloud_color
+                    })
+                by_weather.append(entries)
+            table.append(by_weather)
+        return table
     
-    def draw_sky(self):
-        """绘制天空，考虑昼夜变化"""
+    def sky_state(self):
+        """当前(季节, 天气, 时间)在天空查找表中的条目"""
+        step = int(round(self.current_time * self.sky_time_steps, 6)) % (24 * self.sky_time_steps)
+        return self.sky_table[self.current_season][self.current_weather][step]
+    
+    def get_sky_surface(self):
+        """返回缓存的天空背景，只在查找表给出的天空颜色变化时重建"""
+        color = self.get_sky_color()
+        key = (color, self.sky_gradient)
+        if self.sky_surface is None or self.sky_surface_key != key:
+            surface = pygame.Surface((self.width, self.height))
+            surface.fill(color)
+            if self.sky_gradient:
+                # 竖直渐变：越接近地平线越亮
+                t = np.clip(np.arange(self.height) / self.ground_level, 0, 1)[:, None]
+                rows = np.array(color, dtype=np.float64) + (255 - np.array(color, dtype=np.float64)) * 0.35 * t
+                pixels = pygame.surfarray.pixels3d(surface)
+                pixels[:] = rows.astype(np.uint8)[None, :, :]
+                del pixels  # 解锁表面
+            self.sky_surface = self.convert_surface(surface, alpha=False)
+            self.sky_surface_key = key
+        return self.sky_surface
+    
+    def get_sky_color(self):
+        """当前的天空颜色"""
+        return self.sky_state()['color']
+    
+    def compute_sky_color(self, season, hour):
+        """根据时间和季节计算天空颜色（用于生成天空查找表）"""
         # 根据时间确定天空颜色
-        if self.current_time < 6:  # 凌晨
+        if hour < 6:  # 凌晨
             sky_color = (20, 20, 50)  # 深蓝色夜空
-        elif self.current_time < 7:  # 黎明
-            t = (self.current_time - 6) / 1  # 0-1之间的值
+        elif hour < 7:  # 黎明
+            t = (hour - 6) / 1  # 0-1之间的值
             sky_color = (
                 int(20 + t * (135 - 20)),  # 从深蓝到淡蓝
                 int(20 + t * (206 - 20)),
                 int(50 + t * (235 - 50))
             )
-        elif self.current_time < 18:  # 白天
+        elif hour < 18:  # 白天
             sky_color = (135, 206, 235)  # 天蓝色
             
             # 根据季节调整天空颜色
-            if self.current_season == 0:  # 春天
+            if season == 0:  # 春天
                 sky_color = (173, 216, 230)  # 淡蓝色
-            elif self.current_season == 1:  # 夏天
+            elif season == 1:  # 夏天
                 sky_color = (135, 206, 235)  # 明亮的蓝色
-            elif self.current_season == 2:  # 秋天
+            elif season == 2:  # 秋天
                 sky_color = (176, 196, 222)  # 带灰的蓝色
             else:  # 冬天
                 sky_color = (220, 226, 240)  # 带白的淡蓝色
-        elif self.current_time < 19:  # 黄昏
-            t = (self.current_time - 18) / 1  # 0-1之间的值
+        elif hour < 19:  # 黄昏
+            t = (hour - 18) / 1  # 0-1之间的值
             sky_color = (
                 int(135 - t * (135 - 20)),  # 从淡蓝到深蓝
                 int(206 - t * (206 - 20)),
@@ -488,76 +2170,71 @@ class SeasonalTree:
             )
         else:  # 夜晚
             sky_color = (20, 20, 50)  # 深蓝色夜空
-            
-        # 填充天空
-        self.screen.fill(sky_color)
         
-        # 夜晚显示星星，但在下雪天气时不显示
-        if (self.current_time < 6 or self.current_time > 19) and self.current_weather != 3:
-            for star in self.stars:
-                # 使用正弦函数生成缓慢周期性的亮度变化
-                # 每颗星星有自己的闪烁速度和相位
-                blink_factor = math.sin(self.animation_frame * star['blink_speed'] + star['phase'])
-                # 将正弦值转换为0.6-1.0的亮度范围，使星星始终可见但亮度变化
-                brightness = 0.6 + (blink_factor + 1) * 0.2
-                
-                # 星星颜色 - 使用亮度调整
-                star_color = (int(255 * brightness), int(255 * brightness), int(255 * brightness))
-                
-                # 绘制星星 - 使用记录的位置和大小
-                pygame.draw.circle(self.screen, star_color, (int(star['x']), int(star['y'])), star['size'])
+        return sky_color
+    
+    def stars_visible(self):
+        """夜晚显示星星，但在下雪天气时不显示"""
+        return self.sky_state()['stars']
+    
+    def pick_shooting_star(self):
+        """偶尔添加一些流星效果，返回流星的起点和终点，没有流星时返回None"""
+        rng = self.streams.render  # 流星只影响画面，使用绘制专用的随机数流
+        if rng.random() < 0.005 and not self.paused:  # 每200帧约1次，且非暂停状态
+            start_x = rng.randint(0, self.width)
+            start_y = rng.randint(0, self.ground_level // 3)
+            end_x = start_x + rng.randint(50, 150) * (1 if rng.random() > 0.5 else -1)
+            end_y = start_y + rng.randint(30, 80)
             
-            # 偶尔添加一些流星效果
-            if random.random() < 0.005 and not self.paused:  # 每200帧约1次，且非暂停状态
-                start_x = random.randint(0, self.width)
-                start_y = random.randint(0, self.ground_level // 3)
-                end_x = start_x + random.randint(50, 150) * (1 if random.random() > 0.5 else -1)
-                end_y = start_y + random.randint(30, 80)
-                
-                # 确保流星不会超出屏幕边界
-                end_x = max(0, min(self.width, end_x))
-                end_y = max(0, min(self.ground_level - 50, end_y))
-                
-                # 绘制流星
-                pygame.draw.line(self.screen, (255, 255, 255), (start_x, start_y), (end_x, end_y), 1)
+            # 确保流星不会超出屏幕边界
+            end_x = max(0, min(self.width, end_x))
+            end_y = max(0, min(self.ground_level - 50, end_y))
+            return (start_x, start_y), (end_x, end_y)
+        return None
+    
+    @profiled
+    def draw_stars(self, shooting_star=None):
+        """绘制闪烁的星星和流星"""
+        self.star_field.draw(self.screen, self.render_frame)
+        
+        # 绘制流星
+        if shooting_star is not None:
+            pygame.draw.line(self.screen, (255, 255, 255), shooting_star[0], shooting_star[1], 1)
 
+    @profiled
     def draw_weather(self):
         """绘制天气效果"""
-        # 绘制云彩
+        # 绘制云彩，颜色由时间和天气决定
+        # 每朵云是一个缓存好的精灵，所有云一次blits绘制
+        cloud_color = self.sky_state()['cloud_color']
+        sprites = []
         for cloud in self.clouds:
-            # 根据时间和天气调整云的颜色
-            if self.current_time < 6 or self.current_time > 19:  # 夜间
-                cloud_color = (100, 100, 120)  # 夜间云色更暗
-            else:
-                if self.current_weather == 1:  # 多云
-                    cloud_color = (220, 220, 220)
-                elif self.current_weather == 2:  # 雨
-                    cloud_color = (120, 120, 130)
-                elif self.current_weather == 3:  # 雪
-                    cloud_color = (240, 240, 250)
-                else:  # 晴朗
-                    cloud_color = (250, 250, 250)
-            
-            # 绘制云朵 (多个重叠的圆形)
-            x, y = cloud['x'], cloud['y']
-            for i in range(5):
-                offset = cloud['offsets'][i]
-                size = cloud['sizes'][i]
-                pygame.draw.circle(self.screen, cloud_color, (int(x + offset[0]), int(y + offset[1])), size)
-        
-        # 绘制雨滴
-        if self.current_weather == 2:  # 下雨
-            for drop in self.raindrops:
-                pygame.draw.line(self.screen, (200, 200, 250), 
-                                (drop[0], drop[1]), 
-                                (drop[0] + self.wind_strength * 2, drop[1] + 10), 1)
-        
-        # 绘制雪花
+            x, y = self.lerp_pos(cloud.get('prev_pos', (cloud['x'], cloud['y'])), (cloud['x'], cloud['y']))
+            rect = self.cloud_shapes[cloud['shape']]['rect']
+            sprites.append((self.get_cloud_sprite(cloud['shape'], cloud_color), (int(x) + rect.x, int(y) + rect.y)))
+        self.screen.blits(sprites, doreturn=False)
+        
+        # 绘制雨滴：每滴雨是一条短线，沿线采样像素后一次写入
+        if self.current_weather in [2, 4]:  # 下雨或雷暴
+            xs, ys, _ = self.raindrops.visible(self.render_alpha)
+            if len(xs):
+                t = np.linspace(0, 1, 11, dtype=np.float32)[:, None]
+                plot_points(self.screen,
+                            (xs + t * (self.wind_strength * 2)).ravel(),
+                            (ys + t * 10).ravel(),
+                            (200, 200, 250))
+        
+        # 绘制雪花：按半径展开成像素点后一次写入
         elif self.current_weather == 3:  # 下雪
-            for flake in self.snowflakes:
-                pygame.draw.circle(self.screen, (250, 250, 250), 
-                                  (int(flake[0]), int(flake[1])), 
-                                  int(flake[2]))
+            xs, ys, sizes = self.snowflakes.visible(self.render_alpha)
+            for radius, (dx, dy) in self.snowflake_offsets.items():
+                selected = sizes.astype(np.int32) == radius
+                if not selected.any():
+                    continue
+                plot_points(self.screen,
+                            (xs[selected].astype(np.int32)[:, None] + dx).ravel(),
+                            (ys[selected].astype(np.int32)[:, None] + dy).ravel(),
+                            (250, 250, 250))
 
     def draw_wildlife(self):
         """绘制野生动物（昆虫和鸟类）"""
@@ -569,9 +2246,9 @@ class SeasonalTree:
         if self.current_season == 0:  # 春天
             # 绘制蝴蝶
             for insect in self.insects:
-                x, y = insect['pos']
+                x, y = self.lerp_pos(insect.get('prev_pos', insect['pos']), insect['pos'])
                 size = insect['size']
-                phase = insect['phase'] + self.animation_frame * 0.2
+                phase = insect['phase'] + self.render_frame * 0.2
                 
                 # 蝴蝶翅膀
                 wing_open = (math.sin(phase) + 1) / 2  # 0-1 之间波动
@@ -600,7 +2277,7 @@ class SeasonalTree:
         elif self.current_season == 1:  # 夏天
             # 绘制蜜蜂
             for insect in self.insects:
-                x, y = insect['pos']
+                x, y = self.lerp_pos(insect.get('prev_pos', insect['pos']), insect['pos'])
                 size = insect['size']
                 
                 # 蜜蜂身体
@@ -614,10 +2291,10 @@ class SeasonalTree:
         
         # 绘制鸟
         for bird in self.birds:
-            x, y = bird['pos']
+            x, y = self.lerp_pos(bird.get('prev_pos', bird['pos']), bird['pos'])
             size = bird['size']
             direction = bird['direction']
-            phase = bird['phase'] + self.animation_frame * 0.1
+            phase = bird['phase'] + self.render_frame * 0.1
             
             # 鸟翅膀扇动
             wing_y = math.sin(phase) * size * 0.5
@@ -640,8 +2317,10 @@ class SeasonalTree:
             pygame.draw.polygon(self.screen, (50, 50, 50), wing_points)
 
     def run(self):
-        """运行程序，提高帧率与响应速度"""
-        last_update = pygame.time.get_ticks()
+        """运行程序：固定步长模拟 + 插值渲染，模拟速度与帧率无关"""
+        step_seconds = 1.0 / self.tick_rate
+        accumulator = 0.0
+        last_frame = time.perf_counter()
         running = True
         
         # 展示使用说明
@@ -656,74 +2335,149 @@ class SeasonalTree:
             "按P键暂停/继续时间流逝"
         ]
         
-        show_welcome = True
+        self.welcome_lines = welcome_message
         welcome_start = pygame.time.get_ticks()
+        last_caption = time.perf_counter()
         
         # 主循环
+        profiler = self.profiler
         while running:
+            profiler.begin_frame()
+            
             # 处理事件
             running = self.handle_events()
             
-            # 更新天数和动画，提高响应速度
-            current_time = pygame.time.get_ticks()
-            if current_time - last_update > self.day_update_interval // 2:  # 提高更新频率
+            # 累积真实经过的时间，限制单帧最大值，避免长时间卡顿后的"死亡螺旋"
+            now = time.perf_counter()
+            accumulator += min(now - last_frame, self.max_frame_time)
+            last_frame = now
+            
+            # 按固定步长推进模拟，每帧最多追赶max_catchup_steps步
+            steps = 0
+            while accumulator >= step_seconds and steps < self.max_catchup_steps:
+                if self.replay_end is not None and self.tick_count >= self.replay_end:
+                    # 实时回放到录制结束的步数为止
+                    running = False
+                    break
                 self.update()
-                last_update = current_time
+                accumulator -= step_seconds
+                steps += 1
+            if steps >= self.max_catchup_steps:
+                # 追赶不上时丢弃积压的时间，模拟变慢但不会卡死
+                accumulator = min(accumulator, step_seconds)
             
-            # 绘制
-            self.draw()
+            # 插值系数：当前帧位于最近两个模拟状态之间的位置
+            self.render_alpha = accumulator / step_seconds
             
-            # 显示欢迎信息
-            if show_welcome and pygame.time.get_ticks() - welcome_start < 8000:
-                # 半透明背景
-                s = pygame.Surface((self.width, 200))
-                s.set_alpha(180)
-                s.fill((0, 0, 0))
-                self.screen.blit(s, (0, 100))
-                
-                # 显示欢迎信息
-                for i, line in enumerate(welcome_message):
-                    text = self.font.render(line, True, (255, 255, 255))
-                    self.screen.blit(text, (self.width//2 - text.get_width()//2, 120 + i * 30))
-            else:
-                show_welcome = False
+            # 欢迎信息显示8秒
+            if self.welcome_lines and pygame.time.get_ticks() - welcome_start >= 8000:
+                self.welcome_lines = None
             
-            pygame.display.flip()
-            self.clock.tick(60)  # 提高帧率到60帧
-        
+            # 绘制
+            if self.render_mode == 'dirty':
+                # 只把重绘过的区域更新到屏幕，并在标题栏显示重绘比例
+                rects = self.draw_dirty()
+                start = profiler.begin('present')
+                pygame.display.update(rects)
+                profiler.end('present', start)
+                if now - last_caption >= 1.0:
+                    pygame.display.set_caption(f"四季树叶变化模拟 - 重绘 {self.redraw_average:.1f}%")
+                    last_caption = now
+            else:
+                self.draw()
+                start = profiler.begin('present')
+                pygame.display.flip()
+                profiler.end('present', start)
+            if profiler.enabled:
+                profiler.end_frame()
+            if self.trace_recorder is not None:
+                self.trace_recorder.counters(self.entity_counts())
+            # target_fps为0时不限制帧率（基准测试模式）
+            self.clock.tick(self.target_fps)
+        
+        if self.trace_recorder is not None:
+            self.dump_trace()
+        if self.input_log is not None:
+            try:
+                self.save_recording()
+                print(f"已保存输入录制: {self.recording_path} ({len(self.input_log)} 条命令)")
+            except OSError as e:
+                print(f"无法保存输入录制: {e}")
+        status = 0
+        if self.replay_end is not None and self.tick_count >= self.replay_end:
+            same = self.state_digest() == self.replay_digest
+            print("回放结果与录制一致" if same else "回放结果与录制不一致")
+            status = 0 if same else 1
         pygame.quit()
-        sys.exit()
+        sys.exit(status)
+    
+    def start_trace(self, path, capacity=262144):
+        """开始记录性能追踪（环形缓冲区，只保留最近capacity个阶段和capacity个计数器值），dump_trace()导出到path"""
+        self.trace_recorder = TraceRecorder(capacity, counter_capacity=capacity)
+        self.trace_path = path
+        self.profiler.enabled = True
+        self.profiler.tracer = self.trace_recorder
     
+    def dump_trace(self, path=None):
+        """把缓冲区中的追踪导出为trace-event JSON文件"""
+        path = path or self.trace_path
+        try:
+            self.trace_recorder.write(path)
+            print(f"已导出性能追踪: {path} ({len(self.trace_recorder)} 个事件)")
+        except OSError as e:
+            print(f"无法写入性能追踪: {e}")
+    
+    @profiled
     def update(self):
         """更新状态，提高响应速度"""
+        # 在模拟步的边界执行用户命令，回放时按录制的步数注入
+        if self.replay_commands is not None:
+            self.command_queue.extend(self.replay_commands.pop(self.tick_count, ()))
+        if self.command_queue:
+            self.apply_commands()
+        
         # 更新动画帧，即使暂停也继续更新动画
-        self.animation_frame += 1
+        self.animation_frame += self.tick_scale
+        
+        # 推进模拟时钟
+        self.tick_count += 1
+        self.sim_time_ms += self.tick_ms
         
         # 如果暂停状态，不更新时间和季节相关内容
         if self.paused:
             # 只更新落叶、云和降水的动态效果，保持视觉连续性
             self.update_falling_leaves()
+            self.update_black_leaves()
             self.update_clouds()
             self.update_precipitation()
             self.update_wildlife()
+            # 天体不动，避免插值时来回抖动
+            self.prev_sun_pos = self.sun_pos
+            self.prev_moon_pos = self.moon_pos
             return
         
         # 更新天数和季节
-        self.current_day += 1
+        self.current_day += self.scaled_count('day', 1)
         if self.current_day >= self.days_per_season:
-            self.current_day = 0
+            self.current_day %= self.days_per_season
             self.current_season = (self.current_season + 1) % 4
-            print(f"切换到{self.seasons[self.current_season]}季")
+            if self.verbose:
+                print(f"切换到{self.seasons[self.current_season]}季")
             self.apply_seasonal_effect()
         
-        # 更新时间，更快的响应
-        current_time = pygame.time.get_ticks()
-        if current_time - self.last_time_update > 50:  # 每50毫秒更新一次，提高响应速度
-            self.current_time = (self.current_time + self.time_speed) % 24
-            self.last_time_update = current_time
+        # 背景森林的物候跟随季节进度
+        self.update_forest()
+        
+        # 更新时间，按模拟时钟计算，与帧率无关
+        elapsed = self.sim_time_ms - self.last_time_update
+        if elapsed > 50:  # 每50毫秒（模拟时间）更新一次
+            # 默认步长下每两步更新一次，步长改变时按经过的模拟时间缩放
+            scale = 1 if self.tick_scale == 1 else elapsed * self.tick_scale / (2 * self.tick_ms)
+            self.current_time = (self.current_time + self.time_speed * scale) % 24
+            self.last_time_update = self.sim_time_ms
             
             # 减少天气随机变化的频率，避免干扰用户操作
-            if random.random() < 0.005:  # 降低随机天气变化概率
+            if self.streams.weather.random() < self.scaled_rate(0.005, scale):  # 降低随机天气变化概率
                 self.update_weather()
         
         # 动态更新叶子数量，但避免闪烁
@@ -731,42 +2485,31 @@ class SeasonalTree:
             if abs(self.leaf_count - self.target_leaf_count) > 0:
                 if self.leaf_count < self.target_leaf_count:
                     # 春天和夏天叶子生长得更快
-                    growth_rate = 3 if self.current_season in [0, 1] else 1
-                    self.leaf_count = min(self.leaf_count + growth_rate, self.target_leaf_count)
-                    self.generate_leaves()
+                    growth_rate = self.scaled_count('leaf_growth', self.leaf_spawn_rate[self.current_season])
+                    if growth_rate:
+                        self.leaf_count = min(self.leaf_count + growth_rate, self.target_leaf_count)
+                        self.generate_leaves()
                 elif self.leaf_count > self.target_leaf_count:
                     # 秋天叶子掉落更快
                     if self.current_season == 2:
-                        fall_rate = 5
+                        fall_rate = self.scaled_count('leaf_fall', 5)
                         leaves_to_remove = min(fall_rate, self.leaf_count - self.target_leaf_count)
                         
-                        for _ in range(leaves_to_remove):
-                            if self.leaves:
-                                # 优先从叶子底部移除，更符合自然规律
-                                self.leaves.sort(key=lambda leaf: -leaf[1])  # 按高度从上到下排序
-                                leaf = self.leaves.pop()  # 移除最底部的叶子
-                                
-                                # 创建下落的叶子，添加物理效果
-                                self.falling_leaves.append({
-                                    'pos': (leaf[0], leaf[1]),
-                                    'size': leaf[2],
-                                    'speed': random.uniform(0.5, 2.0),
-                                    'swing': random.uniform(-1, 1) * self.wind_strength,
-                                    'rotation': random.uniform(0, 360),
-                                    'rotation_speed': random.uniform(-5, 5),
-                                    'type': random.randint(0, 2),  # 随机叶子类型
-                                    'color': self.current_leaf_color,  # 保持颜色一致
-                                    'x': leaf[0],
-                                    'y': leaf[1]
-                                })
-                        self.leaf_count = len(self.leaves)
+                        # 优先从叶子底部移除，更符合自然规律
+                        dropped = self.detach_lowest_leaves(leaves_to_remove)
+                        
+                        # 创建下落的叶子，添加物理效果，保持颜色一致
+                        self.drop_leaves(dropped, speed=(0.5, 2.0),
+                                         swing=(-self.wind_strength, self.wind_strength),
+                                         rotation_speed=(-5, 5), color=self.current_leaf_color)
+                        self.leaf_count = len(self.leaf_slots)
         
         # 动态更新叶子颜色
         r1, g1, b1 = self.current_leaf_color
         r2, g2, b2 = self.target_leaf_color
         
         # 平滑过渡颜色，速度受季节影响
-        transition_speed = 0.03 * self.leaf_transition_speed
+        transition_speed = self.scaled_rate(0.03 * self.leaf_transition_speed)
         
         self.current_leaf_color = (
             r1 + int((r2 - r1) * transition_speed),
@@ -779,6 +2522,9 @@ class SeasonalTree:
         # 更新落叶
         self.update_falling_leaves()
         
+        # 更新被雷劈中的黑色叶子
+        self.update_black_leaves()
+        
         # 更新云的位置
         self.update_clouds()
         
@@ -794,83 +2540,215 @@ class SeasonalTree:
         # 处理闪电效果
         self.handle_lightning()
     
+    def set_tick_rate(self, tick_rate):
+        """修改每秒模拟步数：步长变为1000/tick_rate毫秒，动画在真实时间中的速度不变"""
+        reference_ms = self.day_update_interval // 2
+        self.tick_rate = tick_rate
+        self.tick_ms = 1000 / tick_rate
+        self.tick_scale = self.tick_ms / reference_ms
+        if self.tick_scale == 1:
+            self.tick_scale = 1
+    
+    def scaled_rate(self, rate, scale=None):
+        """默认步长下每步的概率或平滑系数，换算到当前步长"""
+        scale = self.tick_scale if scale is None else scale
+        if scale == 1:
+            return rate
+        return 1 - (1 - min(rate, 1)) ** scale
+    
+    def scaled_count(self, key, count):
+        """默认步长下每步的数量（可以是小数），换算到当前步长；不足一个的部分累积到下一步"""
+        if self.tick_scale == 1 and float(count).is_integer():
+            return int(count)
+        total = self.tick_carry.get(key, 0.0) + count * self.tick_scale
+        whole = int(total)
+        self.tick_carry[key] = total - whole
+        return whole
+    
+    def lerp_pos(self, prev_pos, pos):
+        """按插值系数在上一步位置和当前位置之间插值"""
+        alpha = self.render_alpha
+        return (prev_pos[0] + (pos[0] - prev_pos[0]) * alpha,
+                prev_pos[1] + (pos[1] - prev_pos[1]) * alpha)
+    
+    @property
+    def render_frame(self):
+        """渲染用的动画帧，位于上一步和当前步之间"""
+        return self.animation_frame - self.tick_scale + self.render_alpha * self.tick_scale
+    
+    def simulate(self, ticks):
+        """无界面模拟：尽可能快地执行指定步数的update()，不做任何绘制
+        
+        记录性能追踪时每步算作一帧：追踪中有每步的'run'阶段和各实体数量的计数器。
+        """
+        tracer = self.trace_recorder
+        if tracer is None:
+            for _ in range(ticks):
+                self.update()
+            return self.tick_count
+        profiler = self.profiler
+        for _ in range(ticks):
+            profiler.begin_frame()
+            self.update()
+            profiler.end_frame()
+            tracer.counters(self.entity_counts())
+        return self.tick_count
+    
+    def snapshot_arrays(self):
+        """把完整的模拟状态转换为列式数组（标量状态和随机数生成器状态以JSON形式放在meta中）"""
+        arrays = self.tree_geometry_arrays()
+        stream_meta, stream_values = self.streams.get_state()
+        meta = {
+            'version': SNAPSHOT_FORMAT_VERSION,
+            'scalars': {name: getattr(self, name) for name in SNAPSHOT_SCALARS},
+            'records': {name: len(getattr(self, name)) for name in SNAPSHOT_RECORDS},
+            'streams': stream_meta
+        }
+        for name, values in stream_values.items():
+            arrays['streams.' + name] = values
+        for prefix in SNAPSHOT_SYSTEMS:
+            for name, array in getattr(self, prefix).get_state().items():
+                arrays[prefix + '.' + name] = array
+        for prefix in SNAPSHOT_RECORDS:
+            for name, column in pack_records(getattr(self, prefix)).items():
+                arrays[prefix + '.' + name] = column
+        for name, array in self.star_field.get_state().items():
+            arrays['star_field.' + name] = array
+        arrays['cloud_shapes.offsets'] = np.array([shape['offsets'] for shape in self.cloud_shapes], dtype=np.int32)
+        arrays['cloud_shapes.sizes'] = np.array([shape['sizes'] for shape in self.cloud_shapes], dtype=np.int32)
+        arrays['leaf_color_jitter'] = self.leaf_color_jitter
+        arrays['lightning_bolt'] = np.array(self.lightning_bolt or [], dtype=np.float64).reshape(-1, 2)
+        
+        def to_json(value):
+            if isinstance(value, np.generic):
+                return value.item()
+            raise TypeError(f"无法保存到快照: {type(value).__name__}")
+        arrays['meta'] = np.frombuffer(json.dumps(meta, default=to_json).encode('utf-8'), dtype=np.uint8)
+        return arrays
+    
+    def save_snapshot(self, path):
+        """把完整的模拟状态保存为未压缩的.npz快照"""
+        save_npz(path, **self.snapshot_arrays())
+    
+    def load_snapshot(self, path, mmap=True):
+        """从快照恢复完整的模拟状态；树几何保持为内存映射数组，其余状态复制到内存中"""
+        arrays = load_npz(path, mmap=mmap)
+        meta = json.loads(bytes(np.asarray(arrays['meta'])).decode('utf-8'))
+        if meta.get('version') != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"不支持的快照版本: {meta.get('version')}")
+        
+        # 按前缀把数组分组
+        groups = {}
+        for key, array in arrays.items():
+            prefix, _, name = key.partition('.')
+            if name:
+                groups.setdefault(prefix, {})[name] = array
+        
+        for name, value in meta['scalars'].items():
+            # JSON中的平坦列表原来是元组（颜色、坐标），嵌套列表（天气概率表）保持为列表
+            if isinstance(value, list) and not any(isinstance(item, list) for item in value):
+                value = tuple(value)
+            setattr(self, name, value)
+        self.streams.set_state(meta['streams'], groups['streams'])
+        self.set_tree_geometry(arrays)
+        for prefix in SNAPSHOT_SYSTEMS:
+            getattr(self, prefix).set_state(groups[prefix])
+        for prefix, count in meta['records'].items():
+            setattr(self, prefix, unpack_records(groups.get(prefix, {}), count))
+        self.star_field.set_state(groups['star_field'])
+        shapes = groups['cloud_shapes']
+        self.cloud_shapes = [self.cloud_shape([tuple(offset) for offset in offsets], sizes) for offsets, sizes
+                             in zip(np.asarray(shapes['offsets']).tolist(), np.asarray(shapes['sizes']).tolist())]
+        self.leaf_color_jitter = np.array(arrays['leaf_color_jitter'])
+        bolt = np.asarray(arrays['lightning_bolt']).tolist()
+        self.lightning_bolt = [tuple(point) for point in bolt] if bolt else None
+        
+        # 所有绘制缓存都依赖于旧状态，下一帧整屏重绘
+        self.cloud_sprites.clear()
+        self.tree_layer_key = None
+        self.sky_surface_key = None
+        self.drawn_scene_key = None
+        self.forest_instance_state = None
+        self.forest_stage = None
+        self.full_redraw = True
+        self.update_forest()
+    
+    @profiled
     def handle_events(self):
         """处理事件，提高按键响应速度"""
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 return False
             
-            # 处理鼠标点击，立即响应
+            # 窗口内容被破坏时，脏矩形渲染需要整屏重绘
+            if event.type == pygame.VIDEOEXPOSE:
+                self.full_redraw = True
+            
+            # 鼠标点击：按钮或树上的点击转换为命令，在下一个模拟步开始时执行
             if event.type == pygame.MOUSEBUTTONDOWN:
-                mouse_pos = pygame.mouse.get_pos()
+                mouse_pos = event.pos
                 
                 # 检查是否点击了任何按钮
-                button_clicked = False
                 for button in self.buttons:
                     if button['rect'].collidepoint(mouse_pos):
-                        # 立即执行按钮对应的操作
-                        if button['action'] == 'season':
-                            self.change_season(button['value'])
-                            button_clicked = True
-                            break
-                        elif button['action'] == 'weather':
-                            self.change_weather(button['value'])
-                            button_clicked = True
-                            break
-                        elif button['action'] == 'wind':
-                            self.increase_wind()
-                            button_clicked = True
-                            break
-                        elif button['action'] == 'wind_reset':
-                            self.reset_wind()
-                            button_clicked = True
-                            break
-                        elif button['action'] == 'pause':
-                            self.paused = not self.paused
-                            pause_status = "暂停" if self.paused else "继续"
-                            print(f"时间已{pause_status}")
-                            button_clicked = True
-                            break
-                        elif button['action'] == 'lightning':
-                            # 触发闪电
-                            if not self.lightning_active and self.lightning_cooldown == 0:
-                                self.lightning_active = True
-                                self.lightning_strike_pos = None
-                
-                # 如果没有点击按钮，检查是否点击了树干
-                if not button_clicked and abs(mouse_pos[0] - self.trunk_x) < 25 and self.trunk_base_y - self.trunk_height < mouse_pos[1] < self.trunk_base_y:
-                    # 模拟风吹或树干震动，导致一些叶子掉落
-                    self.shake_tree()
+                        self.queue_command(*self.button_command(button))
+                        break
+                else:
+                    # 没有点击按钮，点击树干或树冠时摇落叶子
+                    self.queue_command('click', mouse_pos)
             
-            # 处理键盘事件，立即响应
+            # 处理键盘事件
             if event.type == pygame.KEYDOWN:
                 # 空格键增加风力
                 if event.key == pygame.K_SPACE:
-                    self.increase_wind()
+                    self.queue_command('wind')
                 
                 # 按R键重置风力
                 elif event.key == pygame.K_r:
-                    self.reset_wind()
+                    self.queue_command('wind_reset')
                 
                 # W键改变天气
                 elif event.key == pygame.K_w:
-                    self.change_weather((self.current_weather + 1) % 4)
+                    self.queue_command('next_weather')
                     
                 # 按1-4键快速切换季节
                 elif event.key == pygame.K_1:
-                    self.change_season(0)  # 春
+                    self.queue_command('season', 0)  # 春
                 elif event.key == pygame.K_2:
-                    self.change_season(1)  # 夏
+                    self.queue_command('season', 1)  # 夏
                 elif event.key == pygame.K_3:
-                    self.change_season(2)  # 秋
+                    self.queue_command('season', 2)  # 秋
                 elif event.key == pygame.K_4:
-                    self.change_season(3)  # 冬
+                    self.queue_command('season', 3)  # 冬
                 
                 # 按P键暂停/继续时间流逝
                 elif event.key == pygame.K_p:
-                    self.paused = not self.paused
-                    pause_status = "暂停" if self.paused else "继续"
-                    print(f"时间已{pause_status}")
+                    self.queue_command('pause')
+                
+                # 按F3显示/隐藏性能面板
+                elif event.key == pygame.K_F3:
+                    self.show_profiler = not self.show_profiler
+                    self.full_redraw = True  # 隐藏时需要恢复面板下面的画面
+                
+                # 按F4导出性能追踪（需要用--trace启动）
+                elif event.key == pygame.K_F4 and self.trace_recorder is not None:
+                    self.dump_trace()
+                
+                # 按F5保存快照，F9从快照恢复
+                elif event.key == pygame.K_F5:
+                    try:
+                        self.save_snapshot(self.snapshot_path)
+                        print(f"已保存快照: {self.snapshot_path}")
+                    except OSError as e:
+                        print(f"无法保存快照: {e}")
+                elif event.key == pygame.K_F9 and (self.input_log is not None or self.replay_commands is not None):
+                    print("录制或回放输入时不能恢复快照")
+                elif event.key == pygame.K_F9:
+                    try:
+                        self.load_snapshot(self.snapshot_path)
+                        print(f"已恢复快照: {self.snapshot_path}")
+                    except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+                        print(f"无法恢复快照: {e}")
         
         # 更新按钮悬停状态
         mouse_pos = pygame.mouse.get_pos()
@@ -883,45 +2761,137 @@ class SeasonalTree:
         """处理按钮点击"""
         for button in self.buttons:
             if button['rect'].collidepoint(mouse_pos):
-                # 执行按钮对应的操作
-                if button['action'] == 'season':
-                    self.change_season(button['value'])
-                elif button['action'] == 'weather':
-                    self.change_weather(button['value'])
-                elif button['action'] == 'wind':
-                    self.increase_wind()
-                elif button['action'] == 'wind_reset':
-                    self.reset_wind()
-                elif button['action'] == 'pause':
-                    self.paused = not self.paused
-                    pause_status = "暂停" if self.paused else "继续"
-                    print(f"时间已{pause_status}")
-                elif button['action'] == 'lightning':
-                    # 触发闪电
-                    if not self.lightning_active and self.lightning_cooldown == 0:
-                        self.lightning_active = True
-                        self.lightning_strike_pos = None
+                # 按钮对应的操作在下一个模拟步开始时执行
+                self.queue_command(*self.button_command(button))
                 # 按钮点击效果（闪烁或动画）可以在这里添加
                 break
     
+    def button_command(self, button):
+        """按钮对应的命令，返回(命令, 参数...)"""
+        if button['action'] in ('season', 'weather'):
+            return button['action'], button['value']
+        return (button['action'],)
+    
+    def queue_command(self, name, *args):
+        """把用户命令排队，在下一个模拟步开始时执行；回放期间忽略实时输入"""
+        if self.replay_commands is None:
+            self.command_queue.append((name, args))
+    
+    def apply_commands(self):
+        """在模拟步的边界执行排队的命令，录制时记下当前步数"""
+        commands, self.command_queue = self.command_queue, []
+        for name, args in commands:
+            if self.input_log is not None:
+                self.input_log.append((self.tick_count, name, list(args)))
+            self.execute_command(name, args)
+    
+    def execute_command(self, name, args):
+        """执行一条用户命令"""
+        if name == 'season':
+            self.change_season(*args)
+        elif name == 'weather':
+            self.change_weather(*args)
+        elif name == 'next_weather':
+            self.change_weather((self.current_weather + 1) % 4)
+        elif name == 'wind':
+            self.increase_wind()
+        elif name == 'wind_reset':
+            self.reset_wind()
+        elif name == 'pause':
+            self.paused = not self.paused
+            if self.verbose:
+                pause_status = "暂停" if self.paused else "继续"
+                print(f"时间已{pause_status}")
+        elif name == 'lightning':
+            # 触发闪电
+            if not self.lightning_active and self.lightning_cooldown == 0:
+                self.lightning_active = True
+                self.lightning_strike_pos = None
+        elif name == 'click':
+            self.click_tree(*args)
+        else:
+            raise ValueError(f"未知的命令: {name}")
+    
+    def click_tree(self, pos):
+        """点击树干时随机摇落叶子，点击树冠时只摇落点击处附近的叶子"""
+        x, y = pos
+        if abs(x - self.trunk_x) < 25 and self.trunk_base_y - self.trunk_height < y < self.trunk_base_y:
+            # 模拟风吹或树干震动，导致一些叶子掉落
+            self.shake_tree()
+        elif len(self.leaves_near(x, y, self.shake_radius)):
+            self.shake_tree(tuple(pos))
+    
+    def start_recording(self, path, options):
+        """开始录制用户命令，退出时保存到path；options为create_tree()的选项，回放时用它重建初始状态"""
+        self.recording_path = path
+        self.recording_options = dict(options, seed=self.streams.seed)  # 记录实际使用的主种子
+        self.recording_start = self.tick_count
+        self.input_log = []
+    
+    def save_recording(self, path=None):
+        """把录制的命令、初始状态选项和结束时的状态哈希保存为JSON"""
+        path = path or self.recording_path
+        recording = {
+            'version': RECORDING_FORMAT_VERSION,
+            'options': self.recording_options,
+            'start_tick': self.recording_start,
+            'end_tick': self.tick_count,
+            'state_digest': self.state_digest(),
+            'commands': self.input_log
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(recording, f, ensure_ascii=False)
+    
+    def start_replay(self, recording):
+        """按录制的步数注入命令，回放期间忽略实时输入"""
+        self.replay_commands = {tick: list(commands) for tick, commands in recording['schedule'].items()}
+        self.replay_end = recording['end_tick']
+        self.replay_digest = recording['state_digest']
+    
+    def state_digest(self):
+        """模拟状态（快照数组）的哈希，用于检查回放结果与录制时是否一致
+        
+        render流只被绘制使用，消耗多少取决于绘制了多少帧，不计入哈希。
+        """
+        arrays = self.snapshot_arrays()
+        meta = json.loads(bytes(arrays.pop('meta')).decode('utf-8'))
+        del meta['streams']['render']
+        del arrays['streams.render']
+        digest = hashlib.sha1(json.dumps(meta, sort_keys=True).encode('utf-8'))
+        for name, array in sorted(arrays.items()):
+            digest.update(name.encode('utf-8'))
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+    
+    def fast_forward(self, end_tick, ranges=()):
+        """快进到end_tick：ranges（[开始, 结束)步数区间）之外只模拟不绘制，区间内每步绘制并按模拟速度显示
+        
+        关闭窗口时提前结束并返回False。
+        """
+        while self.tick_count < end_tick:
+            if not any(start <= self.tick_count < stop for start, stop in ranges):
+                next_start = min([start for start, _ in ranges if start > self.tick_count] + [end_tick])
+                self.simulate(next_start - self.tick_count)
+                continue
+            if not self.handle_events():
+                return False
+            self.update()
+            self.render_alpha = 1.0
+            self.draw()
+            pygame.display.flip()
+            self.clock.tick(self.tick_rate)
+        return True
+    
     def increase_wind(self):
         """增加风力"""
         self.wind_strength = min(5.0, self.wind_strength + 1.0)
         # 风大时有些叶子会掉落
-        if self.wind_strength > 2.5 and self.leaves:
-            for _ in range(int(self.wind_strength * 2)):
-                if self.leaves:
-                    idx = random.randint(0, len(self.leaves)-1)
-                    leaf = self.leaves.pop(idx)
-                    self.falling_leaves.append({
-                        'pos': (leaf[0], leaf[1]),
-                        'size': leaf[2],
-                        'speed': random.uniform(0.5, 2.0),
-                        'swing': random.uniform(-2, 2) * self.wind_strength,
-                        'rotation': random.uniform(0, 360),
-                        'rotation_speed': random.uniform(-5, 5)
-                    })
-            self.leaf_count = len(self.leaves)
+        if self.wind_strength > 2.5 and self.leaf_slots:
+            dropped = self.detach_random_leaves(int(self.wind_strength * 2))
+            self.drop_leaves(dropped, speed=(0.5, 2.0),
+                             swing=(-2 * self.wind_strength, 2 * self.wind_strength),
+                             rotation_speed=(-5, 5))
+            self.leaf_count = len(self.leaf_slots)
     
     def reset_wind(self):
         """重置风力为季节默认值"""
@@ -933,231 +2903,181 @@ class SeasonalTree:
         self.current_weather = weather_index
         self.weather_duration = 100
         # 清空降水
-        self.raindrops = []
-        self.snowflakes = []
+        self.raindrops.clear()
+        self.snowflakes.clear()
         
         # 更新风力
         if self.current_weather in [2, 3]:  # 雨或雪时风力较大
-            self.wind_strength = random.uniform(1.0, 3.0)
+            self.wind_strength = self.streams.weather.uniform(1.0, 3.0)
         else:
-            self.wind_strength = random.uniform(0.2, 1.5)
+            self.wind_strength = self.streams.weather.uniform(0.2, 1.5)
             
         # 下雪时可能会在地面积雪
         if self.current_weather == 3 and self.current_season == 3:  # 冬天下雪
             self.soil_color = (240, 240, 250)  # 雪地
     
-    def shake_tree(self):
-        """摇晃树，使一些叶子掉落"""
-        if not self.leaves:
+    def shake_tree(self, pos=None):
+        """摇晃树，使一些叶子掉落；pos为点击位置时只掉落点击处附近的叶子"""
+        if not self.leaf_slots:
             return
             
         # 掉落数量取决于季节
+        rng = self.streams.effects
         if self.current_season == 0:  # 春
-            drop_count = random.randint(1, 3)
+            drop_count = rng.randint(1, 3)
         elif self.current_season == 1:  # 夏
-            drop_count = random.randint(2, 5)
+            drop_count = rng.randint(2, 5)
         elif self.current_season == 2:  # 秋
-            drop_count = random.randint(5, 10)
+            drop_count = rng.randint(5, 10)
         else:  # 冬
-            drop_count = random.randint(0, 2)
-        
-        drop_count = min(drop_count, len(self.leaves))
-        for _ in range(drop_count):
-            if self.leaves:
-                idx = random.randint(0, len(self.leaves)-1)
-                leaf = self.leaves.pop(idx)
-                self.falling_leaves.append({
-                    'pos': (leaf[0], leaf[1]),
-                    'size': leaf[2],
-                    'speed': random.uniform(1.0, 3.0),
-                    'swing': random.uniform(-3, 3),
-                    'rotation': random.uniform(0, 360),
-                    'rotation_speed': random.uniform(-8, 8)
-                })
-        
-        self.leaf_count = len(self.leaves)
+            drop_count = rng.randint(0, 2)
+        
+        if pos is None:
+            dropped = self.detach_random_leaves(drop_count)
+        else:
+            nearby = self.leaves_near(pos[0], pos[1], self.shake_radius)
+            picks = self.streams.effects.generator.choice(len(nearby), min(drop_count, len(nearby)), replace=False)
+            dropped = self.detach_leaves(nearby[picks])
+        self.drop_leaves(dropped, speed=(1.0, 3.0), swing=(-3, 3), rotation_speed=(-8, 8))
+        
+        self.leaf_count = len(self.leaf_slots)
     
     def change_season(self, season):
         """手动更改季节"""
         self.current_season = season
         self.current_day = 0  # 重置天数
         self.apply_seasonal_effect()
+        self.update_forest()
     
     def update_leaves(self):
-        """生成树叶，使叶子位置固定不闪烁"""
-        # 限制叶子数量不超过位置数量
-        effective_count = min(self.leaf_count, len(self.leaf_positions))
+        """生成树叶（与generate_leaves相同，保留旧接口）"""
+        self.generate_leaves()
+    
+    def drop_leaves(self, leaves, speed, swing, rotation_speed, color=None, leaf_type=None, target=None):
+        """让一批叶子开始飘落（所有落叶的统一生成接口）
         
-        # 如果已有叶子，则保持现有叶子位置不变，只增加或减少叶子
-        if hasattr(self, 'leaves') and self.leaves:
-            current_count = len(self.leaves)
-            
-            if effective_count > current_count:
-                # 需要添加新叶子
-                # 找出当前未使用的位置
-                used_positions = set((leaf[0], leaf[1]) for leaf in self.leaves)
-                available_positions = [pos for pos in self.leaf_positions if pos not in used_positions]
-                
-                # 如果可用位置不足，就随机使用已有位置
-                if len(available_positions) < (effective_count - current_count):
-                    available_positions = self.leaf_positions
-                
-                # 随机选择需要的数量的新位置
-                new_positions = random.sample(available_positions, effective_count - current_count)
-                
-                # 添加新叶子
-                for x, y in new_positions:
-                    # 随机大小变化但保持稳定
-                    size_variation = random.uniform(0.9, 1.1)
-                    size = self.leaf_size * size_variation
-                    self.leaves.append((x, y, size))
-                    
-            elif effective_count < current_count:
-                # 需要移除一些叶子，按季节特点移除
-                if self.current_season == 2:  # 秋天，主要从底部移除叶子
-                    # 按高度排序，移除最低的叶子
-                    self.leaves.sort(key=lambda leaf: -leaf[1])  # 从高到低排序
-                    self.leaves = self.leaves[:effective_count]
-                else:  # 其他季节随机移除
-                    # 随机抽样保留指定数量的叶子
-                    indices = list(range(len(self.leaves)))
-                    random.shuffle(indices)
-                    self.leaves = [self.leaves[i] for i in indices[:effective_count]]
-        else:
-            # 如果还没有叶子，需要初始化
-            self.leaves = []
-            if effective_count > 0:
-                # 按季节特点选择叶子位置
-                if self.current_season in [0, 1]:  # 春夏
-                    # 优先选择树顶部的位置
-                    positions_with_height = [(pos, 1.0 - (pos[1] / self.ground_level)) for pos in self.leaf_positions]
-                    positions_with_height.sort(key=lambda x: -x[1])  # 按高度降序排序
-                    positions_to_use = [pos for pos, _ in positions_with_height[:effective_count]]
-                else:  # 秋冬
-                    # 均匀随机选择
-                    positions_to_use = random.sample(self.leaf_positions, effective_count)
-                
-                # 创建叶子
-                for x, y in positions_to_use:
-                    # 随机大小变化但保持稳定
-                    size_variation = random.uniform(0.9, 1.1)
-                    size = self.leaf_size * size_variation
-                    
-                    # 保存叶子
-                    self.leaves.append((x, y, size))
+        speed、swing、rotation_speed为随机取值范围；color为空时使用当前叶子颜色加随机变化，
+        leaf_type为空时随机选择落叶形状（0=椭圆, 1=圆形, 2=针形）。
+        """
+        if not leaves:
+            return
+        target = self.falling_leaves if target is None else target
+        rng = target.rng
+        count = len(leaves)
+        positions = np.array([(leaf[0], leaf[1], leaf[2]) for leaf in leaves], dtype=np.float32)
+        
+        if color is None:
+            # 每片叶子一个固定的颜色，只在生成时随机一次
+            jitter = self.leaf_color_jitter[rng.integers(0, len(self.leaf_color_jitter), count)]
+            color = np.clip(np.array(self.current_leaf_color) + jitter, 0, 255)
+        if leaf_type is None:
+            leaf_type = rng.integers(0, 3, count)
+        
+        target.spawn(positions[:, 0], positions[:, 1], positions[:, 2],
+                     speed=rng.uniform(speed[0], speed[1], count),
+                     swing=rng.uniform(swing[0], swing[1], count),
+                     rotation=rng.uniform(0, 360, count),
+                     rotation_speed=rng.uniform(rotation_speed[0], rotation_speed[1], count),
+                     leaf_type=leaf_type, color=color)
     
+    @profiled
     def update_falling_leaves(self):
-        """更新落叶的位置和旋转"""
-        new_falling_leaves = []
-        for leaf in self.falling_leaves:
-            # 更新位置，考虑风力和重力
-            x, y = leaf['pos']
-            
-            # 添加风的影响和随机摆动
-            swing = leaf['swing'] + math.sin(self.animation_frame * 0.05) * self.wind_strength
-            
-            # 落叶运动物理效果
-            new_x = x + swing
-            new_y = y + leaf['speed']
-            
-            # 更新旋转
-            leaf['rotation'] = (leaf['rotation'] + leaf['rotation_speed']) % 360
-            
-            # 检查是否落到地面
-            if new_y < self.ground_level:
-                leaf['pos'] = (new_x, new_y)
-                new_falling_leaves.append(leaf)
-            # 有小概率叶子会堆积在地面上
-            elif random.random() < 0.1 and self.current_season in [2, 3]:  # 秋冬
-                # 不再在这里直接绘制，这是更新方法
-                pass
-        
-        self.falling_leaves = new_falling_leaves
+        """更新落叶的位置和旋转（向量化）"""
+        # 风的影响，所有叶子共享同一个摆动量
+        sway = math.sin(self.animation_frame * 0.05) * self.wind_strength
+        self.falling_leaves.update(sway, self.ground_level, self.tick_scale)
     
+    @profiled
     def update_clouds(self):
         """更新云的位置"""
+        rng = self.streams.weather
         for cloud in self.clouds:
+            cloud['prev_pos'] = (cloud['x'], cloud['y'])
+            
             # 云的移动方向受风力影响
-            cloud['x'] += cloud['speed'] * self.wind_strength
+            cloud['x'] += cloud['speed'] * self.wind_strength * self.tick_scale
             
             # 如果云飘出屏幕，从另一侧重新进入
             if cloud['x'] > self.width + 100:
                 cloud['x'] = -cloud['width'] - 50
-                cloud['y'] = random.randint(50, 150)
+                cloud['y'] = rng.randint(50, 150)
+                cloud['prev_pos'] = (cloud['x'], cloud['y'])  # 瞬移时不插值
             elif cloud['x'] < -cloud['width'] - 100:
                 cloud['x'] = self.width + 50
-                cloud['y'] = random.randint(50, 150)
+                cloud['y'] = rng.randint(50, 150)
+                cloud['prev_pos'] = (cloud['x'], cloud['y'])
+    
+    def set_precipitation_capacity(self, max_raindrops, max_snowflakes):
+        """修改雨滴和雪花的容量（会清空现有降水）"""
+        self.max_raindrops = max_raindrops
+        self.max_snowflakes = max_snowflakes
+        self.raindrops.resize(max_raindrops)
+        self.snowflakes.resize(max_snowflakes)
     
+    @profiled
     def update_precipitation(self):
-        """更新降水（雨或雪）"""
+        """更新降水（雨或雪），所有粒子一次性向量化更新"""
         # 雨
         if self.current_weather in [2, 4]:  # 下雨或雷暴
             # 随机生成新雨滴
-            for _ in range(10):  # 增加雨滴数量
-                self.raindrops.append([
-                    random.randint(0, self.width),
-                    random.randint(0, self.ground_level // 2)
-                ])
-            
-            # 更新现有雨滴位置
-            new_raindrops = []
-            for drop in self.raindrops:
-                drop[1] += 15  # 增加雨滴下落速度
-                drop[0] += self.wind_strength * 2  # 增加风力影响
-                
-                if drop[1] < self.ground_level:
-                    new_raindrops.append(drop)
+            rng = self.raindrops.rng
+            count = self.scaled_count('rain', self.rain_emit_rate)
+            self.raindrops.emit(rng.integers(0, self.width + 1, count),
+                                rng.integers(0, self.ground_level // 2 + 1, count),
+                                vy=15)  # 雨滴下落速度
             
-            # 限制雨滴数量
-            self.raindrops = new_raindrops[:500]  # 增加最大雨滴数量
+            # 更新雨滴位置，风力影响水平位移，落地的雨滴被移除
+            self.raindrops.integrate(dx=self.wind_strength * 2, dt=self.tick_scale)
+            self.raindrops.cull_below(self.ground_level)
         
         # 雪
         elif self.current_weather == 3:  # 下雪
             # 随机生成新雪花
-            for _ in range(2):
-                self.snowflakes.append([
-                    random.randint(0, self.width),
-                    random.randint(0, self.ground_level // 2),
-                    random.uniform(1, 3)  # 雪花大小
-                ])
+            snow = self.snowflakes
+            rng = snow.rng
+            count = self.scaled_count('snow', self.snow_emit_rate)
+            snow.emit(rng.integers(0, self.width + 1, count),
+                      rng.integers(0, self.ground_level // 2 + 1, count),
+                      size=rng.uniform(1, 3, count))  # 雪花大小
             
-            # 更新现有雪花位置
-            new_snowflakes = []
-            for flake in self.snowflakes:
-                # 雪花下落慢一些，有随机摆动
-                flake[1] += random.uniform(1, 3)
-                flake[0] += math.sin(self.animation_frame * 0.05 + flake[1] * 0.1) * 2 + self.wind_strength
-                
-                if flake[1] < self.ground_level:
-                    new_snowflakes.append(flake)
-            
-            # 限制雪花数量
-            self.snowflakes = new_snowflakes[:200]
+            # 雪花下落慢一些，有随机摆动
+            n = snow.used
+            snow.integrate(dy=rng.uniform(1, 3, n).astype(np.float32), dt=self.tick_scale)
+            snow.x[:n] += (np.sin(self.animation_frame * 0.05 + snow.y[:n] * 0.1) * 2 + self.wind_strength) * self.tick_scale
+            snow.cull_below(self.ground_level)
         else:
             # 清空降水
-            self.raindrops = []
-            self.snowflakes = []
+            self.raindrops.clear()
+            self.snowflakes.clear()
     
+    @profiled
     def update_wildlife(self):
         """更新野生动物"""
+        rng = self.streams.wildlife
+        dt = self.tick_scale
+        # 所有昆虫的随机移动一次批量生成
+        jitter = rng.generator.uniform(-1, 1, (len(self.insects), 2)) * (2 * dt, dt)
+        drift_x = math.sin(self.animation_frame * 0.1) * 2 * dt
+        drift_y = math.cos(self.animation_frame * 0.1) * 2 * dt
+        wind_dx = self.wind_strength * 0.5 * dt  # 昆虫受风影响
+        
         # 更新昆虫位置
         new_insects = []
-        for insect in self.insects:
+        for insect, (jitter_x, jitter_y) in zip(self.insects, jitter.tolist()):
             x, y = insect['pos']
+            insect['prev_pos'] = insect['pos']
             
             # 随机移动
-            dx = random.uniform(-2, 2) + math.sin(self.animation_frame * 0.1) * 2
-            dy = random.uniform(-1, 1) + math.cos(self.animation_frame * 0.1) * 2
-            
-            # 昆虫受风影响
-            dx += self.wind_strength * 0.5
+            dx = jitter_x + drift_x
+            dy = jitter_y + drift_y
+            dx += wind_dx
             
             # 边界检查
             x = max(50, min(self.width - 50, x + dx))
             y = max(50, min(self.ground_level - 50, y + dy))
             
             insect['pos'] = (x, y)
-            insect['phase'] += 0.2  # 翅膀扇动速度
+            insect['phase'] += 0.2 * dt  # 翅膀扇动速度
             
             new_insects.append(insect)
         
@@ -1167,22 +3087,25 @@ class SeasonalTree:
         new_birds = []
         for bird in self.birds:
             x, y = bird['pos']
+            bird['prev_pos'] = bird['pos']
             speed = bird['speed']
             direction = bird['direction']
             
             # 鸟飞行
-            x += speed * direction
+            x += speed * direction * dt
             
             # 如果飞出屏幕，从另一侧进入
             if x > self.width + 50:
                 x = -50
-                y = random.randint(50, self.ground_level - 100)
+                y = rng.randint(50, self.ground_level - 100)
+                bird['prev_pos'] = (x, y)  # 瞬移时不插值
             elif x < -50:
                 x = self.width + 50
-                y = random.randint(50, self.ground_level - 100)
+                y = rng.randint(50, self.ground_level - 100)
+                bird['prev_pos'] = (x, y)
             
             bird['pos'] = (x, y)
-            bird['phase'] += 0.3  # 翅膀扇动速度
+            bird['phase'] += 0.3 * dt  # 翅膀扇动速度
             
             new_birds.append(bird)
         
@@ -1190,65 +3113,62 @@ class SeasonalTree:
         
         # 根据季节随机生成昆虫和鸟类
         if self.current_season == 0:  # 春天，较多昆虫和鸟类
-            if len(self.insects) < 10 and random.random() < 0.05:  # 增加昆虫生成概率
+            if len(self.insects) < 10 and rng.random() < self.scaled_rate(0.05):  # 增加昆虫生成概率
                 self.add_insect()
-            if len(self.birds) < 6 and random.random() < 0.03:  # 增加鸟类生成概率
+            if len(self.birds) < 6 and rng.random() < self.scaled_rate(0.03):  # 增加鸟类生成概率
                 self.add_bird()
         elif self.current_season == 1:  # 夏天，大量昆虫和鸟类
-            if len(self.insects) < 15 and random.random() < 0.06:  # 增加昆虫生成概率
+            if len(self.insects) < 15 and rng.random() < self.scaled_rate(0.06):  # 增加昆虫生成概率
                 self.add_insect()
-            if len(self.birds) < 8 and random.random() < 0.04:  # 增加鸟类生成概率
+            if len(self.birds) < 8 and rng.random() < self.scaled_rate(0.04):  # 增加鸟类生成概率
                 self.add_bird()
         elif self.current_season == 2:  # 秋天，鸟类数量增加并统一方向
-            if len(self.birds) < 12 and random.random() < 0.05:  # 增加鸟类生成概率
+            if len(self.birds) < 12 and rng.random() < self.scaled_rate(0.05):  # 增加鸟类生成概率
                 self.add_bird()
             for bird in self.birds:
                 bird['direction'] = 1  # 统一方向
         else:  # 冬天，很少有昆虫和鸟类
             # 昆虫和鸟类逐渐消失
-            if self.insects and random.random() < 0.05:
+            if self.insects and rng.random() < self.scaled_rate(0.05):
                 self.insects.pop()
-            if self.birds and random.random() < 0.02:
+            if self.birds and rng.random() < self.scaled_rate(0.02):
                 self.birds.pop()
     
     def add_insect(self):
         """添加一个昆虫"""
+        rng = self.streams.wildlife
         self.insects.append({
-            'pos': (random.randint(50, self.width - 50), random.randint(50, self.ground_level - 100)),
-            'size': random.randint(3, 5),
-            'phase': random.uniform(0, 2 * math.pi)
+            'pos': (rng.randint(50, self.width - 50), rng.randint(50, self.ground_level - 100)),
+            'size': rng.randint(3, 5),
+            'phase': rng.uniform(0, 2 * math.pi)
         })
     
     def add_bird(self):
         """添加一只鸟"""
+        rng = self.streams.wildlife
         self.birds.append({
-            'pos': (random.randint(0, self.width), random.randint(50, self.ground_level - 150)),
-            'size': random.randint(6, 10),
-            'direction': 1 if random.random() < 0.5 else -1,  # 飞行方向
-            'speed': random.uniform(1, 3),
-            'phase': random.uniform(0, 2 * math.pi)
+            'pos': (rng.randint(0, self.width), rng.randint(50, self.ground_level - 150)),
+            'size': rng.randint(6, 10),
+            'direction': 1 if rng.random() < 0.5 else -1,  # 飞行方向
+            'speed': rng.uniform(1, 3),
+            'phase': rng.uniform(0, 2 * math.pi)
         })
     
+    @profiled
     def update_weather(self):
         """更新天气状况"""
+        rng = self.streams.weather
         # 天气持续时间减少
         if self.weather_duration > 0:
             self.weather_duration -= 1
         else:
             # 随机天气变化
             # 不同季节有不同的天气概率
-            if self.current_season == 0:  # 春天
-                weather_probs = [0.6, 0.3, 0.1, 0.0, 0.0]  # 主要晴朗和多云，偶尔有雨
-            elif self.current_season == 1:  # 夏天
-                weather_probs = [0.7, 0.2, 0.1, 0.0, 0.0]  # 更多晴朗，偶尔有雨
-            elif self.current_season == 2:  # 秋天
-                weather_probs = [0.4, 0.4, 0.2, 0.0, 0.0]  # 更多多云和雨
-            else:  # 冬天
-                weather_probs = [0.3, 0.3, 0.1, 0.3, 0.1]  # 有雪
+            weather_probs = self.weather_probs[self.current_season]
             
             # 根据概率选择天气
-            if random.random() < 0.02:  # 2%的概率天气发生变化
-                r = random.random()
+            if rng.random() < 0.02:  # 2%的概率天气发生变化
+                r = rng.random()
                 cumulative = 0
                 for i, prob in enumerate(weather_probs):
                     cumulative += prob
@@ -1257,16 +3177,16 @@ class SeasonalTree:
                         break
                 
                 # 设置天气持续时间
-                self.weather_duration = random.randint(30, 120)
+                self.weather_duration = rng.randint(30, 120)
                 
                 # 更新风力
                 if self.current_weather in [2, 3]:  # 雨或雪时风力较大
-                    self.wind_strength = random.uniform(1.0, 3.0)
+                    self.wind_strength = rng.uniform(1.0, 3.0)
                 else:
-                    self.wind_strength = random.uniform(0.2, 1.5)
+                    self.wind_strength = rng.uniform(0.2, 1.5)
                 
                 # 更新降水量
-                self.precipitation = 0 if self.current_weather < 2 else random.randint(1, 10)
+                self.precipitation = 0 if self.current_weather < 2 else rng.randint(1, 10)
         
         # 更新温度（根据季节和时间）
         base_temp = [15, 28, 18, 0, -10][self.current_season]  # 春夏秋冬基础温度
@@ -1291,13 +3211,13 @@ class SeasonalTree:
         
         # 更新湿度（根据天气）
         if self.current_weather == 0:  # 晴朗
-            target_humidity = 40 + random.randint(-10, 10)
+            target_humidity = 40 + rng.randint(-10, 10)
         elif self.current_weather == 1:  # 多云
-            target_humidity = 60 + random.randint(-10, 10)
+            target_humidity = 60 + rng.randint(-10, 10)
         elif self.current_weather == 2:  # 雨
-            target_humidity = 90 + random.randint(-5, 5)
+            target_humidity = 90 + rng.randint(-5, 5)
         else:  # 雪
-            target_humidity = 70 + random.randint(-10, 10)
+            target_humidity = 70 + rng.randint(-10, 10)
         
         # 湿度平滑变化
         if abs(self.humidity - target_humidity) > 1:
@@ -1319,7 +3239,7 @@ class SeasonalTree:
         self.leaf_transition_speed = 1.5  # 春天叶子变化速度较快
         
         # 清空下落的叶子
-        self.falling_leaves = []
+        self.falling_leaves.clear()
         
         # 春天天气和环境参数
         self.temperature = 15  # 春天温度适中
@@ -1347,7 +3267,7 @@ class SeasonalTree:
         self.leaf_transition_speed = 1.0  # 夏天叶子稳定
         
         # 清空下落的叶子
-        self.falling_leaves = []
+        self.falling_leaves.clear()
         
         # 夏天天气和环境参数
         self.temperature = 28  # 夏天温度高
@@ -1414,11 +3334,12 @@ class SeasonalTree:
         self.soil_color = (240, 240, 250)  # 雪地
         
         # 停止落叶
-        self.falling_leaves = []
+        self.falling_leaves.clear()
         
         # 确保冬天有下雪现象
         self.current_weather = 3  # 设置为下雪天气
     
+    @profiled
     def apply_seasonal_effect(self):
         """根据当前季节应用相应效果"""
         if self.current_season == 0:  # 春
@@ -1444,69 +3365,112 @@ class SeasonalTree:
         # 生成新的树叶
         self.generate_leaves()
     
+    @profiled
     def generate_leaves(self):
         """生成树叶，使叶子位置固定不闪烁"""
+        slots = self.leaf_slots
         # 限制叶子数量不超过位置数量
-        effective_count = min(self.leaf_count, len(self.leaf_positions))
+        effective_count = min(self.leaf_count, slots.capacity)
         
         # 如果已有叶子，则保持现有叶子位置不变，只增加或减少叶子
-        if hasattr(self, 'leaves') and self.leaves:
-            current_count = len(self.leaves)
+        if slots:
+            current_count = len(slots)
             
             if effective_count > current_count:
-                # 需要添加新叶子
-                # 找出当前未使用的位置
-                used_positions = set((leaf[0], leaf[1]) for leaf in self.leaves)
-                available_positions = [pos for pos in self.leaf_positions if pos not in used_positions]
-                
-                # 如果可用位置不足，就随机使用已有位置
-                if len(available_positions) < (effective_count - current_count):
-                    available_positions = self.leaf_positions
-                
-                # 随机选择需要的数量的新位置
-                new_positions = random.sample(available_positions, effective_count - current_count)
-                
-                # 添加新叶子
-                for x, y in new_positions:
-                    # 随机大小变化但保持稳定
-                    size_variation = random.uniform(0.9, 1.1)
-                    size = self.leaf_size * size_variation
-                    self.leaves.append((x, y, size))
+                # 从空闲槽位中随机选择新位置，耗时只与新增的叶子数量有关
+                self.grow_leaves(slots.allocate(effective_count - current_count))
                     
             elif effective_count < current_count:
                 # 需要移除一些叶子，按季节特点移除
-                if self.current_season == 2:  # 秋天，主要从底部移除叶子
-                    # 按高度排序，移除最低的叶子
-                    self.leaves.sort(key=lambda leaf: -leaf[1])  # 从高到低排序
-                    self.leaves = self.leaves[:effective_count]
+                if self.current_season == 2:  # 秋天，按高度顺序移除叶子
+                    self.detach_lowest_leaves(current_count - effective_count)
                 else:  # 其他季节随机移除
-                    # 随机抽样保留指定数量的叶子
-                    indices = list(range(len(self.leaves)))
-                    random.shuffle(indices)
-                    self.leaves = [self.leaves[i] for i in indices[:effective_count]]
+                    self.detach_random_leaves(current_count - effective_count)
         else:
             # 如果还没有叶子，需要初始化
-            self.leaves = []
             if effective_count > 0:
                 # 按季节特点选择叶子位置
                 if self.current_season in [0, 1]:  # 春夏
                     # 优先选择树顶部的位置
-                    positions_with_height = [(pos, 1.0 - (pos[1] / self.ground_level)) for pos in self.leaf_positions]
-                    positions_with_height.sort(key=lambda x: -x[1])  # 按高度降序排序
-                    positions_to_use = [pos for pos, _ in positions_with_height[:effective_count]]
+                    indices = np.argsort(self.leaf_positions[:, 1], kind='stable')[:effective_count]
+                    slots.take(indices)
                 else:  # 秋冬
                     # 均匀随机选择
-                    positions_to_use = random.sample(self.leaf_positions, effective_count)
-                
-                # 创建叶子
-                for x, y in positions_to_use:
-                    # 随机大小变化但保持稳定
-                    size_variation = random.uniform(0.9, 1.1)
-                    size = self.leaf_size * size_variation
-                    
-                    # 保存叶子
-                    self.leaves.append((x, y, size))
+                    indices = slots.allocate(effective_count)
+                self.set_leaf_sizes(indices)
+            
+            # 树叶全部重新生成，重新烘焙树冠
+            if self.canopy is not None:
+                self.canopy.clear()
+                self.canopy.add_leaves(self.leaf_tuples(slots.occupied()))
+    
+    def set_leaf_sizes(self, indices):
+        """为新长出的叶子随机设定大小（随机大小变化但保持稳定）"""
+        self.leaf_slots.size[indices] = self.leaf_size * self.leaf_slots.rng.uniform(0.9, 1.1, len(indices))
+    
+    def grow_leaves(self, indices):
+        """在已分配的槽位上长出新叶子，并烘焙到树冠层"""
+        self.set_leaf_sizes(indices)
+        self.canopy_add(self.leaf_tuples(indices))
+    
+    def leaf_tuples(self, indices):
+        """把槽位下标转换为(x, y, 大小, 类型)元组列表，供树冠层和落叶使用"""
+        indices = np.asarray(indices, dtype=np.int64)
+        return [(x, y, size, leaf_type) for (x, y), size, leaf_type in
+                zip(self.leaf_positions[indices].tolist(), self.leaf_slots.size[indices].tolist(),
+                    self.leaf_types[indices].tolist())]
+    
+    def leaves_near(self, x, y, radius):
+        """距离(x, y)不超过radius的、树上现有叶子的槽位"""
+        slots = self.leaf_grid.query_radius(x, y, radius)
+        return slots[self.leaf_slots.is_occupied(slots)]
+    
+    def leaves_near_path(self, points, radius):
+        """距离折线不超过radius的、树上现有叶子的槽位"""
+        slots = self.leaf_grid.query_path(points, radius)
+        return slots[self.leaf_slots.is_occupied(slots)]
     
+    def detach_leaves(self, indices):
+        """把指定槽位上的叶子从树上摘下：释放槽位、从树冠层擦除，返回叶子元组"""
+        leaves = self.leaf_tuples(indices)
+        self.leaf_slots.release(indices)
+        self.canopy_remove(leaves)
+        return leaves
+    
+    def detach_lowest_leaves(self, k):
+        """按高度顺序摘下k片叶子（秋天落叶），返回叶子元组"""
+        leaves = self.leaf_tuples(self.leaf_slots.release_lowest(k))
+        self.canopy_remove(leaves)
+        return leaves
+    
+    def detach_random_leaves(self, k):
+        """随机摘下k片叶子（不足k片时全部摘下），返回叶子元组"""
+        leaves = self.leaf_tuples(self.leaf_slots.release_random(k))
+        self.canopy_remove(leaves)
+        return leaves
+    
+    def canopy_add(self, leaves):
+        """把新增的叶子烘焙到树冠层（树冠层尚未创建时忽略）"""
+        if self.canopy is not None:
+            self.canopy.add_leaves(leaves)
+    
+    def canopy_remove(self, leaves):
+        """从树冠层擦除被移除的叶子"""
+        if self.canopy is not None:
+            self.canopy.remove_leaves(leaves)
+    
+    def build_canopy(self):
+        """根据所有叶子位置的包围盒创建树冠层，并烘焙当前叶子"""
+        margin = int(math.ceil(self.max_leaf_size * 1.1 * 1.6)) + 4
+        (min_x, min_y), (max_x, max_y) = self.leaf_positions.min(axis=0), self.leaf_positions.max(axis=0)
+        left = int(min_x) - margin
+        top = int(min_y) - margin
+        rect = pygame.Rect(left, top, int(max_x) + margin - left, int(max_y) + margin - top)
+        canopy = CanopyLayer(rect)
+        canopy.add_leaves(self.leaf_tuples(self.leaf_slots.occupied()))
+        return canopy
+    
+    @profiled
     def draw_grass(self):
         """绘制草地"""
         for blade in self.grass_blades:
@@ -1525,7 +3489,7 @@ class SeasonalTree:
                 grass_color = (220, 220, 230)  # 雪覆盖的草
             
             # 计算草的摆动
-            sway = math.sin(self.animation_frame * 0.05 + blade['phase']) * 2 * self.wind_strength
+            sway = math.sin(self.render_frame * 0.05 + blade['phase']) * 2 * self.wind_strength
             
             # 绘制草叶
             pygame.draw.line(
@@ -1536,52 +3500,186 @@ class SeasonalTree:
                 1
             )
     
-    def draw_buttons(self):
-        """绘制所有实体按钮"""
+    def button_state(self, button, mouse_pos):
+        """按钮当前的显示状态：(背景颜色, 文字)"""
+        # 确定按钮颜色（悬停、激活或默认）
+        color = button['color']
+        
+        # 检查是否是当前选中的季节或天气
+        is_active = False
+        if button['action'] == 'season' and button['value'] == self.current_season:
+            is_active = True
+        elif button['action'] == 'weather' and button['value'] == self.current_weather:
+            is_active = True
+        elif button['action'] == 'pause' and self.paused:
+            is_active = True
+            
+        if is_active:
+            color = button['active_color']
+        elif button['rect'].collidepoint(mouse_pos):
+            color = button['hover_color']
+        
+        button_text = button['text']
+        # 对于暂停按钮，根据状态显示不同文字
+        if button['action'] == 'pause':
+            button_text = "继续" if self.paused else "暂停"
+        return color, button_text
+    
+    @profiled
+    def draw_buttons(self, buttons=None):
+        """绘制实体按钮，buttons为空时绘制所有按钮"""
         mouse_pos = pygame.mouse.get_pos()
         
-        for button in self.buttons:
-            # 确定按钮颜色（悬停、激活或默认）
-            color = button['color']
-            
-            # 检查是否是当前选中的季节或天气
-            is_active = False
-            if button['action'] == 'season' and button['value'] == self.current_season:
-                is_active = True
-            elif button['action'] == 'weather' and button['value'] == self.current_weather:
-                is_active = True
-            elif button['action'] == 'pause' and self.paused:
-                is_active = True
-                
-            if is_active:
-                color = button['active_color']
-            elif button['rect'].collidepoint(mouse_pos):
-                color = button['hover_color']
+        for button in self.buttons if buttons is None else buttons:
+            color, button_text = self.button_state(button, mouse_pos)
+            self.screen.blit(self.get_button_surface(button, color, button_text), button['rect'])
+    
+    def get_button_surface(self, button, color, button_text):
+        """返回按钮在某个状态下预先渲染好的表面（背景、边框和文字）"""
+        surfaces = button.setdefault('surfaces', {})
+        surface = surfaces.get((color, button_text))
+        if surface is None:
+            surface = pygame.Surface(button['rect'].size)
             
             # 绘制按钮背景
-            pygame.draw.rect(self.screen, color, button['rect'])
-            pygame.draw.rect(self.screen, (50, 50, 50), button['rect'], 2)  # 加粗边框
+            pygame.draw.rect(surface, color, surface.get_rect())
+            pygame.draw.rect(surface, (50, 50, 50), surface.get_rect(), 2)  # 加粗边框
             
             # 绘制按钮文本
-            button_text = button['text']
-            # 对于暂停按钮，根据状态显示不同文字
-            if button['action'] == 'pause':
-                button_text = "继续" if self.paused else "暂停"
-            
             if button['action'] == 'season':
                 text = self.font.render(button_text, True, (0, 0, 0))  # 黑色文字，更醒目
             else:
                 text = self.small_font.render(button_text, True, (255, 255, 255))
-            text_rect = text.get_rect(center=button['rect'].center)
-            self.screen.blit(text, text_rect)
+            text_rect = text.get_rect(center=surface.get_rect().center)
+            surface.blit(text, text_rect)
+            
+            surface = self.convert_surface(surface, alpha=False)
+            surfaces[(color, button_text)] = surface
+        return surface
+    
+    def prerender_buttons(self):
+        """预先渲染每个按钮的普通、悬停和激活状态"""
+        for button in self.buttons:
+            texts = ["继续", "暂停"] if button['action'] == 'pause' else [button['text']]
+            for color in (button['color'], button['hover_color'], button['active_color']):
+                for button_text in texts:
+                    self.get_button_surface(button, color, button_text)
     
+    def render_text(self, font, text, color):
+        """渲染文字，结果按(字体, 文字, 颜色)缓存，内容不变时不重新渲染"""
+        return self.text_cache.get((id(font), text, color),
+                                   lambda: self.convert_surface(font.render(text, True, color)))
+    
+    def info_panel_rect(self):
+        """信息面板在屏幕上的区域"""
+        return pygame.Rect(0, self.height - 80, self.width, 80)
+    
+    def info_panel_texts(self):
+        """信息面板显示的文字：(季节, 天数, 时间, 天气, 温度, 湿度, 风力, 暂停状态)"""
+        return (f"当前季节: {self.seasons[self.current_season]}",
+                f"第 {self.current_day} 天",
+                f"时间: {int(self.current_time):02d}:00",
+                f"天气: {self.weather_conditions[self.current_weather]}",
+                f"温度: {self.temperature:.1f}°",
+                f"湿度: {int(self.humidity)}%",
+                f"风力: {float(self.wind_strength):.1f}",
+                "[ 已暂停 ]" if self.paused else "")
+    
+    def entity_counts(self):
+        """各子系统当前的实体数量"""
+        return {
+            'leaves': len(self.leaf_slots),
+            'falling_leaves': len(self.falling_leaves),
+            'black_leaves': len(self.black_leaves),
+            'raindrops': len(self.raindrops),
+            'snowflakes': len(self.snowflakes),
+            'clouds': len(self.clouds),
+            'insects': len(self.insects),
+            'birds': len(self.birds),
+            'stars': len(self.star_field),
+            'forest_trees': len(self.forest_trees)
+        }
+    
+    def profiler_rect(self):
+        """性能面板在屏幕上的区域"""
+        return pygame.Rect(140, 70, 360, 330)
+    
+    def build_profiler_panel(self, rect):
+        """绘制性能面板的背景和文字：整帧及耗时最多的阶段的分位数，以及各子系统的实体数量"""
+        panel = pygame.Surface(rect.size, pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 170))
+        profiler = self.profiler
+        font = self.small_font
+        
+        p50, p95, p99 = profiler.percentiles()
+        lines = [(f"帧 (ms)", f"{p50:6.2f} {p95:6.2f} {p99:6.2f}", (255, 255, 255))]
+        # 按p95从大到小列出各阶段
+        stats = sorted(((profiler.percentiles(name), name) for name in profiler.samples), reverse=True,
+                       key=lambda item: item[0][1])
+        colors = self.profiler_colors()
+        for (p50, p95, p99), name in stats[:10]:
+            color = colors.get(name, (200, 200, 200))
+            lines.append((name, f"{p50:6.2f} {p95:6.2f} {p99:6.2f}", color))
+        counts = [f"{name} {count}" for name, count in self.entity_counts().items() if count]
+        for i in range(0, len(counts), 4):
+            lines.append(("  ".join(counts[i:i + 4]), "", (180, 220, 255)))
+        
+        # 阶段名和分位数（p50 p95 p99）分两列
+        y = 104
+        for name, numbers, color in lines:
+            panel.blit(font.render(name, True, color), (8, y))
+            if numbers:
+                panel.blit(font.render(numbers, True, color), (190, y))
+            y += font.get_linesize()
+        return self.convert_surface(panel)
+    
+    def profiler_colors(self):
+        """堆叠图中每个顶层阶段的颜色"""
+        palette = [(90, 170, 250), (250, 170, 60), (120, 220, 120), (230, 90, 200), (240, 240, 90), (160, 160, 160)]
+        return {name: palette[i % len(palette)] for i, name in enumerate(self.profiler.top_level)}
+    
+    @profiled
+    def draw_profiler(self):
+        """绘制性能面板：顶层阶段耗时的堆叠图（虚线为16.7毫秒）、分位数和实体数量"""
+        if not self.show_profiler:
+            return
+        rect = self.profiler_rect()
+        profiler = self.profiler
+        if self.profiler_panel is None or profiler.frames - self.profiler_panel_frame >= self.profiler_refresh:
+            self.profiler_panel = self.build_profiler_panel(rect)
+            self.profiler_panel_frame = profiler.frames
+        self.screen.blit(self.profiler_panel, rect)
+        
+        # 堆叠图：每一列（2像素宽）是一帧，从下到上依次是各顶层阶段的耗时，整个图高对应33.3毫秒
+        graph = pygame.Rect(rect.x + 8, rect.y + 8, rect.width - 16, 90)
+        names = [name for name in profiler.top_level if name in profiler.samples]
+        if not names:
+            return
+        values = np.stack([profiler.recent(profiler.samples[name], graph.width // 2) for name in names], axis=1)
+        heights = np.cumsum(values, axis=1) * (graph.height / 0.0333)
+        y = np.arange(graph.height, dtype=np.float32)[::-1] + 0.5  # 像素中心离图底部的高度
+        # 每个像素属于哪个阶段：低于第k个累计高度的最小k，超过所有阶段时为背景
+        level = np.zeros((len(values), graph.height), dtype=np.uint8)
+        for k in range(len(names)):
+            level += y[None, :] >= heights[:, k, None]
+        colors = self.profiler_colors()
+        palette = np.array([colors[name] for name in names] + [(30, 30, 30)], dtype=np.uint8)
+        image = pygame.surfarray.make_surface(np.repeat(palette[level], 2, axis=0))
+        self.screen.blit(image, (graph.right - image.get_width(), graph.y))
+        budget_y = graph.bottom - graph.height // 2
+        for x in range(graph.x, graph.right, 8):
+            pygame.draw.line(self.screen, (255, 80, 80), (x, budget_y), (x + 3, budget_y))
+    
+    @profiled
     def draw_info_panel(self):
         """绘制信息面板"""
         # 底部半透明信息面板
-        panel_rect = pygame.Rect(0, self.height - 80, self.width, 80)
-        panel_surface = pygame.Surface((self.width, 80), pygame.SRCALPHA)
-        panel_surface.fill((0, 0, 0, 128))  # 半透明黑色
-        self.screen.blit(panel_surface, panel_rect)
+        panel_rect = self.info_panel_rect()
+        if self.info_panel_surface is None:
+            panel_surface = pygame.Surface(panel_rect.size, pygame.SRCALPHA)
+            panel_surface.fill((0, 0, 0, 128))  # 半透明黑色
+            self.info_panel_surface = self.convert_surface(panel_surface)
+        self.screen.blit(self.info_panel_surface, panel_rect)
         
         # 计算面板中心位置
         panel_center_x = self.width // 2
@@ -1589,17 +3687,17 @@ class SeasonalTree:
         bottom_row_y = self.height - 40
         
         # 创建所有文本
-        season_text = self.font.render(f"当前季节: {self.seasons[self.current_season]}", True, (255, 255, 255))
-        day_text = self.font.render(f"第 {self.current_day} 天", True, (255, 255, 255))
-        time_text = self.font.render(f"时间: {int(self.current_time):02d}:00", True, (255, 255, 255))
-        weather_text = self.font.render(f"天气: {self.weather_conditions[self.current_weather]}", True, (255, 255, 255))
-        temp_text = self.font.render(f"温度: {self.temperature:.1f}°", True, (255, 255, 255))
-        humidity_text = self.font.render(f"湿度: {int(self.humidity)}%", True, (255, 255, 255))
-        wind_text = self.font.render(f"风力: {float(self.wind_strength):.1f}", True, (255, 255, 255))
+        season, day, clock, weather, temperature, humidity, wind, pause_status = self.info_panel_texts()
+        season_text = self.render_text(self.font, season, (255, 255, 255))
+        day_text = self.render_text(self.font, day, (255, 255, 255))
+        time_text = self.render_text(self.font, clock, (255, 255, 255))
+        weather_text = self.render_text(self.font, weather, (255, 255, 255))
+        temp_text = self.render_text(self.font, temperature, (255, 255, 255))
+        humidity_text = self.render_text(self.font, humidity, (255, 255, 255))
+        wind_text = self.render_text(self.font, wind, (255, 255, 255))
         
         # 添加暂停状态显示
-        pause_status = "[ 已暂停 ]" if self.paused else ""
-        pause_text = self.font.render(pause_status, True, (255, 100, 100))
+        pause_text = self.render_text(self.font, pause_status, (255, 100, 100))
         
         # 计算每行文本的总宽度，考虑暂停状态文本
         top_row_width = season_text.get_width() + time_text.get_width() + temp_text.get_width() + pause_text.get_width() + 80  # 添加间距
@@ -1631,85 +3729,98 @@ class SeasonalTree:
         self.screen.blit(humidity_text, (humidity_x, bottom_row_y))
         self.screen.blit(wind_text, (wind_x, bottom_row_y))
     
+    @profiled
     def draw_leaves(self):
-        """绘制树叶"""
-        for i, leaf in enumerate(self.leaves):
-            x, y, size = leaf
-            leaf_type = self.leaf_types[i % len(self.leaf_types)]  # 安全处理
-            
-            # 根据季节和昼夜调整叶子亮度
-            r, g, b = self.leaf_color
-            if self.current_time < 6 or self.current_time > 20:  # 夜晚
-                brightness = 0.7  # 降低亮度
-                r = int(r * brightness)
-                g = int(g * brightness)
-                b = int(b * brightness)
-            
-            color = (r, g, b)
-            
-            # 根据叶子类型绘制不同形状
-            if leaf_type == 0:  # 圆形
-                pygame.draw.circle(self.screen, color, (int(x), int(y)), int(size))
-            elif leaf_type == 1:  # 椭圆形
-                ellipse_rect = pygame.Rect(int(x - size*1.2), int(y - size*0.8), int(size*2.4), int(size*1.6))
-                pygame.draw.ellipse(self.screen, color, ellipse_rect)
-            else:  # 簇状
-                for j in range(3):
-                    angle = j * (2*math.pi/3)
-                    offset_x = math.cos(angle) * size * 0.6
-                    offset_y = math.sin(angle) * size * 0.6
-                    pygame.draw.circle(self.screen, color, (int(x + offset_x), int(y + offset_y)), int(size*0.7))
+        """绘制树叶：整个树冠是一张烘焙好的调色板表面"""
+        if len(self.leaf_positions) == 0:
+            return
+        self.update_canopy()
+        self.canopy.draw(self.screen)
+    
+    def update_canopy(self):
+        """第一次使用时创建树冠层，并根据季节和昼夜调整叶子亮度（只修改调色板）"""
+        if self.canopy is None:
+            self.canopy = self.build_canopy()
+        
+        self.canopy.set_color(self.leaf_display_color())
+    
+    def leaf_display_color(self):
+        """树上叶子的显示颜色（夜晚降低亮度）"""
+        r, g, b = self.leaf_color
+        brightness = self.sky_state()['ambient']  # 夜晚降低亮度
+        if brightness != 1.0:
+            r = int(r * brightness)
+            g = int(g * brightness)
+            b = int(b * brightness)
+        return (r, g, b)
+    
+    def build_leaf_sprite(self, leaf_type, size, rotation, color):
+        """绘制一个落叶精灵，返回(表面, 中心偏移)"""
+        if leaf_type == 0:
+            # 椭圆形，带旋转
+            base = pygame.Surface((max(1, int(size * 2)), max(1, int(size))), pygame.SRCALPHA)
+            pygame.draw.ellipse(base, color, (0, 0, size * 2, size))
+            sprite = pygame.transform.rotate(base, rotation)
+            offset = (sprite.get_width() // 2, sprite.get_height() // 2)
+        elif leaf_type == 2:
+            # 针形
+            radius = int(size * 2) + 2
+            sprite = pygame.Surface((radius * 2 + 1, radius * 2 + 1), pygame.SRCALPHA)
+            end_x = radius + math.cos(math.radians(rotation)) * size * 2
+            end_y = radius + math.sin(math.radians(rotation)) * size * 2
+            pygame.draw.line(sprite, color, (radius, radius), (int(end_x), int(end_y)), 2)
+            offset = (radius, radius)
+        else:
+            # 圆形
+            radius = int(size) + 1
+            sprite = pygame.Surface((radius * 2 + 1, radius * 2 + 1), pygame.SRCALPHA)
+            pygame.draw.circle(sprite, color, (radius, radius), int(size))
+            offset = (radius, radius)
+        return self.convert_surface(sprite), offset
     
+    def draw_leaf_system(self, leaves):
+        """绘制一组飘落的叶子：相同量化参数的叶子共用一个缓存精灵，一次blits全部绘制"""
+        n = leaves.count
+        if n == 0:
+            return
+        alpha = self.render_alpha
+        xs = (leaves.prev_x[:n] + (leaves.x[:n] - leaves.prev_x[:n]) * alpha).astype(np.int32)
+        ys = (leaves.prev_y[:n] + (leaves.y[:n] - leaves.prev_y[:n]) * alpha).astype(np.int32)
+        
+        # 向量化量化，合成整数键后去重，每种精灵只查一次缓存
+        size_q = np.maximum(2, np.rint(leaves.size[:n] / self.leaf_size_step)).astype(np.int64)
+        steps = 360 // self.leaf_rotation_step
+        rotation_q = (leaves.rotation[:n] // self.leaf_rotation_step).astype(np.int64) % steps
+        # 利用形状的对称性减少精灵数量：圆形与角度无关，椭圆旋转180度后不变
+        leaf_types = leaves.leaf_type[:n]
+        rotation_q = np.where(leaf_types == 1, 0,
+                              np.where(leaf_types == 0, rotation_q % (steps // 2), rotation_q))
+        color_q = (leaves.color[:n] >> 3).astype(np.int64)
+        keys = ((((leaf_types.astype(np.int64) * 256 + size_q) * 64 + rotation_q) * 32
+                 + color_q[:, 0]) * 32 + color_q[:, 1]) * 32 + color_q[:, 2]
+        unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        
+        sprites = []
+        offsets = np.empty((len(unique_keys), 2), dtype=np.int32)
+        for j, (key, i) in enumerate(zip(unique_keys.tolist(), first.tolist())):
+            sprite, offsets[j] = self.leaf_sprites.get(key, lambda: self.build_leaf_sprite(
+                int(leaf_types[i]), int(size_q[i]) * self.leaf_size_step,
+                int(rotation_q[i]) * self.leaf_rotation_step,
+                tuple(int(c) << 3 for c in color_q[i])))
+            sprites.append(sprite)
+        
+        # 每片叶子的精灵和左上角位置，组装成blits需要的序列
+        inverse = inverse.ravel()
+        positions = np.stack((xs - offsets[inverse, 0], ys - offsets[inverse, 1]), axis=1).tolist()
+        leaf_sprites = [sprites[k] for k in inverse.tolist()]
+        self.screen.blits(zip(leaf_sprites, positions), doreturn=False)
+    
+    @profiled
     def draw_falling_leaves(self):
         """绘制飘落的叶子"""
-        for leaf in self.falling_leaves:
-            # 获取位置和大小
-            x, y = leaf['pos']
-            size = leaf['size']
-            rotation = leaf['rotation']
-            
-            # 使用叶子自带的颜色（如果有），或者使用当前季节的叶子颜色
-            if 'color' in leaf:
-                color = leaf['color']
-            else:
-                # 使用当前季节的叶子颜色，并增加一些随机变化
-                base_color = self.current_leaf_color
-                r_var = random.randint(-15, 15)
-                g_var = random.randint(-15, 15)
-                b_var = random.randint(-15, 15)
-                
-                color = (
-                    max(0, min(255, base_color[0] + r_var)),
-                    max(0, min(255, base_color[1] + g_var)),
-                    max(0, min(255, base_color[2] + b_var))
-                )
-            
-            # 绘制带旋转效果的叶子
-            if hasattr(leaf, 'type') and leaf['type'] == 0:
-                # 椭圆形
-                rotated_rect = pygame.Surface((size * 2, size), pygame.SRCALPHA)
-                pygame.draw.ellipse(rotated_rect, color, (0, 0, size * 2, size))
-                # 叶子旋转
-                rotated_leaf = pygame.transform.rotate(rotated_rect, rotation)
-                self.screen.blit(rotated_leaf, (x - rotated_leaf.get_width() // 2, y - rotated_leaf.get_height() // 2))
-            elif hasattr(leaf, 'type') and leaf['type'] == 1:
-                # 圆形
-                pygame.draw.circle(self.screen, color, (int(x), int(y)), int(size))
-            elif hasattr(leaf, 'type') and leaf['type'] == 2:
-                # 针形
-                end_x = x + math.cos(math.radians(rotation)) * size * 2
-                end_y = y + math.sin(math.radians(rotation)) * size * 2
-                pygame.draw.line(self.screen, color, (int(x), int(y)), (int(end_x), int(end_y)), 2)
-            else:
-                # 默认形状，椭圆或圆
-                if rotation % 90 < 45:
-                    # 椭圆形
-                    ellipse_rect = pygame.Rect(int(x - size*1.2), int(y - size*0.8), int(size*2.4), int(size*1.6))
-                    pygame.draw.ellipse(self.screen, color, ellipse_rect)
-                else:
-                    # 圆形
-                    pygame.draw.circle(self.screen, color, (int(x), int(y)), int(size))
+        self.draw_leaf_system(self.falling_leaves)
 
+    @profiled
     def draw_ground(self):
         """绘制地面和土壤"""
         # 根据季节设置土壤颜色
@@ -1737,24 +3848,158 @@ class SeasonalTree:
                         (self.soil_color[0]-20, self.soil_color[1]-20, self.soil_color[2]-20),
                         (0, self.ground_level), (self.width, self.ground_level), 2)
     
-    def draw_tree(self):
-        """绘制树干和树枝"""
-        # 根据季节调整树干颜色
+    def get_trunk_color(self):
+        """根据季节返回树干颜色"""
         if self.current_season == 0:  # 春
-            trunk_color = (130, 70, 20)  # 湿润的树干
+            return (130, 70, 20)  # 湿润的树干
         elif self.current_season == 1:  # 夏
-            trunk_color = (120, 65, 15)  # 正常的树干
+            return (120, 65, 15)  # 正常的树干
         elif self.current_season == 2:  # 秋
-            trunk_color = (110, 60, 15)  # 干燥的树干
+            return (110, 60, 15)  # 干燥的树干
         else:  # 冬
-            trunk_color = (100, 55, 10)  # 寒冷的树干
+            return (100, 55, 10)  # 寒冷的树干
+    
+    def convert_surface(self, surface, alpha=True):
+        """将表面转换为显示格式，加快blit；没有显示窗口时原样返回"""
+        if pygame.display.get_surface() is None:
+            return surface
+        return surface.convert_alpha() if alpha else surface.convert()
+    
+    def build_tree_layer(self, trunk_color):
+        """把所有树枝一次性绘制到透明表面上，返回表面及其在屏幕上的偏移"""
+        # 计算树枝的包围盒，留出线宽余量
+        margin = max(int(thickness) for _, _, thickness in self.branches) + 2
+        xs = [p[0] for start, end, _ in self.branches for p in (start, end)]
+        ys = [p[1] for start, end, _ in self.branches for p in (start, end)]
+        left = int(math.floor(min(xs))) - margin
+        top = int(math.floor(min(ys))) - margin
+        right = int(math.ceil(max(xs))) + margin
+        bottom = int(math.ceil(max(ys))) + margin
+        
+        layer = pygame.Surface((right - left, bottom - top), pygame.SRCALPHA)
+        for start, end, thickness in self.branches:
+            # 整数偏移保证与直接画在屏幕上的像素完全一致
+            pygame.draw.line(layer, trunk_color,
+                             (start[0] - left, start[1] - top),
+                             (end[0] - left, end[1] - top), int(thickness))
+        return self.convert_surface(layer), (left, top)
+    
+    @profiled
+    def draw_tree(self):
+        """绘制树干和树枝（使用缓存的树层）"""
+        self.screen.blit(self.get_tree_layer(), self.tree_layer_offset)
+    
+    def get_tree_layer(self):
+        """返回缓存的树层，只在几何或季节变化时重绘"""
+        # 根据季节调整树干颜色
+        trunk_color = self.get_trunk_color()
         
-        # 绘制树枝，考虑粗细
-        for branch in self.branches:
-            start, end, thickness = branch
-            # 主干更粗，次级分支更细
-            pygame.draw.line(self.screen, trunk_color, start, end, int(thickness))
+        key = (self.branch_version, self.current_season, trunk_color)
+        if self.tree_layer is None or self.tree_layer_key != key:
+            self.tree_layer, self.tree_layer_offset = self.build_tree_layer(trunk_color)
+            self.tree_layer_key = key
+        return self.tree_layer
+    
+    def update_forest(self):
+        """按共用环境的季节进度向量化更新每棵背景树的物候阶段、叶子比例和颜色，每棵树有自己的物候偏移"""
+        if not self.forest_trees:
+            return
+        stages = self.forest_stages
+        progress = self.current_season + self.current_day / self.days_per_season + self.forest_phase
+        stage = np.floor(progress * stages).astype(np.int32) % (4 * stages)
+        if self.forest_stage is not None and np.array_equal(stage, self.forest_stage):
+            return
+        self.forest_stage = stage
+        if self.forest_stage_table is None:
+            # 每个阶段的叶子比例和颜色：关键帧在各季节的中间，首尾各补一个关键帧使插值可以跨年
+            keys = np.arange(-0.5, 5)
+            seasons = [3, 0, 1, 2, 3, 0]
+            points = np.arange(4 * stages) / stages
+            colors = np.array(self.forest_season_colors, dtype=float)[seasons]
+            self.forest_stage_table = (
+                np.interp(points, keys, np.array(self.forest_season_leaves)[seasons]),
+                np.column_stack([np.interp(points, keys, colors[:, c]) for c in range(3)])
+            )
+        leaves, colors = self.forest_stage_table
+        self.forest_leaf_fraction = leaves[stage]
+        self.forest_leaf_color = colors[stage] * self.forest_tint
+    
+    def forest_display(self):
+        """每棵背景树的显示状态：叶子档位和显示颜色（计入昼夜亮度）"""
+        bands = np.rint(self.forest_leaf_fraction * self.forest_bands).astype(np.int32)
+        colors = np.clip(self.forest_leaf_color * self.sky_state()['ambient'], 0, 255).astype(np.int32)
+        return np.column_stack([bands, colors])
+    
+    def build_forest_sprite(self, variant_index, band):
+        """绘制一个原尺寸的树形变体：8位调色板表面，0为透明，树干和叶子各占一个调色板项"""
+        variant = self.forest_variants[variant_index]
+        rect = variant['rect']
+        sprite = pygame.Surface(rect.size, 0, 8)
+        sprite.set_palette_at(CanopyLayer.TRANSPARENT_INDEX, (255, 0, 255))  # 转换成显示格式后的色键
+        sprite.fill(CanopyLayer.TRANSPARENT_INDEX)
+        trunk_index = CanopyLayer.LEAF_INDEX + 1
+        for start, end, thickness in variant['branches']:
+            pygame.draw.line(sprite, trunk_index, (start[0] - rect.x, start[1] - rect.y),
+                             (end[0] - rect.x, end[1] - rect.y), int(thickness))
+        # 叶子按固定顺序保留，档位越高叶子越多；远处的树看不出叶子大小的变化，使用固定大小
+        shown = variant['leaf_order'][:len(variant['leaf_order']) * band // self.forest_bands]
+        if len(shown):
+            canopy = CanopyLayer(rect)
+            canopy.add_leaves([(x, y, self.max_leaf_size * 0.8, leaf_type) for (x, y), leaf_type in
+                               zip(variant['leaf_positions'][shown].tolist(), variant['leaf_types'][shown].tolist())])
+            pixels = pygame.surfarray.pixels2d(sprite)
+            pixels[pygame.surfarray.pixels2d(canopy.surface) == CanopyLayer.LEAF_INDEX] = CanopyLayer.LEAF_INDEX
+            del pixels
+        return sprite
+    
+    def get_forest_sprite(self, tree, band):
+        """取出一棵森林树木的缩放精灵，同一变体、缩放档位和叶子档位的树共用一个精灵，颜色由调用者设置"""
+        def build():
+            base = self.forest_sprites.get(('base', tree['variant'], band),
+                                           lambda: self.build_forest_sprite(tree['variant'], band))
+            sprite = pygame.transform.scale(base, tree['rect'].size)
+            sprite.set_colorkey(CanopyLayer.TRANSPARENT_INDEX)
+            return sprite
+        return self.forest_sprites.get((tree['variant'], tree['scale'], band), build)
+    
+    def update_forest_instances(self):
+        """为显示状态变化的背景树重新着色：把这棵树的颜色写入共用几何精灵的调色板，再复制成可以快速绘制的表面"""
+        state = (self.get_trunk_color(), self.forest_display())
+        previous = self.forest_instance_state
+        if previous is None or previous[0] != state[0]:
+            changed = range(len(self.forest_trees))
+        else:
+            changed = np.flatnonzero((state[1] != previous[1]).any(axis=1)).tolist()
+        self.forest_instance_state = state
+        trunk_color = state[0]
+        display = state[1].tolist()
+        for i in changed:
+            tree = self.forest_trees[i]
+            band, r, g, b = display[i]
+            sprite = self.get_forest_sprite(tree, band)
+            sprite.set_palette_at(CanopyLayer.LEAF_INDEX, (r, g, b))
+            sprite.set_palette_at(CanopyLayer.LEAF_INDEX + 1, trunk_color)
+            instance = self.convert_surface(sprite.copy(), alpha=False)
+            instance.set_colorkey((255, 0, 255), pygame.RLEACCEL)
+            self.forest_instances[i] = instance
+            self.forest_damage.append(tree['rect'])
+    
+    @profiled
+    def draw_forest(self, clip=None):
+        """绘制背景森林；clip不为空时只绘制与该区域相交的树"""
+        if not self.forest_trees:
+            return
+        self.update_forest_instances()
+        if clip is None:
+            self.forest_damage = []
+            indices = range(len(self.forest_trees))
+        else:
+            indices = clip.collidelistall(self.forest_rects)
+        instances = self.forest_instances
+        rects = self.forest_rects
+        self.screen.blits([(instances[i], rects[i]) for i in indices], doreturn=False)
     
+    @profiled
     def draw_wildlife(self):
         """绘制野生动物（昆虫和鸟类）"""
         # 只在春夏绘制昆虫和鸟类
@@ -1765,9 +4010,9 @@ class SeasonalTree:
         if self.current_season == 0:  # 春天
             # 绘制蝴蝶
             for insect in self.insects:
-                x, y = insect['pos']
+                x, y = self.lerp_pos(insect.get('prev_pos', insect['pos']), insect['pos'])
                 size = insect['size']
-                phase = insect['phase'] + self.animation_frame * 0.2
+                phase = insect['phase'] + self.render_frame * 0.2
                 
                 # 蝴蝶翅膀
                 wing_open = (math.sin(phase) + 1) / 2  # 0-1 之间波动
@@ -1796,7 +4041,7 @@ class SeasonalTree:
         elif self.current_season == 1:  # 夏天
             # 绘制蜜蜂
             for insect in self.insects:
-                x, y = insect['pos']
+                x, y = self.lerp_pos(insect.get('prev_pos', insect['pos']), insect['pos'])
                 size = insect['size']
                 
                 # 蜜蜂身体
@@ -1810,10 +4055,10 @@ class SeasonalTree:
         
         # 绘制鸟
         for bird in self.birds:
-            x, y = bird['pos']
+            x, y = self.lerp_pos(bird.get('prev_pos', bird['pos']), bird['pos'])
             size = bird['size']
             direction = bird['direction']
-            phase = bird['phase'] + self.animation_frame * 0.1
+            phase = bird['phase'] + self.render_frame * 0.1
             
             # 鸟翅膀扇动
             wing_y = math.sin(phase) * size * 0.5
@@ -1837,27 +4082,15 @@ class SeasonalTree:
 
     def generate_stars(self, count):
         """生成星星，为每颗星星分配位置、大小和闪烁周期"""
-        self.stars = []
-        for _ in range(count):
-            # 随机生成星星的位置和大小
-            x = random.randint(0, self.width)
-            y = random.randint(0, self.ground_level - 100)
-            size = random.uniform(0.8, 2.0)
-            
-            # 为每颗星星分配不同的闪烁周期和初始相位，使闪烁看起来不同步
-            blink_speed = random.uniform(0.01, 0.03)  # 更慢的闪烁速度
-            phase = random.uniform(0, 2 * math.pi)  # 随机初相位
-            
-            self.stars.append({
-                'x': x,
-                'y': y,
-                'size': size,
-                'blink_speed': blink_speed,
-                'phase': phase
-            })
+        self.star_field.generate(count, self.width, self.ground_level - 100)
 
+    @profiled
     def update_astronomical_bodies(self):
         """更新太阳和月亮的位置"""
+        # 记录上一步位置用于插值
+        self.prev_sun_pos = self.sun_pos
+        self.prev_moon_pos = self.moon_pos
+        
         # 计算时间对应的角度（0-24小时映射到0-2π）
         time_angle = (self.current_time / 24) * 2 * math.pi
         
@@ -1891,127 +4124,642 @@ class SeasonalTree:
                              int(200 * moon_height_factor), 
                              int(200 * moon_height_factor))
 
+    @profiled
     def draw_astronomical_bodies(self):
         """绘制太阳和月亮"""
+        sun_x, sun_y = self.lerp_pos(self.prev_sun_pos, self.sun_pos)
+        moon_x, moon_y = self.lerp_pos(self.prev_moon_pos, self.moon_pos)
+        
         # 根据时间调整亮度
-        if 6 <= self.current_time <= 18:  # 白天
+        if self.sky_state()['sun']:  # 白天
             # 绘制太阳
             pygame.draw.circle(self.screen, self.sun_color, 
-                             (int(self.sun_pos[0]), int(self.sun_pos[1])), 
+                             (int(sun_x), int(sun_y)), 
                              self.sun_radius)
             # 太阳光芒（随高度变化）
             # 太阳光芒
             for i in range(8):
                 angle = i * (math.pi / 4)
-                start_x = self.sun_pos[0] + math.cos(angle) * self.sun_radius
-                start_y = self.sun_pos[1] + math.sin(angle) * self.sun_radius
-                end_x = self.sun_pos[0] + math.cos(angle) * (self.sun_radius + 10)
-                end_y = self.sun_pos[1] + math.sin(angle) * (self.sun_radius + 10)
+                start_x = sun_x + math.cos(angle) * self.sun_radius
+                start_y = sun_y + math.sin(angle) * self.sun_radius
+                end_x = sun_x + math.cos(angle) * (self.sun_radius + 10)
+                end_y = sun_y + math.sin(angle) * (self.sun_radius + 10)
                 pygame.draw.line(self.screen, self.sun_color, 
                                (int(start_x), int(start_y)), 
                                (int(end_x), int(end_y)), 2)
         else:  # 夜晚
             # 绘制月亮（固定圆形）
-            if self.moon_pos[1] < self.ground_level:  # 只有当月亮在地面以上时才绘制
+            if moon_y < self.ground_level:  # 只有当月亮在地面以上时才绘制
                 pygame.draw.circle(self.screen, self.moon_color, 
-                                 (int(self.moon_pos[0]), int(self.moon_pos[1])), 
+                                 (int(moon_x), int(moon_y)), 
                                  self.moon_radius)
 
+    @profiled
     def handle_lightning(self):
         """处理闪电效果"""
         # 只在雷暴天气下随机触发闪电
         if self.current_weather == 4:  # 雷暴天气
-            if random.random() < 0.02:  # 2%的概率触发闪电
+            if self.streams.effects.random() < self.scaled_rate(self.lightning_chance):  # 默认2%的概率触发闪电
                 self.lightning_active = True
                 self.lightning_timer = 0
                 self.lightning_strike_pos = None
         
         if self.lightning_active:
-            self.lightning_timer += 1
+            # 闪电路径每个模拟步变化一次，绘制时只添加发光抖动，与帧率无关
+            self.lightning_bolt = self.generate_lightning_bolt()
+            self.lightning_timer += self.tick_scale
             if self.lightning_timer >= self.lightning_duration:
                 self.lightning_active = False
                 self.lightning_timer = 0
                 
-                # 随机选择一些叶子变成黑色
-                if self.leaves:
-                    # 确保不会选择超过现有叶子数量的索引
-                    num_leaves_to_blacken = min(20, len(self.leaves))
-                    if num_leaves_to_blacken > 0:
-                        # 创建叶子索引的副本，避免在循环中修改列表
-                        leaf_indices = list(range(len(self.leaves)))
-                        blackened_indices = random.sample(leaf_indices, num_leaves_to_blacken)
-                        # 按降序排序，这样从后往前删除不会影响前面的索引
-                        blackened_indices.sort(reverse=True)
-                        
-                        for idx in blackened_indices:
-                            if 0 <= idx < len(self.leaves):  # 额外的安全检查
-                                leaf = self.leaves[idx]
-                                self.black_leaves.append({
-                                    'pos': (leaf[0], leaf[1]),
-                                    'size': leaf[2],
-                                    'speed': random.uniform(1.0, 3.0),
-                                    'swing': random.uniform(-3, 3),
-                                    'rotation': random.uniform(0, 360),
-                                    'rotation_speed': random.uniform(-8, 8)
-                                })
-                                # 从原位置移除叶子
-                                self.leaves.pop(idx)
-    
-    def draw_lightning(self):
-        """绘制闪电效果"""
+                # 闪电路径附近的叶子被烧焦变成黑色
+                bolt, self.lightning_bolt = self.lightning_bolt, None
+                if self.leaf_slots:
+                    blackened = self.detach_leaves(self.leaves_near_path(bolt, self.lightning_char_radius))
+                    self.leaf_count = len(self.leaf_slots)
+                    self.drop_leaves(blackened, speed=(1.0, 3.0), swing=(-3, 3), rotation_speed=(-8, 8),
+                                     color=(0, 0, 0), leaf_type=1, target=self.black_leaves)
+    
+    def generate_lightning_bolt(self):
+        """生成一条从起始点到地面的闪电路径（模拟状态）"""
+        rng = self.streams.effects
+        if not self.lightning_strike_pos:
+            # 随机选择闪电起始点（天空中的某个位置）
+            self.lightning_strike_pos = (rng.randint(100, self.width - 100), rng.randint(50, 150))
+        start_x, start_y = self.lightning_strike_pos
+        
+        # 一次生成足够多的随机偏移，截取到第一次到达地面的那一段
+        steps = max(1, int(math.ceil((self.ground_level - start_y) / 10)))
+        xs = start_x + np.cumsum(rng.generator.uniform(-20, 20, steps))
+        ys = start_y + np.cumsum(rng.generator.uniform(10, 30, steps))
+        end = int(np.searchsorted(ys, self.ground_level)) + 1
+        return [self.lightning_strike_pos] + list(zip(xs[:end].tolist(), ys[:end].tolist()))
+    
+    def lightning_path(self):
+        """本帧的闪电路径，返回(主闪电的点, 发光线的点列表)；发光抖动只影响画面"""
+        points = self.lightning_bolt or []
+        
+        # 闪电发光效果
+        jitter = self.streams.render.generator.uniform(-2, 2, (3, len(points), 2))
+        glows = [[tuple(point) for point in (np.array(points).reshape(-1, 2) + offsets).tolist()]
+                 for offsets in jitter]
+        return points, glows
+    
+    @profiled
+    def draw_lightning(self, path=None):
+        """绘制闪电效果；path为空时生成新的闪电路径"""
         if self.lightning_active:
-            # 创建闪电路径
-            if not self.lightning_strike_pos:
-                # 随机选择闪电起始点（天空中的某个位置）
-                start_x = random.randint(100, self.width - 100)
-                start_y = random.randint(50, 150)
-                self.lightning_strike_pos = (start_x, start_y)
-            
-            # 绘制主闪电
-            points = [self.lightning_strike_pos]
-            current_x, current_y = self.lightning_strike_pos
-            
-            # 生成闪电路径
-            while current_y < self.ground_level:
-                # 添加随机偏移
-                current_x += random.uniform(-20, 20)
-                current_y += random.uniform(10, 30)
-                points.append((current_x, current_y))
+            points, glows = path if path is not None else self.lightning_path()
             
             # 绘制闪电
             if len(points) > 1:
                 pygame.draw.lines(self.screen, (255, 255, 255), False, points, 3)
                 
                 # 添加闪电发光效果
-                for i in range(3):
-                    glow_points = [(x + random.uniform(-2, 2), y + random.uniform(-2, 2)) 
-                                 for x, y in points]
+                for glow_points in glows:
                     pygame.draw.lines(self.screen, (200, 200, 255), False, glow_points, 1)
     
+    @profiled
+    def update_black_leaves(self):
+        """更新被雷劈中的黑色叶子的位置和旋转"""
+        self.black_leaves.update(0.0, self.ground_level, self.tick_scale)
+    
+    @profiled
     def draw_black_leaves(self):
         """绘制被雷劈中的黑色叶子"""
-        for leaf in self.black_leaves:
-            x, y = leaf['pos']
-            size = leaf['size']
-            rotation = leaf['rotation']
-            
-            # 绘制黑色叶子
-            pygame.draw.circle(self.screen, (0, 0, 0), (int(x), int(y)), int(size))
-            
-            # 更新位置和旋转
-            leaf['pos'] = (x + leaf['swing'], y + leaf['speed'])
-            leaf['rotation'] = (leaf['rotation'] + leaf['rotation_speed']) % 360
-            
-            # 如果叶子落到地面，移除它
-            if y > self.ground_level:
-                self.black_leaves.remove(leaf)
+        self.draw_leaf_system(self.black_leaves)
+    
+def create_tree(options, headless=False):
+    """按选项创建一棵树；界面、无界面和回放共用，相同的选项得到相同的初始状态"""
+    tree = SeasonalTree(headless=headless, tree_seed=options.get('tree_seed'), seed=options.get('seed'),
+                        tree_shape=options.get('tree_shape'))
+    stars = options.get('stars', 100)
+    if stars != len(tree.star_field):
+        tree.generate_stars(stars)
+    if options.get('forest'):
+        tree.generate_forest(options['forest'])
+    cloud_density = options.get('cloud_density', 1.0)
+    if cloud_density != tree.cloud_density:
+        tree.cloud_density = cloud_density
+        tree.generate_clouds(5)
+    if options.get('restore'):
+        tree.load_snapshot(options['restore'])
+    if options.get('tick_rate'):
+        tree.set_tick_rate(options['tick_rate'])
+    return tree
+
+def load_recording(path):
+    """读取save_recording()保存的输入录制，命令按步数分组到recording['schedule']"""
+    with open(path, encoding='utf-8') as f:
+        recording = json.load(f)
+    if recording.get('version') != RECORDING_FORMAT_VERSION:
+        raise ValueError(f"不支持的录制版本: {recording.get('version')}")
+    schedule = {}
+    for tick, name, args in recording['commands']:
+        schedule.setdefault(tick, []).append((name, tuple(args)))
+    recording['schedule'] = schedule
+    return recording
+
+def parse_tick_ranges(text):
+    """解析"1000-1200,5000-5100"形式的步数区间"""
+    ranges = []
+    for part in text.split(','):
+        start, _, stop = part.partition('-')
+        ranges.append((int(start), int(stop)))
+    return ranges
+
+def benchmark_leaf_positions(configs=((5, 1), (6, 1), (7, 1), (8, 1), (8, 16)), repeat=5):
+    """测量叶子位置生成的耗时随树规模的变化，configs为(树枝深度, 叶子密度)列表"""
+    tree = SeasonalTree(headless=True)
+    results = []
+    for depth, density in configs:
+        tree.tree_shape['max_depth'] = depth
+        tree.tree_shape['leaf_density'] = density
+        tree.generate_branches()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            tree.generate_leaf_positions()
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        results.append({
+            'depth': depth,
+            'density': density,
+            'branches': len(tree.branches),
+            'leaf_slots': len(tree.leaf_positions),
+            'seconds': best,
+            'slots_per_second': len(tree.leaf_positions) / best
+        })
+    return results
+
+# 集合模拟记录的轨迹及其数据类型
+ENSEMBLE_TRACES = {
+    'leaf_count': np.int32,
+    'weather': np.int8,
+    'season': np.int8,
+    'temperature': np.float32,
+    'humidity': np.float32
+}
+
+def ensemble_configs(runs, ticks, seed=0, sample_every=10, tree_seed=None, params=None, tree_shape=None):
+    """生成runs次模拟的参数：每次模拟的种子由主种子派生，params为覆盖SeasonalTree属性的参数
+    
+    树形参数决定几何，必须在创建树时传入，params中的tree_shape也会转为构造参数。
+    """
+    if ticks < 1 or sample_every < 1:
+        raise ValueError(f"模拟步数和采样间隔必须为正数: ticks={ticks}, sample_every={sample_every}")
+    params = dict(params or {})
+    tree_shape = params.pop('tree_shape', tree_shape)
+    children = np.random.SeedSequence(seed).spawn(runs)
+    return [{
+        'run': run,
+        'seed': int(child.generate_state(1)[0]),
+        'ticks': ticks,
+        'sample_every': sample_every,
+        'tree_seed': seed if tree_seed is None else tree_seed,  # 默认所有模拟使用同一棵树
+        'tree_shape': tree_shape,
+        'params': dict(params)
+    } for run, child in enumerate(children)]
+
+def run_simulation(config):
+    """运行一次无界面模拟（可在子进程中执行），返回按sample_every步采样的轨迹数组
+    
+    最后一个采样点总在最后一步，ticks不是sample_every的整数倍（或小于它）时最后一段较短。
+    """
+    seed = config['seed']
+    tree = SeasonalTree(headless=True, tree_seed=config['tree_seed'], seed=seed, tree_shape=config.get('tree_shape'))
+    for key, value in config['params'].items():
+        if not hasattr(tree, key):
+            raise ValueError(f"未知的模拟参数: {key}")
+        setattr(tree, key, value)
+    
+    every = config['sample_every']
+    ticks = config['ticks']
+    samples = -(-ticks // every)
+    traces = {name: np.empty(samples, dtype=dtype) for name, dtype in ENSEMBLE_TRACES.items()}
+    for i in range(samples):
+        tree.simulate(min(every, ticks - i * every))
+        traces['leaf_count'][i] = len(tree.leaf_slots)
+        traces['weather'][i] = tree.current_weather
+        traces['season'][i] = tree.current_season
+        traces['temperature'][i] = tree.temperature
+        traces['humidity'][i] = tree.humidity
+    return {'run': config['run'], 'seed': seed, **traces}
+
+def run_ensemble(configs, workers=None):
+    """用进程池并行运行多次模拟，按完成顺序逐个产出结果；workers=1时在当前进程中运行"""
+    if workers == 1:
+        for config in configs:
+            yield run_simulation(config)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_simulation, config) for config in configs]
+        for future in as_completed(futures):
+            yield future.result()
+
+def summarize_ensemble(results, keep_traces=False):
+    """把模拟结果逐个归约为统计量（每个采样点的均值和标准差、天气时间占比），不需要同时保存所有结果"""
+    runs = 0
+    sums = {}
+    squares = {}
+    weather_share = np.zeros(5)
+    final_leaves = []
+    kept = []
+    for result in results:
+        runs += 1
+        for name in ('leaf_count', 'temperature', 'humidity'):
+            trace = result[name].astype(np.float64)
+            sums[name] = sums.get(name, 0) + trace
+            squares[name] = squares.get(name, 0) + trace * trace
+        weather_share += np.bincount(result['weather'], minlength=5)[:5] / max(len(result['weather']), 1)
+        final_leaves.append(int(result['leaf_count'][-1]) if len(result['leaf_count']) else 0)
+        if keep_traces:
+            kept.append(result)
+    if runs == 0:
+        return {'runs': 0}
+    
+    summary = {'runs': runs, 'weather_share': weather_share / runs}
+    for name in sums:
+        mean = sums[name] / runs
+        summary[name + '_mean'] = mean
+        summary[name + '_std'] = np.sqrt(np.maximum(squares[name] / runs - mean * mean, 0))
+    summary['final_leaf_mean'] = float(np.mean(final_leaves))
+    summary['final_leaf_std'] = float(np.std(final_leaves))
+    if keep_traces:
+        # 按运行编号排序后堆叠成(运行次数, 采样点)的数组
+        kept.sort(key=lambda result: result['run'])
+        summary['seeds'] = np.array([result['seed'] for result in kept], dtype=np.uint32)
+        for name in ENSEMBLE_TRACES:
+            summary[name] = np.stack([result[name] for result in kept])
+    return summary
+
+# 基准测试场景：固定季节、天气和时刻，params覆盖SeasonalTree属性，precipitation为(雨滴容量, 雪花容量)
+BENCHMARK_SCENARIOS = {
+    'summer_full': {
+        'description': "夏天正午，叶子数达到max_leaf_count",
+        'season': 1, 'weather': 0, 'hour': 12,
+        'full_leaves': True,
+        'warmup': 50, 'ticks': 2000, 'frames': 300
+    },
+    'thunderstorm': {
+        'description': "雷暴：雨滴达到容量上限，频繁闪电",
+        'season': 1, 'weather': 4, 'hour': 16,
+        'params': {'rain_emit_rate': 2000, 'lightning_chance': 0.2},
+        'precipitation': (20000, 200),
+        'full_leaves': True,
+        'warmup': 100, 'ticks': 1000, 'frames': 300
+    },
+    'autumn_shed': {
+        'description': "秋天大风：满树的叶子持续掉落",
+        'season': 2, 'weather': 1, 'hour': 10, 'wind': 5.0,
+        'params': {'max_leaf_count': 1500},
+        'full_leaves': True,
+        'warmup': 0, 'ticks': 150, 'frames': 150
+    },
+    'winter_night_snow': {
+        'description': "冬天夜晚下大雪（下雪时天空不显示星星）",
+        'season': 3, 'weather': 3, 'hour': 23,
+        'params': {'snow_emit_rate': 100},
+        'precipitation': (500, 5000),
+        'warmup': 200, 'ticks': 2000, 'frames': 300
+    },
+    'winter_night_clear': {
+        'description': "冬天晴朗的夜晚，满天星星",
+        'season': 3, 'weather': 0, 'hour': 2, 'stars': 2000,
+        'warmup': 50, 'ticks': 2000, 'frames': 300
+    }
+}
+
+# 与基线比较的指标，以及数值越大越好还是越小越好
+BENCHMARK_METRICS = {
+    'ticks_per_second': 'higher',
+    'frames_per_second': 'higher',
+    'peak_memory_mb': 'lower'
+}
+
+def build_benchmark_tree(name, seed=0, headless=True):
+    """按场景配置创建一棵树并预热，季节、天气和时刻在测量期间保持不变"""
+    scenario = BENCHMARK_SCENARIOS[name]
+    tree = SeasonalTree(headless=headless, tree_seed=seed, seed=seed)
+    tree.verbose = False
+    tree.profiler.enabled = False
+    if 'snapshot' in scenario:
+        # 从快照的预热状态开始，保持快照中的季节、天气和时刻
+        tree.load_snapshot(scenario['snapshot'])
+        tree.days_per_season = 10 ** 9
+        tree.weather_duration = 10 ** 9
+        tree.time_speed = 0
+        return tree
+    for key, value in scenario.get('params', {}).items():
+        setattr(tree, key, value)
+    if 'precipitation' in scenario:
+        tree.set_precipitation_capacity(*scenario['precipitation'])
+    if 'stars' in scenario:
+        tree.generate_stars(scenario['stars'])
+    
+    tree.days_per_season = 10 ** 9  # 不切换季节
+    tree.change_season(scenario['season'])
+    tree.change_weather(scenario['weather'])
+    tree.weather_duration = 10 ** 9  # 不随机改变天气
+    tree.time_speed = 0
+    tree.current_time = scenario['hour']
+    if 'wind' in scenario:
+        tree.wind_strength = scenario['wind']
+    if scenario.get('full_leaves'):
+        tree.leaf_count = tree.max_leaf_count
+        tree.generate_leaves()
+    tree.simulate(scenario.get('warmup', 0))
+    return tree
+
+def snapshot_scenario(path, ticks=1000, frames=300):
+    """以快照为起点的基准测试场景"""
+    return {'description': f"从快照{path}开始", 'snapshot': path, 'ticks': ticks, 'frames': frames}
+
+def run_benchmark(name, seed=0, repeat=5):
+    """运行一个基准测试场景，返回模拟和绘制的吞吐量、各阶段耗时和内存峰值
+    
+    计时部分各重复repeat次（每次从相同的初始状态开始），吞吐量取最好的一次，与基线比较时
+    不受偶然的系统干扰影响；每次的结果和中位数也一并返回。帧耗时分位数按所有重复的帧统计。
+    """
+    scenario = BENCHMARK_SCENARIOS[name]
+    ticks, frames = scenario['ticks'], scenario['frames']
     
+    # 只模拟不绘制
+    tick_rates = []
+    for _ in range(repeat):
+        tree = build_benchmark_tree(name, seed)
+        start = time.perf_counter()
+        tree.simulate(ticks)
+        tick_rates.append(ticks / max(time.perf_counter() - start, 1e-9))
+    
+    # 每帧模拟一步并完整绘制，记录各阶段耗时
+    profiler = FrameProfiler(history=frames * repeat)
+    frame_rates = []
+    for _ in range(repeat):
+        tree = build_benchmark_tree(name, seed, headless=False)
+        tree.profiler = profiler
+        start = time.perf_counter()
+        for _ in range(frames):
+            profiler.begin_frame()
+            tree.update()
+            tree.draw()
+            profiler.end_frame()
+        frame_rates.append(frames / max(time.perf_counter() - start, 1e-9))
+    phases = {}
+    for phase, samples in sorted(profiler.samples.items()):
+        p50, p95, p99 = profiler.percentiles(phase)
+        phases[phase] = {'mean_ms': float(profiler.recent(samples).mean() * 1000),
+                         'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99}
+    p50, p95, p99 = profiler.percentiles()
+    entities = tree.entity_counts()
+    
+    # 内存峰值单独测量，tracemalloc会拖慢上面的计时；先不跟踪地创建一次，
+    # 保证树几何已经在磁盘缓存中，峰值不包含生成几何的临时内存
+    tree = None
+    build_benchmark_tree(name, seed)
+    tracemalloc.start()
+    try:
+        build_benchmark_tree(name, seed).simulate(ticks)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    
+    return {
+        'description': scenario['description'],
+        'seed': seed,
+        'ticks': ticks,
+        'frames': frames,
+        'repeat': repeat,
+        'ticks_per_second': max(tick_rates),
+        'frames_per_second': max(frame_rates),
+        'ticks_per_second_median': float(np.median(tick_rates)),
+        'frames_per_second_median': float(np.median(frame_rates)),
+        'ticks_per_second_runs': tick_rates,
+        'frames_per_second_runs': frame_rates,
+        'frame_ms': {'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99},
+        'phases': phases,
+        'peak_memory_mb': peak / (1024 * 1024),
+        'entities': entities
+    }
+
+def run_benchmarks(names=None, seed=0, repeat=5):
+    """依次运行多个基准测试场景（默认全部），画面绘制到内存中，不打开窗口"""
+    names = list(BENCHMARK_SCENARIOS) if not names else names
+    for name in names:
+        if name not in BENCHMARK_SCENARIOS:
+            raise ValueError(f"未知的基准测试场景: {name}")
+    pygame.display.quit()
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    return {
+        'version': 1,
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'pygame': pygame.version.ver,
+        'scenarios': {name: run_benchmark(name, seed, repeat) for name in names}
+    }
+
+def compare_benchmarks(results, baseline, threshold=0.1):
+    """与基线结果比较，返回变差超过threshold（相对变化）的指标列表（吞吐量是repeat次中最好的一次）"""
+    regressions = []
+    for name, result in results['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if base is None:
+            continue
+        for metric, better in BENCHMARK_METRICS.items():
+            old, new = base.get(metric), result[metric]
+            if not old:
+                continue
+            change = (new - old) / old
+            if (change < -threshold) if better == 'higher' else (change > threshold):
+                regressions.append({'scenario': name, 'metric': metric, 'baseline': old,
+                                    'current': new, 'change': change})
+    return regressions
+
+def positive_float(text):
+    """argparse类型：正数"""
+    value = float(text)
+    if not value > 0:
+        raise argparse.ArgumentTypeError(f"必须是正数: {text}")
+    return value
+
+def positive_int(text):
+    """argparse类型：正整数"""
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"必须是正整数: {text}")
+    return value
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="四季树叶变化模拟")
+    parser.add_argument('--headless', action='store_true', help="无界面模式，按模拟时钟尽快运行")
+    parser.add_argument('--ticks', type=int, default=10000, help="无界面模式下运行的模拟步数")
+    parser.add_argument('--fps', type=int, default=60, help="目标帧率，0表示不限制（基准测试）")
+    parser.add_argument('--tick-rate', type=positive_float, default=None,
+                        help="每秒模拟步数，默认约24步；步长为1000/tick-rate毫秒，每步的位移、数量和概率"
+                             "按步长缩放，所以降低它只减少计算量，不改变动画速度")
+    parser.add_argument('--max-catchup', type=positive_int, default=5, help="每帧最多追赶的模拟步数")
+    parser.add_argument('--bench-leaves', action='store_true', help="测量叶子位置生成随树规模的耗时")
+    parser.add_argument('--bench', nargs='*', default=None, choices=list(BENCHMARK_SCENARIOS),
+                        help="运行基准测试场景（不指定时运行全部）")
+    parser.add_argument('--bench-output', default=None, help="把基准测试结果保存为JSON文件，可作为以后的基线")
+    parser.add_argument('--bench-repeat', type=positive_int, default=5,
+                        help="基准测试的计时部分重复的次数，吞吐量取最好的一次")
+    parser.add_argument('--baseline', default=None, help="与该JSON基线比较，有指标变差超过阈值时返回非零退出码")
+    parser.add_argument('--threshold', type=float, default=0.1, help="与基线比较时允许的相对变化，默认10%%")
+    parser.add_argument('--snapshot', default=None, help="快照文件：无界面模式结束时保存到这里，界面中按F5保存、F9恢复")
+    parser.add_argument('--snapshot-every', type=int, default=0, help="无界面模式每隔多少步保存一次快照")
+    parser.add_argument('--restore', default=None, help="从快照开始运行；与--bench一起使用时增加一个从该快照开始的场景")
+    parser.add_argument('--record', default=None, help="录制用户输入（按模拟步数），退出时保存到该JSON文件")
+    parser.add_argument('--replay', default=None, help="回放输入录制，默认不打开窗口并尽快运行")
+    parser.add_argument('--realtime', action='store_true', help="在窗口中按实际速度回放")
+    parser.add_argument('--render-ticks', type=parse_tick_ranges, default=None,
+                        help="快进回放时只绘制这些步数区间，例如 1000-1200,5000-5100")
+    parser.add_argument('--tree-seed', type=int, default=None, help="树形种子，相同种子的树几何会缓存复用")
+    parser.add_argument('--tree-shape', type=json.loads, default=None,
+                        help='覆盖部分树形参数(JSON)，例如 \'{"max_depth": 6, "leaf_density": 2}\'')
+    parser.add_argument('--dirty-rects', action='store_true', help="只重绘变化的区域，降低长时间运行时的CPU占用")
+    parser.add_argument('--sky-gradient', action='store_true', help="天空使用竖直渐变背景")
+    parser.add_argument('--stars', type=int, default=100, help="夜空中星星的数量")
+    parser.add_argument('--cloud-density', type=float, default=1.0, help="云量倍数，例如20表示阴天上百朵云")
+    parser.add_argument('--forest', type=int, default=0, help="背景森林中树的数量")
+    parser.add_argument('--profile', action='store_true', help="启动时显示性能面板（也可以按F3切换）")
+    parser.add_argument('--trace', default=None, help="记录性能追踪，按F4或退出时导出到该JSON文件")
+    parser.add_argument('--trace-buffer', type=positive_int, default=262144, help="性能追踪环形缓冲区保留的阶段数（计数器值另外保留同样多个）")
+    parser.add_argument('--ensemble', type=int, default=0, help="并行运行N次无界面模拟并汇总统计（使用--ticks步数）")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="主随机种子，相同种子的模拟完全可复现；集合模拟中每次模拟的种子由它派生")
+    parser.add_argument('--workers', type=positive_int, default=None, help="集合模拟的进程数，默认等于CPU核数")
+    parser.add_argument('--sample-every', type=positive_int, default=10, help="集合模拟每隔多少步采样一次")
+    parser.add_argument('--params', type=json.loads, default={},
+                        help='集合模拟覆盖的参数(JSON)，例如 \'{"days_per_season": 60}\'')
+    parser.add_argument('--output', default=None, help="把集合模拟的统计量和所有轨迹保存到.npz文件")
+    return parser.parse_args(argv)
+
 # 主程序入口
 if __name__ == "__main__":
+    args = parse_args()
+    if args.bench_leaves:
+        print(f"{'深度':>4} {'密度':>4} {'树枝':>6} {'叶子位置':>8} {'耗时(ms)':>9} {'位置/秒':>12}")
+        for row in benchmark_leaf_positions():
+            print(f"{row['depth']:>6} {row['density']:>6} {row['branches']:>8} {row['leaf_slots']:>12} "
+                  f"{row['seconds'] * 1000:>11.2f} {row['slots_per_second']:>14.0f}")
+        sys.exit()
+    if args.bench is not None:
+        names = args.bench or list(BENCHMARK_SCENARIOS)
+        if args.restore:
+            BENCHMARK_SCENARIOS['snapshot'] = snapshot_scenario(args.restore)
+            names.append('snapshot')
+        results = run_benchmarks(names, seed=args.seed or 0, repeat=args.bench_repeat)
+        print(f"{'场景':<20} {'步/秒':>9} {'帧/秒':>8} {'帧p95(ms)':>10} {'内存峰值(MB)':>12}")
+        for name, result in results['scenarios'].items():
+            print(f"{name:<22} {result['ticks_per_second']:>9.0f} {result['frames_per_second']:>9.1f} "
+                  f"{result['frame_ms']['p95_ms']:>11.2f} {result['peak_memory_mb']:>15.1f}")
+        if args.bench_output:
+            with open(args.bench_output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            print(f"已保存到 {args.bench_output}")
+        if args.baseline:
+            with open(args.baseline, encoding='utf-8') as f:
+                regressions = compare_benchmarks(results, json.load(f), args.threshold)
+            for item in regressions:
+                print(f"性能退化: {item['scenario']} {item['metric']} "
+                      f"{item['baseline']:.1f} -> {item['current']:.1f} ({item['change']:+.1%})")
+            if regressions:
+                sys.exit(1)
+            print(f"与基线相比没有超过{args.threshold:.0%}的退化")
+        sys.exit()
+    if args.ensemble:
+        configs = ensemble_configs(args.ensemble, args.ticks, seed=args.seed or 0, sample_every=args.sample_every,
+                                   tree_seed=args.tree_seed, params=args.params, tree_shape=args.tree_shape)
+        start = time.perf_counter()
+        summary = summarize_ensemble(run_ensemble(configs, args.workers), keep_traces=args.output is not None)
+        elapsed = time.perf_counter() - start
+        total = args.ensemble * args.ticks
+        print(f"集合模拟完成: {summary['runs']} 次 x {args.ticks} 步, 用时 {elapsed:.2f} 秒 "
+              f"({total / max(elapsed, 1e-9):.0f} 步/秒)")
+        print(f"最终叶子数: {summary['final_leaf_mean']:.1f} ± {summary['final_leaf_std']:.1f}")
+        if summary['runs']:
+            print(f"平均温度: {summary['temperature_mean'].mean():.1f}°, 平均湿度: {summary['humidity_mean'].mean():.1f}%")
+            print("天气时间占比: " + ", ".join(f"{name} {share:.1%}" for name, share in
+                                          zip(["晴朗", "多云", "雨", "雪", "雷暴"], summary['weather_share'])))
+        if args.output:
+            save_npz(args.output, **summary)
+            print(f"已保存到 {args.output}")
+        sys.exit()
+    options = {
+        'seed': args.seed,
+        'tree_seed': args.tree_seed,
+        'tree_shape': args.tree_shape,
+        'stars': args.stars,
+        'cloud_density': args.cloud_density,
+        'forest': args.forest,
+        'restore': os.path.abspath(args.restore) if args.restore else None,
+        'tick_rate': args.tick_rate
+    }
+    recording = None
+    if args.replay:
+        recording = load_recording(args.replay)
+        options = recording['options']
+    if recording and not args.realtime:
+        # 快进回放：不指定--render-ticks时不打开窗口
+        tree = create_tree(options, headless=not args.render_ticks)
+        tree.verbose = False
+        tree.start_replay(recording)
+        start = time.perf_counter()
+        completed = tree.fast_forward(recording['end_tick'], args.render_ticks or ())
+        elapsed = time.perf_counter() - start
+        ticks = tree.tick_count - recording['start_tick']
+        print(f"回放 {len(recording['commands'])} 条命令, {ticks} 步, 用时 {elapsed:.2f} 秒 "
+              f"({ticks / max(elapsed, 1e-9):.0f} 步/秒)")
+        if completed:
+            same = tree.state_digest() == recording['state_digest']
+            print("回放结果与录制一致" if same else "回放结果与录制不一致")
+        pygame.quit()
+        sys.exit(0 if not completed or same else 1)
+    if args.headless:
+        tree = create_tree(options, headless=True)
+        if args.trace:
+            tree.start_trace(args.trace, args.trace_buffer)
+        first_tick = tree.tick_count
+        start = time.perf_counter()
+        if args.snapshot and args.snapshot_every > 0:
+            # 长时间运行时定期保存快照，中断后可以用--restore继续
+            for done in range(0, args.ticks, args.snapshot_every):
+                tree.simulate(min(args.snapshot_every, args.ticks - done))
+                tree.save_snapshot(args.snapshot)
+        else:
+            tree.simulate(args.ticks)
+        elapsed = time.perf_counter() - start
+        ticks = tree.tick_count - first_tick
+        print(f"无界面模拟完成: {ticks} 步, 用时 {elapsed:.2f} 秒 "
+              f"({ticks / max(elapsed, 1e-9):.0f} 步/秒)")
+        print(f"季节: {tree.seasons[tree.current_season]}, 第 {tree.current_day} 天, "
+              f"天气: {tree.weather_conditions[tree.current_weather]}, 叶子: {len(tree.leaf_slots)}")
+        if args.trace:
+            tree.dump_trace()
+        if args.snapshot:
+            tree.save_snapshot(args.snapshot)
+            print(f"已保存快照: {args.snapshot}")
+        sys.exit()
     try:
         print("启动四季树叶模拟器：展示春夏秋冬季节变化")
         print("空格键增加风力,R键重置风力,W键改变天气,点击树干使叶子掉落")
-        tree = SeasonalTree()
+        tree = create_tree(options)
+        tree.target_fps = args.fps
+        tree.max_catchup_steps = args.max_catchup
+        if args.dirty_rects:
+            tree.render_mode = 'dirty'
+        tree.sky_gradient = args.sky_gradient
+        tree.show_profiler = args.profile
+        if args.snapshot:
+            tree.snapshot_path = args.snapshot
+        if args.trace:
+            tree.start_trace(args.trace, args.trace_buffer)
+        if recording:
+            tree.start_replay(recording)
+        elif args.record:
+            tree.start_recording(args.record, options)
         tree.run()
     except Exception as e:
         print(f"程序出错: {str(e)}")
@@ -0,0 +1,31 @@
+import os
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import numpy as np
+import pygame
+
+import AIAgentTree
+
+RAIN_COLOR = (200, 200, 250)
+
+
+def rain_pixels(surface):
+    """画面中雨滴颜色的像素数"""
+    pixels = pygame.surfarray.pixels3d(surface)
+    return int(np.count_nonzero(np.all(pixels == RAIN_COLOR, axis=-1)))
+
+
+def test_thunderstorm_draws_rain():
+    tree = AIAgentTree.build_benchmark_tree('thunderstorm', headless=False)
+    assert tree.current_weather == 4
+    assert len(tree.raindrops) > 0
+
+    tree.screen.fill((0, 0, 0))
+    tree.draw_weather()
+    assert rain_pixels(tree.screen) > 1000
+
+    tree.raindrops.clear()
+    tree.screen.fill((0, 0, 0))
+    tree.draw_weather()
+    assert rain_pixels(tree.screen) == 0
@@ -0,0 +1,36 @@
+import os
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import numpy as np
+import pygame
+
+import AIAgentTree
+
+
+def render(tree):
+    """绘制一帧并返回像素"""
+    tree.welcome_lines = None
+    tree.render_alpha = 1.0
+    tree.draw()
+    return pygame.surfarray.array3d(tree.screen)
+
+
+def test_round_trip_restores_state_and_frame(tmp_path):
+    tree = AIAgentTree.SeasonalTree(tree_seed=1, seed=1)
+    tree.verbose = False
+    tree.change_weather(1)
+    tree.simulate(200)
+    path = str(tmp_path / 'state.npz')
+    tree.save_snapshot(path)
+
+    restored = AIAgentTree.SeasonalTree(tree_seed=2, seed=2)
+    restored.verbose = False
+    restored.load_snapshot(path)
+    assert restored.state_digest() == tree.state_digest()
+    assert np.array_equal(render(restored), render(tree))
+
+    tree.simulate(100)
+    restored.simulate(100)
+    assert restored.state_digest() == tree.state_digest()
+    assert np.array_equal(render(restored), render(tree))